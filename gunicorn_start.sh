@@ -19,6 +19,7 @@ GROUP=`whoami`                                  # the group to run as (*)
 NUM_WORKERS=3                                   # how many worker processes should Gunicorn spawn (*)
                                                 # NUM_WORKERS = 2 * CPUS + 1
 TIMEOUT=60
+WORKER_CLASS=${GUNICORN_WORKER_CLASS:-sync}     # gevent/eventlet para o canal SSE do painel (PAINEL_STREAM)
 MAX_REQUESTS=100                                # number of requests before restarting worker
 DJANGO_SETTINGS_MODULE=sapl.settings            # which settings file should Django use (*)
 DJANGO_WSGI_MODULE=sapl.wsgi                    # WSGI module name (*)
@@ -45,6 +46,7 @@ exec gunicorn ${DJANGO_WSGI_MODULE}:application \
   --log-level debug \
   --timeout $TIMEOUT \
   --workers $NUM_WORKERS \
+  --worker-class $WORKER_CLASS \
   --max-requests $MAX_REQUESTS \
   --user $USER \
   --access-logfile /var/log/sapl/access.log \
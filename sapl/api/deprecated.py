@@ -24,7 +24,7 @@ from rest_framework.viewsets import GenericViewSet
 
 from sapl.api.serializers import ModelChoiceSerializer, AutorSerializer,\
     ChoiceSerializer
-from sapl.base.models import TipoAutor, Autor, CasaLegislativa
+from sapl.base.models import TipoAutor, Autor, cache_configuracao
 from sapl.materia.models import MateriaLegislativa
 from sapl.parlamentares.models import Legislatura
 from sapl.sessao.models import SessaoPlenaria, OrdemDia
@@ -380,7 +380,7 @@ class SessaoPlenariaOldSerializer(serializers.ModelSerializer):
         return self.casa().nome
 
     def casa(self):
-        casa = CasaLegislativa.objects.first()
+        casa = cache_configuracao.casa_legislativa()
         return casa
 
 
@@ -1,18 +1,30 @@
 from datetime import datetime as dt
+from datetime import timedelta
 import logging
 
 from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.template import Context, loader
 from django.utils import timezone
 
-from sapl.base.models import CasaLegislativa
+from sapl.base.models import MensagemEmail, cache_configuracao
 from sapl.materia.models import AcompanhamentoMateria
 from sapl.protocoloadm.models import AcompanhamentoDocumento
 from sapl.settings import EMAIL_SEND_USER
 from sapl.utils import mail_service_configured
 from django.utils.translation import ugettext_lazy as _
 
+# Fila de envio: mensagens por execução do envio e número máximo de
+# tentativas; a espera (em segundos) dobra a cada nova falha.
+EMAILS_POR_LOTE = 100
+MAX_TENTATIVAS_EMAIL = 5
+ESPERA_REENVIO_EMAIL = 60
+DIAS_RETENCAO_EMAIL = 30
+
+# Substituído pelo hash de cada destinatário nos e-mails de tramitação
+MARCADOR_HASH_EMAIL = 'SAPLHASHDESTINATARIO'
+
 
 def load_email_templates(templates, context={}):
 
@@ -204,9 +216,19 @@ def criar_email_tramitacao(base_url, casa_legislativa, tipo, doc_mat, status,
     return templates
 
 
+def cria_mensagem_email(assunto, texto, html, destinatario,
+                        remetente=EMAIL_SEND_USER):
+    return MensagemEmail(remetente=remetente,
+                         destinatario=destinatario,
+                         assunto=assunto,
+                         texto=texto,
+                         html=html)
+
+
 def do_envia_email_tramitacao(base_url, tipo, doc_mat, status, unidade_destino):
     #
-    # Envia email de tramitacao para usuarios cadastrados
+    # Inclui na fila de envio os emails de tramitacao para usuarios
+    # cadastrados. O envio é feito pelo comando envia_emails
     #
 
     logger = logging.getLogger(__name__)
@@ -225,9 +247,8 @@ def do_envia_email_tramitacao(base_url, tipo, doc_mat, status, unidade_destino):
         logger.debug(_('Não existem destinatários cadastrados para essa matéria.'))
         return
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
-    sender = EMAIL_SEND_USER
     # FIXME i18nn
     if tipo == "materia":
         msg = " - Acompanhamento de Matéria Legislativa"
@@ -235,33 +256,129 @@ def do_envia_email_tramitacao(base_url, tipo, doc_mat, status, unidade_destino):
         msg = " - Acompanhamento de Documento"
     subject = "[SAPL] {} {}".format(str(doc_mat), msg)
 
-    connection = get_connection()
-    connection.open()
-
+    # O corpo é o mesmo para todos os destinatários, exceto pelo hash de
+    # exclusão do acompanhamento: renderiza uma única vez com um marcador
+    # e o substitui pelo hash de cada destinatário.
+    email_texts = criar_email_tramitacao(base_url,
+                                         casa,
+                                         tipo,
+                                         doc_mat,
+                                         status,
+                                         unidade_destino,
+                                         MARCADOR_HASH_EMAIL)
+
+    mensagens = []
     for destinatario in destinatarios:
+        texto, html = [t.replace(MARCADOR_HASH_EMAIL, destinatario.hash)
+                       for t in email_texts]
+        mensagens.append(cria_mensagem_email(subject,
+                                             texto,
+                                             html,
+                                             destinatario.email))
+
+    MensagemEmail.objects.bulk_create(mensagens)
+
+
+def do_envia_email_tramitacao_em_lote(base_url, tipo, tramitacoes):
+    #
+    # Inclui na fila de envio os emails de tramitacao em lote, na mesma
+    # transação que criou as tramitações
+    #
+
+    for tramitacao in tramitacoes:
+        doc_mat = tramitacao.materia if tipo == "materia" \
+            else tramitacao.documento
+        do_envia_email_tramitacao(base_url,
+                                  tipo,
+                                  doc_mat,
+                                  tramitacao.status,
+                                  tramitacao.unidade_tramitacao_destino)
+
+
+def registra_erro_envio(mensagem, erro, max_tentativas):
+    '''
+    Registra a falha de envio da mensagem, reagendando-a com espera
+    exponencial ou marcando-a como falha ao atingir max_tentativas.
+    '''
+    logger = logging.getLogger(__name__)
+    mensagem.tentativas += 1
+    mensagem.ultimo_erro = str(erro)
+    if mensagem.tentativas >= max_tentativas:
+        mensagem.status = MensagemEmail.FALHOU
+        logger.error('Falha definitiva ao enviar e-mail para {}: {}'.format(
+            mensagem.destinatario, str(erro)))
+    else:
+        mensagem.proximo_envio = timezone.now() + timedelta(
+            seconds=ESPERA_REENVIO_EMAIL * 2 ** (mensagem.tentativas - 1))
+
+
+def envia_emails_pendentes(lote=EMAILS_POR_LOTE,
+                           max_tentativas=MAX_TENTATIVAS_EMAIL):
+    '''
+    Envia até `lote` mensagens pendentes da fila usando uma única conexão
+    SMTP. Mensagens com erro, inclusive quando não é possível conectar ao
+    servidor, são reagendadas com espera exponencial até atingirem
+    max_tentativas, quando passam a constar como falhas.
+    Retorna a quantidade de mensagens enviadas e a de erros.
+    '''
+    logger = logging.getLogger(__name__)
+    enviadas = erros = 0
+    campos = ['status', 'tentativas', 'ultimo_erro', 'proximo_envio',
+              'enviada_em']
+
+    with transaction.atomic():
+        mensagens = list(MensagemEmail.objects.select_for_update(
+            skip_locked=True).filter(
+            status=MensagemEmail.PENDENTE,
+            proximo_envio__lte=timezone.now())[:lote])
+
+        if not mensagens:
+            return enviadas, erros
+
+        conexao = get_connection()
         try:
-            email_texts = criar_email_tramitacao(base_url,
-                                                 casa,
-                                                 tipo,
-                                                 doc_mat,
-                                                 status,
-                                                 unidade_destino,
-                                                 destinatario.hash)
-
-            email = EmailMultiAlternatives(
-                subject,
-                email_texts[0],
-                sender,
-                [destinatario.email],
-                connection=connection)
-            email.attach_alternative(email_texts[1], "text/html")
-            email.send()
-
-        # Garantia de que, mesmo com o lançamento de qualquer exceção,
-        # a conexão será fechada
-        except Exception:
-            connection.close()
-            raise Exception(
-                'Erro ao enviar e-mail de acompanhamento de matéria.')
-
-    connection.close()
+            conexao.open()
+        except Exception as e:
+            logger.error('Erro ao conectar ao servidor de e-mail: {}'.format(
+                str(e)))
+            for mensagem in mensagens:
+                registra_erro_envio(mensagem, e, max_tentativas)
+                mensagem.save(update_fields=campos)
+            return enviadas, len(mensagens)
+
+        try:
+            for mensagem in mensagens:
+                email = EmailMultiAlternatives(mensagem.assunto,
+                                               mensagem.texto,
+                                               mensagem.remetente,
+                                               [mensagem.destinatario],
+                                               connection=conexao)
+                if mensagem.html:
+                    email.attach_alternative(mensagem.html, "text/html")
+
+                try:
+                    email.send()
+                except Exception as e:
+                    erros += 1
+                    registra_erro_envio(mensagem, e, max_tentativas)
+                else:
+                    enviadas += 1
+                    mensagem.tentativas += 1
+                    mensagem.status = MensagemEmail.ENVIADA
+                    mensagem.enviada_em = timezone.now()
+                    mensagem.ultimo_erro = ''
+                mensagem.save(update_fields=campos)
+        finally:
+            conexao.close()
+
+    return enviadas, erros
+
+
+def remove_emails_enviados(dias=DIAS_RETENCAO_EMAIL):
+    '''
+    Remove da fila as mensagens enviadas há mais de `dias` dias.
+    Retorna a quantidade de mensagens removidas.
+    '''
+    return MensagemEmail.objects.filter(
+        status=MensagemEmail.ENVIADA,
+        enviada_em__lt=timezone.now() - timedelta(days=dias)).delete()[0]
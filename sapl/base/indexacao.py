@@ -0,0 +1,269 @@
+from collections import OrderedDict
+from datetime import timedelta
+from hashlib import sha1
+from multiprocessing import Pool
+import logging
+import os.path
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections as db_connections
+from django.db.models import signals
+from django.utils import timezone
+from haystack import connections
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+
+from sapl.base.models import FilaIndexacao, TextoExtraido
+
+logger = logging.getLogger(__name__)
+
+MAX_TENTATIVAS_INDEXACAO = 5
+ESPERA_REINDEXACAO = 60
+
+
+class FilaSignalProcessor(BaseSignalProcessor):
+    '''
+    Em vez de indexar o objeto durante o save, como o
+    RealtimeSignalProcessor, apenas o inclui na fila de indexação, que é
+    processada em lote pelo comando atualiza_indice.
+    '''
+
+    def setup(self):
+        signals.post_save.connect(self.handle_save)
+        signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        signals.post_save.disconnect(self.handle_save)
+        signals.post_delete.disconnect(self.handle_delete)
+
+    def indexado(self, sender):
+        try:
+            self.connections['default'].get_unified_index().get_index(sender)
+        except NotHandled:
+            return False
+        return True
+
+    def handle_save(self, sender, instance, **kwargs):
+        if self.indexado(sender):
+            enfileira(instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if self.indexado(sender):
+            enfileira(instance, remover=True)
+
+
+def enfileira(instance, remover=False):
+    FilaIndexacao.objects.create(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=instance.pk,
+        remover=remover)
+
+
+def enfileira_todos(index):
+    '''
+    Inclui na fila todos os objetos do index, para a reindexação completa.
+    '''
+    model = index.get_model()
+    content_type = ContentType.objects.get_for_model(model)
+    total = 0
+    pks = index.index_queryset().order_by('pk').values_list('pk', flat=True)
+    for inicio in range(0, pks.count(), 1000):
+        itens = [FilaIndexacao(content_type=content_type, object_id=pk)
+                 for pk in pks[inicio:inicio + 1000]]
+        FilaIndexacao.objects.bulk_create(itens)
+        total += len(itens)
+    return total
+
+
+def hash_arquivo(caminho):
+    h = sha1()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def extrai_texto(caminho):
+    '''
+    Extrai o texto do arquivo pelo extract handler do Solr. Retorna None
+    quando a extração falha, para que o resultado não seja guardado.
+    '''
+    backend = connections['default'].get_backend()
+    try:
+        with open(caminho, 'rb') as f:
+            content = backend.extract_file_contents(f)
+    except Exception as e:
+        logger.error('Erro extraindo texto do arquivo {}: {}'.format(
+            caminho, str(e)))
+        return None
+    if not content or not content['contents']:
+        return ''
+    return content['contents']
+
+
+def caminho_e_hash(caminho):
+    return caminho, hash_arquivo(caminho)
+
+
+def extrai(args):
+    caminho, hash = args
+    return hash, extrai_texto(caminho)
+
+
+def arquivos_indexados(index, obj):
+    '''
+    Caminhos dos arquivos de obj cujo texto é extraído pelo index.
+    '''
+    caminhos = []
+    for attr, func in index.text.model_attr:
+        if func != 'file_extractor':
+            continue
+        arquivo = getattr(obj, attr, None)
+        if arquivo and os.path.exists(arquivo.path) and \
+                os.path.splitext(arquivo.path)[1][:1]:
+            caminhos.append(arquivo.path)
+    return caminhos
+
+
+class PipelineIndexacao:
+    '''
+    Processa a fila de indexação em lotes: os arquivos dos objetos do lote
+    são identificados pelo hash e somente os que ainda não constam em
+    TextoExtraido são enviados ao Solr para extração, em paralelo num pool
+    de processos. Cada lote é enviado ao Solr sem commit e confirmado de
+    uma só vez; os itens da fila só são removidos após o envio, de modo que
+    uma execução interrompida continua de onde parou.
+
+    Objetos com arquivos cuja extração falhou não são indexados: continuam
+    na fila e são tentados novamente com espera exponencial, até
+    MAX_TENTATIVAS_INDEXACAO tentativas, quando são indexados sem o texto
+    desses arquivos.
+    '''
+
+    def __init__(self, processos=None):
+        self.backend = connections['default'].get_backend()
+        self.unified_index = connections['default'].get_unified_index()
+        self.processos = processos or os.cpu_count()
+        self.pool = None
+        self.indexados = self.removidos = self.adiados = 0
+        self.extraidos = self.aproveitados = 0
+
+    def __enter__(self):
+        # Os processos filhos não devem herdar as conexões com o banco
+        db_connections.close_all()
+        self.pool = Pool(self.processos)
+        return self
+
+    def __exit__(self, *args):
+        self.pool.close()
+        self.pool.join()
+
+    def textos(self, caminhos):
+        '''
+        Texto de cada caminho; None para os arquivos cuja extração falhou.
+        '''
+        if not caminhos:
+            return {}
+
+        hashes = dict(self.pool.map(caminho_e_hash, caminhos))
+        conhecidos = dict(TextoExtraido.objects.filter(
+            hash__in=set(hashes.values())).values_list('hash', 'texto'))
+
+        faltantes = OrderedDict()
+        for caminho, hash in hashes.items():
+            if hash not in conhecidos and hash not in faltantes:
+                faltantes[hash] = caminho
+
+        self.aproveitados += len(caminhos) - len(faltantes)
+        self.extraidos += len(faltantes)
+
+        for hash, texto in self.pool.map(
+                extrai, [(c, h) for h, c in faltantes.items()]):
+            conhecidos[hash] = texto
+            if texto is not None:
+                # outro processo pode ter extraído o mesmo arquivo
+                TextoExtraido.objects.get_or_create(
+                    hash=hash, defaults={'texto': texto})
+
+        return {caminho: conhecidos[hash] for caminho, hash in hashes.items()}
+
+    def processa_lote(self, lote):
+        itens = list(FilaIndexacao.objects.filter(
+            proxima_tentativa__lte=timezone.now())[:lote])
+        if not itens:
+            return 0
+
+        # Apenas o último evento de cada objeto no lote é considerado
+        ultimos = OrderedDict()
+        for item in itens:
+            ultimos[(item.content_type_id, item.object_id)] = item
+
+        por_tipo = OrderedDict()
+        for (content_type_id, object_id), item in ultimos.items():
+            por_tipo.setdefault(content_type_id, {})[object_id] = item
+
+        adiados = []
+        for content_type_id, objetos in por_tipo.items():
+            model = ContentType.objects.get_for_id(
+                content_type_id).model_class()
+            index = self.unified_index.get_index(model)
+
+            objs = list(index.index_queryset().filter(pk__in=[
+                pk for pk, item in objetos.items() if not item.remover]))
+
+            for pk in set(objetos) - {obj.pk for obj in objs}:
+                self.backend.remove('{}.{}.{}'.format(
+                    model._meta.app_label, model._meta.model_name, pk),
+                    commit=False)
+                self.removidos += 1
+
+            if not objs:
+                continue
+
+            arquivos = {obj.pk: arquivos_indexados(index, obj)
+                        for obj in objs}
+            textos = self.textos(
+                [c for caminhos in arquivos.values() for c in caminhos])
+
+            indexar = []
+            for obj in objs:
+                item = objetos[obj.pk]
+                if item.tentativas + 1 < MAX_TENTATIVAS_INDEXACAO and any(
+                        textos[c] is None for c in arquivos[obj.pk]):
+                    adiados.append(item)
+                else:
+                    indexar.append(obj)
+
+            if indexar:
+                index.text.textos = {c: t or '' for c, t in textos.items()}
+                try:
+                    self.backend.update(index, indexar, commit=False)
+                finally:
+                    index.text.textos = {}
+                self.indexados += len(indexar)
+
+        self.backend.conn.commit()
+
+        for item in adiados:
+            item.tentativas += 1
+            item.proxima_tentativa = timezone.now() + timedelta(
+                seconds=ESPERA_REINDEXACAO * 2 ** (item.tentativas - 1))
+            item.save(update_fields=['tentativas', 'proxima_tentativa'])
+        self.adiados += len(adiados)
+
+        FilaIndexacao.objects.filter(id__in=[
+            item.id for item in itens]).exclude(
+            id__in=[item.id for item in adiados]).delete()
+
+        return len(itens)
+
+    def processa(self, lote):
+        inicio = time.time()
+        total = 0
+        while True:
+            processados = self.processa_lote(lote)
+            total += processados
+            if processados < lote:
+                break
+        return total, time.time() - inicio
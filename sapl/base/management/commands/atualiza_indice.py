@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from haystack import connections
+
+from sapl.base.indexacao import PipelineIndexacao, enfileira_todos
+
+
+class Command(BaseCommand):
+
+    help = 'Atualiza o índice textual a partir da fila de indexação, ' \
+        'extraindo os textos dos arquivos em paralelo. Pode ser ' \
+        'interrompido e executado novamente sem perda do que já foi feito'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos', dest='todos', action='store_true', default=False,
+            help='Inclui todos os objetos indexáveis na fila antes de '
+            'processá-la (reindexação completa)')
+        parser.add_argument(
+            '--lote', dest='lote', type=int, default=100,
+            help='Quantidade de itens da fila confirmados no Solr por vez')
+        parser.add_argument(
+            '--processos', dest='processos', type=int, default=None,
+            help='Processos usados na extração de textos')
+        parser.add_argument(
+            '--intervalo', dest='intervalo', type=int, default=0,
+            help='Permanece em execução, verificando a fila a cada '
+            'intervalo de segundos')
+
+    def handle(self, *args, **options):
+        if options['todos']:
+            unified_index = connections['default'].get_unified_index()
+            for model in unified_index.get_indexed_models():
+                total = enfileira_todos(unified_index.get_index(model))
+                self.stdout.write('{}: {} objetos incluídos na fila'.format(
+                    model._meta.verbose_name_plural, total))
+
+        with PipelineIndexacao(options['processos']) as pipeline:
+            while True:
+                total, duracao = pipeline.processa(options['lote'])
+                if total or not options['intervalo']:
+                    self.relatorio(pipeline, total, duracao)
+                if not options['intervalo']:
+                    break
+                time.sleep(options['intervalo'])
+
+    def relatorio(self, pipeline, total, duracao):
+        self.stdout.write(
+            'Itens da fila processados: {} em {:.1f}s ({:.1f} itens/s)\n'
+            'Objetos indexados: {}\nObjetos removidos: {}\n'
+            'Objetos adiados por falha na extração: {}\n'
+            'Arquivos extraídos: {}\nArquivos aproveitados do cache: {}'.format(
+                total, duracao, total / duracao if duracao else 0,
+                pipeline.indexados, pipeline.removidos, pipeline.adiados,
+                pipeline.extraidos, pipeline.aproveitados))
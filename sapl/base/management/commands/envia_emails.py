@@ -0,0 +1,68 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from sapl.base.email_utils import (DIAS_RETENCAO_EMAIL, EMAILS_POR_LOTE,
+                                   MAX_TENTATIVAS_EMAIL,
+                                   envia_emails_pendentes,
+                                   remove_emails_enviados)
+
+
+class Command(BaseCommand):
+
+    help = 'Envia os e-mails pendentes da fila de envio, em lotes, ' \
+        'reutilizando uma conexão SMTP por lote, e remove da fila as ' \
+        'mensagens enviadas há mais de --retencao dias'
+
+    logger = logging.getLogger(__name__)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', dest='lote', type=int, default=EMAILS_POR_LOTE,
+            help='Quantidade de mensagens enviadas por conexão')
+        parser.add_argument(
+            '--tentativas', dest='tentativas', type=int,
+            default=MAX_TENTATIVAS_EMAIL,
+            help='Número de tentativas antes de marcar a mensagem como falha')
+        parser.add_argument(
+            '--retencao', dest='retencao', type=int,
+            default=DIAS_RETENCAO_EMAIL,
+            help='Dias durante os quais as mensagens enviadas são mantidas')
+        parser.add_argument(
+            '--intervalo', dest='intervalo', type=int, default=0,
+            help='Permanece em execução, verificando a fila a cada '
+            'intervalo de segundos')
+
+    def envia(self, lote, tentativas, retencao):
+        total_enviadas = total_erros = 0
+        while True:
+            enviadas, erros = envia_emails_pendentes(lote, tentativas)
+            total_enviadas += enviadas
+            total_erros += erros
+            if enviadas + erros < lote:
+                break
+        return total_enviadas, total_erros, remove_emails_enviados(retencao)
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                enviadas, erros, removidas = self.envia(
+                    options['lote'], options['tentativas'],
+                    options['retencao'])
+            except Exception as e:
+                # em execução contínua, uma falha não deve encerrar o envio
+                if not options['intervalo']:
+                    raise
+                self.logger.error('Erro ao processar a fila de e-mails: '
+                                  '{}'.format(str(e)))
+            else:
+                if enviadas or erros or removidas or \
+                        not options['intervalo']:
+                    self.stdout.write(
+                        'Enviadas: {}\nErros: {}\nRemovidas: {}'.format(
+                            enviadas, erros, removidas))
+
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from sapl.base.models import cache_configuracao
+
+
+class Command(BaseCommand):
+
+    help = 'Exibe a taxa de acerto do cache de CasaLegislativa e AppConfig ' \
+        'acumulada por todos os workers'
+
+    def handle(self, *args, **options):
+        estatisticas = cache_configuracao.estatisticas()
+        self.stdout.write(
+            'Acertos: {acertos}\nFalhas: {falhas}\n'
+            'Taxa de acerto: {taxa_acerto:.2%}'.format(**estatisticas))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sapl.base.views import verifica_inconsistencias
+
+
+class Command(BaseCommand):
+
+    help = 'Executa as verificações de inconsistências da base de dados ' \
+        'e guarda o resultado exibido na Lista de Inconsistências'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo', dest='intervalo', type=int, default=0,
+            help='Permanece em execução, repetindo as verificações a cada '
+            'intervalo de segundos')
+
+    def handle(self, *args, **options):
+        while True:
+            resultado = verifica_inconsistencias()
+            for nome, titulo, ids in resultado['inconsistencias']:
+                self.stdout.write('{}: {}'.format(titulo, len(ids)))
+
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0032_merge_20190219_0941'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensagemEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('remetente', models.CharField(max_length=254, verbose_name='Remetente')),
+                ('destinatario', models.EmailField(max_length=254, verbose_name='Destinatário')),
+                ('assunto', models.CharField(max_length=255, verbose_name='Assunto')),
+                ('texto', models.TextField(verbose_name='Texto')),
+                ('html', models.TextField(blank=True, verbose_name='HTML')),
+                ('status', models.CharField(choices=[('P', 'Pendente'), ('E', 'Enviada'), ('F', 'Falhou')], default='P', max_length=1, verbose_name='Status')),
+                ('tentativas', models.PositiveIntegerField(default=0, verbose_name='Tentativas')),
+                ('ultimo_erro', models.TextField(blank=True, verbose_name='Último erro')),
+                ('criada_em', models.DateTimeField(auto_now_add=True, verbose_name='Criada em')),
+                ('proximo_envio', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Próximo envio')),
+                ('enviada_em', models.DateTimeField(blank=True, null=True, verbose_name='Enviada em')),
+            ],
+            options={
+                'verbose_name': 'Mensagem de E-mail',
+                'verbose_name_plural': 'Mensagens de E-mail',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='mensagememail',
+            index_together=set([('status', 'proximo_envio')]),
+        ),
+    ]
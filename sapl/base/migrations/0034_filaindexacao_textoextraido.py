@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('base', '0033_mensagememail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilaIndexacao',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('remover', models.BooleanField(default=False)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'verbose_name': 'Objeto a Indexar',
+                'verbose_name_plural': 'Fila de Indexação',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='TextoExtraido',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=40, unique=True)),
+                ('texto', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Texto Extraído',
+                'verbose_name_plural': 'Textos Extraídos',
+            },
+        ),
+    ]
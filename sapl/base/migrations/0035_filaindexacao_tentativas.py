@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0034_filaindexacao_textoextraido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filaindexacao',
+            name='tentativas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='filaindexacao',
+            name='proxima_tentativa',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,12 +1,14 @@
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
 from django.db.models.signals import post_migrate
 from django.db.utils import DEFAULT_DB_ALIAS
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 import reversion
 
-from sapl.utils import (LISTA_DE_UFS, YES_NO_CHOICES,
+from sapl.utils import (LISTA_DE_UFS, YES_NO_CHOICES, CacheVersionado,
                         get_settings_auth_user_model, models_with_gr_for_model)
 
 DOC_ADM_OSTENSIVO = 'O'
@@ -179,17 +181,164 @@ class AppConfig(models.Model):
 
     @classmethod
     def attr(cls, attr):
-        config = AppConfig.objects.first()
+        return getattr(cache_configuracao.app_config(), attr)
+
+    def __str__(self):
+        return _('Configurações da Aplicação - %(id)s') % {
+            'id': self.id}
+
+
+class CacheConfiguracao(CacheVersionado):
+    '''
+    Mantém em memória a CasaLegislativa e a AppConfig, consultadas em
+    praticamente toda requisição. Os dados são recarregados em todos os
+    workers quando qualquer um dos dois é salvo ou excluído.
 
+    Acertos (leituras servidas da memória) e falhas (leituras que exigiram
+    consulta ao banco) são contados por processo e acumulados no cache
+    compartilhado a cada verificação de versão; veja estatisticas().
+    '''
+    CHAVE_VERSAO = 'sapl_configuracao_versao'
+    CHAVE_ACERTOS = 'sapl_configuracao_acertos'
+    CHAVE_FALHAS = 'sapl_configuracao_falhas'
+
+    def __init__(self):
+        super().__init__()
+        self.casa = None
+        self.config = None
+        self.acertos = 0
+        self.falhas = 0
+
+    def carregar(self):
+        self.casa = CasaLegislativa.objects.first()
+
+        config = AppConfig.objects.first()
         if not config:
             config = AppConfig()
             config.save()
+        self.config = config
+
+    def versao_verificada(self):
+        for chave, valor in ((self.CHAVE_ACERTOS, self.acertos),
+                             (self.CHAVE_FALHAS, self.falhas)):
+            if valor and not cache.add(chave, valor, None):
+                try:
+                    cache.incr(chave, valor)
+                except ValueError:
+                    cache.set(chave, valor, None)
+        self.acertos = self.falhas = 0
+
+    def obter(self):
+        if self.atualizar():
+            self.falhas += 1
+        else:
+            self.acertos += 1
+
+    def casa_legislativa(self):
+        self.obter()
+        return self.casa
+
+    def app_config(self):
+        self.obter()
+        return self.config
+
+    def estatisticas(self):
+        '''
+        Totais de acertos e falhas acumulados por todos os workers.
+        '''
+        acertos = cache.get(self.CHAVE_ACERTOS, 0) + self.acertos
+        falhas = cache.get(self.CHAVE_FALHAS, 0) + self.falhas
+        total = acertos + falhas
+        return {'acertos': acertos,
+                'falhas': falhas,
+                'taxa_acerto': acertos / total if total else 0}
+
+
+cache_configuracao = CacheConfiguracao()
+
+
+class MensagemEmail(models.Model):
+    '''
+    Fila persistente de e-mails a enviar. As mensagens são incluídas pela
+    aplicação e enviadas pelo comando envia_emails, que registra o
+    resultado de cada envio e reagenda as falhas.
+    '''
+    PENDENTE = 'P'
+    ENVIADA = 'E'
+    FALHOU = 'F'
+
+    STATUS_CHOICES = ((PENDENTE, _('Pendente')),
+                      (ENVIADA, _('Enviada')),
+                      (FALHOU, _('Falhou')))
+
+    remetente = models.CharField(max_length=254, verbose_name=_('Remetente'))
+    destinatario = models.EmailField(
+        max_length=254, verbose_name=_('Destinatário'))
+    assunto = models.CharField(max_length=255, verbose_name=_('Assunto'))
+    texto = models.TextField(verbose_name=_('Texto'))
+    html = models.TextField(blank=True, verbose_name=_('HTML'))
+
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=PENDENTE,
+        verbose_name=_('Status'))
+    tentativas = models.PositiveIntegerField(
+        default=0, verbose_name=_('Tentativas'))
+    ultimo_erro = models.TextField(blank=True, verbose_name=_('Último erro'))
+    criada_em = models.DateTimeField(
+        auto_now_add=True, verbose_name=_('Criada em'))
+    proximo_envio = models.DateTimeField(
+        default=timezone.now, verbose_name=_('Próximo envio'))
+    enviada_em = models.DateTimeField(
+        blank=True, null=True, verbose_name=_('Enviada em'))
 
-        return getattr(config, attr)
+    class Meta:
+        verbose_name = _('Mensagem de E-mail')
+        verbose_name_plural = _('Mensagens de E-mail')
+        ordering = ('id',)
+        index_together = (('status', 'proximo_envio'),)
 
     def __str__(self):
-        return _('Configurações da Aplicação - %(id)s') % {
-            'id': self.id}
+        return '{} - {}'.format(self.destinatario, self.assunto)
+
+
+class FilaIndexacao(models.Model):
+    '''
+    Objetos alterados ou excluídos que aguardam atualização no índice
+    textual. A fila é processada pelo comando atualiza_indice; objetos
+    cujos arquivos não puderam ser extraídos permanecem na fila e são
+    tentados novamente a partir de proxima_tentativa.
+    '''
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    remover = models.BooleanField(default=False)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    tentativas = models.PositiveIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _('Objeto a Indexar')
+        verbose_name_plural = _('Fila de Indexação')
+        ordering = ('id',)
+
+    def __str__(self):
+        return '{}.{}'.format(self.content_type.model, self.object_id)
+
+
+class TextoExtraido(models.Model):
+    '''
+    Texto extraído de um arquivo pelo Solr, identificado pelo hash SHA-1 do
+    conteúdo do arquivo, de modo que arquivos não alterados não sejam
+    extraídos novamente.
+    '''
+    hash = models.CharField(max_length=40, unique=True)
+    texto = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = _('Texto Extraído')
+        verbose_name_plural = _('Textos Extraídos')
+
+    def __str__(self):
+        return self.hash
 
 
 @reversion.register()
@@ -1,10 +1,31 @@
-from django.db.models.signals import post_delete, post_save
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from sapl.materia.models import Tramitacao
+from sapl.base.models import (AppConfig, Autor, CasaLegislativa,
+                              cache_configuracao)
+from sapl.compilacao.models import (Dispositivo, Nota, Publicacao,
+                                    TextoArticulado, TipoDispositivo, Vide)
+from sapl.compilacao.utils import (atualiza_versao_global_texto_articulado,
+                                   atualiza_versao_texto_articulado,
+                                   atualiza_versao_textos_articulados)
+from sapl.materia.models import (Autoria, MateriaLegislativa,
+                                 TipoMateriaLegislativa, Tramitacao,
+                                 atualiza_ultima_tramitacao)
+from sapl.materia.utils import (atualiza_versao_global_materias,
+                                atualiza_versao_materias_ano)
+from sapl.painel.models import Cronometro
+from sapl.painel.utils import (atualiza_versao_global_painel,
+                               atualiza_versao_painel)
+from sapl.parlamentares.models import (Filiacao, Mandato, Parlamentar,
+                                       Partido)
 from sapl.protocoloadm.models import TramitacaoAdministrativo
 from sapl.base.signals import tramitacao_signal
-from sapl.utils import get_base_url
+from sapl.sessao.models import (ExpedienteMateria, OradorExpediente, OrdemDia,
+                                PresencaOrdemDia, RegistroVotacao,
+                                SessaoPlenaria, SessaoPlenariaPresenca,
+                                VotoParlamentar)
+from sapl.utils import get_base_url, indice_filiacoes
 
 from sapl.base.email_utils import do_envia_email_tramitacao
 
@@ -40,3 +61,132 @@ def status_tramitacao_materia(sender, instance, **kwargs):
             documento = instance.documento
             documento.tramitacao = True
             documento.save()
+
+
+def sessao_plenaria_id_painel(instance):
+    if isinstance(instance, SessaoPlenaria):
+        return instance.pk
+    if hasattr(instance, 'sessao_plenaria_id'):
+        return instance.sessao_plenaria_id
+    # VotoParlamentar e RegistroVotacao se ligam à sessão
+    # através da Ordem do Dia ou do Expediente
+    try:
+        if instance.ordem_id:
+            return instance.ordem.sessao_plenaria_id
+        if instance.expediente_id:
+            return instance.expediente.sessao_plenaria_id
+    except ObjectDoesNotExist:
+        pass
+    return None
+
+
+@receiver([post_save, post_delete], sender=SessaoPlenaria)
+@receiver([post_save, post_delete], sender=OrdemDia)
+@receiver([post_save, post_delete], sender=ExpedienteMateria)
+@receiver([post_save, post_delete], sender=OradorExpediente)
+@receiver([post_save, post_delete], sender=PresencaOrdemDia)
+@receiver([post_save, post_delete], sender=SessaoPlenariaPresenca)
+@receiver([post_save, post_delete], sender=RegistroVotacao)
+@receiver([post_save, post_delete], sender=VotoParlamentar)
+def atualiza_painel_sessao(sender, instance, **kwargs):
+    pk = sessao_plenaria_id_painel(instance)
+    if pk:
+        atualiza_versao_painel(pk)
+
+
+@receiver([post_save, post_delete], sender=CasaLegislativa)
+@receiver([post_save, post_delete], sender=AppConfig)
+@receiver([post_save, post_delete], sender=Cronometro)
+@receiver([post_save, post_delete], sender=Parlamentar)
+@receiver([post_save, post_delete], sender=Mandato)
+@receiver([post_save, post_delete], sender=Filiacao)
+def atualiza_painel_global(sender, instance, **kwargs):
+    atualiza_versao_global_painel()
+
+
+@receiver([post_save, post_delete], sender=Filiacao)
+@receiver([post_save, post_delete], sender=Partido)
+def atualiza_indice_filiacoes(sender, instance, **kwargs):
+    indice_filiacoes.invalidar()
+
+
+@receiver([post_save, post_delete], sender=CasaLegislativa)
+@receiver([post_save, post_delete], sender=AppConfig)
+def atualiza_cache_configuracao(sender, instance, **kwargs):
+    cache_configuracao.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Tramitacao)
+def atualiza_ultima_tramitacao_materia(sender, instance, **kwargs):
+    materias = MateriaLegislativa.objects.filter(pk=instance.materia_id)
+    atualiza_ultima_tramitacao(materias)
+
+    # mantém atualizada a matéria já carregada junto com a tramitação, para
+    # que um save posterior não sobrescreva o valor com o anterior
+    materia = getattr(instance, Tramitacao.materia.cache_name, None)
+    if materia is not None:
+        materia.ultima_tramitacao_id = materias.values_list(
+            'ultima_tramitacao', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Dispositivo)
+def atualiza_versao_ta_dispositivo(sender, instance, **kwargs):
+    atualiza_versao_texto_articulado(instance.ta_id)
+    if instance.ta_publicado_id:
+        atualiza_versao_texto_articulado(instance.ta_publicado_id)
+
+
+@receiver([post_save, post_delete], sender=Nota)
+@receiver([post_save, post_delete], sender=Vide)
+def atualiza_versao_ta_nota_vide(sender, instance, **kwargs):
+    dispositivos = [instance.dispositivo_id] if sender == Nota else \
+        [instance.dispositivo_base_id, instance.dispositivo_ref_id]
+    atualiza_versao_textos_articulados(Dispositivo.objects.filter(
+        pk__in=dispositivos).values_list('ta_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Publicacao)
+def atualiza_versao_ta_publicacao(sender, instance, **kwargs):
+    atualiza_versao_texto_articulado(instance.ta_id)
+
+
+# O nome de um texto articulado aparece nos textos alterados por ele
+@receiver([post_save, post_delete], sender=TextoArticulado)
+def atualiza_versao_ta(sender, instance, **kwargs):
+    atualiza_versao_textos_articulados([instance.pk] + list(
+        Dispositivo.objects.filter(ta_publicado_id=instance.pk).values_list(
+            'ta_id', flat=True)))
+
+
+@receiver([post_save, post_delete], sender=TipoDispositivo)
+def atualiza_versao_global_ta(sender, instance, **kwargs):
+    atualiza_versao_global_texto_articulado()
+
+
+@receiver(pre_save, sender=MateriaLegislativa)
+def atualiza_versao_ano_anterior_materia(sender, instance, **kwargs):
+    # A matéria deixa de ser contada no ano anterior quando o ano muda
+    if instance.pk:
+        ano = MateriaLegislativa.objects.filter(pk=instance.pk).exclude(
+            ano=instance.ano).values_list('ano', flat=True).first()
+        if ano is not None:
+            atualiza_versao_materias_ano(ano)
+
+
+@receiver([post_save, post_delete], sender=MateriaLegislativa)
+def atualiza_versao_ano_materia(sender, instance, **kwargs):
+    atualiza_versao_materias_ano(instance.ano)
+
+
+@receiver([post_save, post_delete], sender=Autoria)
+def atualiza_versao_ano_autoria(sender, instance, **kwargs):
+    ano = MateriaLegislativa.objects.filter(
+        pk=instance.materia_id).values_list('ano', flat=True).first()
+    if ano is not None:
+        atualiza_versao_materias_ano(ano)
+
+
+@receiver([post_save, post_delete], sender=Autor)
+@receiver([post_save, post_delete], sender=TipoMateriaLegislativa)
+def atualiza_versao_global_materia(sender, instance, **kwargs):
+    atualiza_versao_global_materias()
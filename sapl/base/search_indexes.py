@@ -1,16 +1,16 @@
 import os.path
-import logging
 
 from django.db.models import F, Q, Value
 from django.db.models.fields import TextField
 from django.db.models.functions import Concat
 from django.template import loader
-from haystack import connections
 from haystack.constants import Indexable
 from haystack.fields import CharField
 from haystack.indexes import SearchIndex
 from haystack.utils import get_model_ct_tuple
 
+from sapl.base.indexacao import extrai_texto, hash_arquivo
+from sapl.base.models import TextoExtraido
 from sapl.compilacao.models import (STATUS_TA_IMMUTABLE_PUBLIC,
                                     STATUS_TA_PUBLIC, Dispositivo)
 from sapl.materia.models import DocumentoAcessorio, MateriaLegislativa
@@ -21,50 +21,37 @@ from sapl.utils import RemoveTag
 
 class TextExtractField(CharField):
 
-    backend = None
-    logger = logging.getLogger(__name__)
-
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         assert self.model_attr
 
+        # caminho do arquivo -> texto, preenchido por PipelineIndexacao
+        self.textos = {}
+
         if not isinstance(self.model_attr, (list, tuple)):
             self.model_attr = (self.model_attr, )
 
-    def solr_extraction(self, arquivo):
-        if not self.backend:
-            self.backend = connections['default'].get_backend()
-        try:
-            with open(arquivo.path, 'rb') as f:
-                content = self.backend.extract_file_contents(f)
-                if not content or not content['contents']:
-                    return ''
-                data = content['contents']
-        except Exception as e:
-            print('erro processando arquivo: ' % arquivo.path)
-            self.logger.error(arquivo.path)
-            self.logger.error('erro processando arquivo: ' % arquivo.path)
-            data = ''
-        return data
-
-    def print_error(self, arquivo, error):
-        msg = 'Erro inesperado processando arquivo %s erro: %s' % (
-            arquivo.path, error)
-        print(msg, error)
-        self.logger.error(msg, error)
-
     def file_extractor(self, arquivo):
         if not os.path.exists(arquivo.path) or \
                 not os.path.splitext(arquivo.path)[1][:1]:
             return ''
 
+        # Texto já extraído pelo pipeline de indexação
+        if arquivo.path in self.textos:
+            return self.textos[arquivo.path]
+
         # Em ambiente de produção utiliza-se o SOLR
         if SOLR_URL:
-            try:
-                return self.solr_extraction(arquivo)
-            except Exception as err:
-                print(str(err))
-                self.print_error(arquivo, err)
+            hash = hash_arquivo(arquivo.path)
+            texto = TextoExtraido.objects.filter(
+                hash=hash).values_list('texto', flat=True).first()
+            if texto is None:
+                texto = extrai_texto(arquivo.path)
+                if texto is None:
+                    return ''
+                TextoExtraido.objects.get_or_create(
+                    hash=hash, defaults={'texto': texto})
+            return texto
         return ''
 
     def ta_extractor(self, value):
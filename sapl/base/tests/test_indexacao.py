@@ -0,0 +1,129 @@
+from unittest import mock
+
+import pytest
+from django.utils import timezone
+from model_mommy import mommy
+
+from sapl.base import indexacao
+from sapl.base.indexacao import (MAX_TENTATIVAS_INDEXACAO, PipelineIndexacao,
+                                 enfileira)
+from sapl.base.models import FilaIndexacao, TextoExtraido
+from sapl.materia.models import MateriaLegislativa
+
+
+class PoolSequencial:
+    # Executa no próprio processo o que o pipeline distribui entre processos
+
+    def map(self, funcao, itens):
+        return [funcao(item) for item in itens]
+
+
+def cria_pipeline(index):
+    conexoes = mock.MagicMock()
+    conexoes['default'].get_unified_index.return_value.get_index.\
+        return_value = index
+    with mock.patch.object(indexacao, 'connections', conexoes):
+        pipeline = PipelineIndexacao(processos=1)
+    pipeline.pool = PoolSequencial()
+    return pipeline
+
+
+def cria_index():
+    index = mock.Mock()
+    index.index_queryset.return_value = MateriaLegislativa.objects.all()
+    index.text.model_attr = (('texto_original', 'file_extractor'),
+                             ('ementa', 'string_extractor'))
+    return index
+
+
+def cria_materia(tmpdir, nome, conteudo):
+    tmpdir.join(nome).write(conteudo)
+    return mommy.make(MateriaLegislativa, texto_original=nome)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_textos_extraidos_uma_vez_por_conteudo(tmpdir, settings):
+    settings.MEDIA_ROOT = str(tmpdir)
+    caminhos = [str(tmpdir.join(nome)) for nome in ('a.txt', 'b.txt',
+                                                     'c.txt')]
+    for caminho, conteudo in zip(caminhos, ('igual', 'igual', 'outro')):
+        with open(caminho, 'w') as f:
+            f.write(conteudo)
+
+    def extrai_texto(caminho):
+        # simula outro processo que extraiu o mesmo arquivo antes
+        texto = 'texto de ' + open(caminho).read()
+        TextoExtraido.objects.get_or_create(
+            hash=indexacao.hash_arquivo(caminho), defaults={'texto': texto})
+        return texto
+
+    pipeline = cria_pipeline(cria_index())
+    with mock.patch.object(indexacao, 'extrai_texto',
+                           side_effect=extrai_texto) as extrai:
+        textos = pipeline.textos(caminhos)
+        assert extrai.call_count == 2
+
+        assert pipeline.textos(caminhos) == textos
+        assert extrai.call_count == 2
+
+    assert textos == {caminhos[0]: 'texto de igual',
+                      caminhos[1]: 'texto de igual',
+                      caminhos[2]: 'texto de outro'}
+    assert TextoExtraido.objects.count() == 2
+
+
+@pytest.mark.django_db(transaction=False)
+def test_falha_na_extracao_mantem_objeto_na_fila(tmpdir, settings):
+    settings.MEDIA_ROOT = str(tmpdir)
+    materia = cria_materia(tmpdir, 'texto.txt', 'conteúdo')
+    FilaIndexacao.objects.all().delete()
+    enfileira(materia)
+
+    index = cria_index()
+    pipeline = cria_pipeline(index)
+    with mock.patch.object(indexacao, 'extrai_texto', return_value=None):
+        assert pipeline.processa_lote(10) == 1
+
+        item = FilaIndexacao.objects.get()
+        assert item.tentativas == 1
+        assert item.proxima_tentativa > timezone.now()
+        assert not pipeline.backend.update.called
+
+        # o item só volta a ser processado após a espera
+        assert pipeline.processa_lote(10) == 0
+
+        # esgotadas as tentativas, o objeto é indexado sem o texto do arquivo
+        FilaIndexacao.objects.update(
+            tentativas=MAX_TENTATIVAS_INDEXACAO - 1,
+            proxima_tentativa=timezone.now())
+        assert pipeline.processa_lote(10) == 1
+
+    assert not FilaIndexacao.objects.exists()
+    pipeline.backend.update.assert_called_once_with(
+        index, [materia], commit=False)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_processa_fila_de_indexacao(tmpdir, settings):
+    settings.MEDIA_ROOT = str(tmpdir)
+    materia = cria_materia(tmpdir, 'texto.txt', 'conteúdo')
+    removida = mommy.make(MateriaLegislativa)
+    FilaIndexacao.objects.all().delete()
+    enfileira(materia)
+    enfileira(materia)
+    enfileira(removida, remover=True)
+
+    index = cria_index()
+    pipeline = cria_pipeline(index)
+    with mock.patch.object(indexacao, 'extrai_texto',
+                           return_value='conteúdo extraído'):
+        total, duracao = pipeline.processa(lote=10)
+
+    assert total == 3
+    assert (pipeline.indexados, pipeline.removidos) == (1, 1)
+    assert not FilaIndexacao.objects.exists()
+    pipeline.backend.update.assert_called_once_with(
+        index, [materia], commit=False)
+    pipeline.backend.remove.assert_called_once_with(
+        'materia.materialegislativa.{}'.format(removida.pk), commit=False)
+    assert TextoExtraido.objects.get().texto == 'conteúdo extraído'
@@ -1,6 +1,25 @@
+from datetime import timedelta
+from unittest import mock
+
 import pytest
+from django.core import mail
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
+from model_mommy import mommy
+
+from sapl.base import email_utils
+from sapl.base.email_utils import (cria_mensagem_email,
+                                   envia_emails_pendentes,
+                                   remove_emails_enviados)
+from sapl.base.models import (AppConfig, Autor, MensagemEmail,
+                              cache_configuracao)
+from sapl.base.views import verifica_inconsistencias
+from sapl.materia.models import (Autoria, MateriaLegislativa,
+                                 TipoMateriaLegislativa)
+from sapl.parlamentares.models import Mandato
 
 
 @pytest.mark.django_db(transaction=False)
@@ -33,3 +52,117 @@ def test_incluir_tipo_autor_errors(admin_client):
 
     assert (response.context_data['form'].errors['descricao'] ==
             [_('Este campo é obrigatório.')])
+
+
+@pytest.mark.django_db(transaction=False)
+def test_cache_configuracao():
+    config = cache_configuracao.app_config()
+
+    with CaptureQueriesContext(connection) as consultas:
+        AppConfig.attr('sequencia_numeracao')
+        AppConfig.attr('esfera_federacao')
+    assert len(consultas) == 0
+
+    # salvar a configuração invalida o cache
+    config.sequencia_numeracao = 'U'
+    config.save()
+    assert AppConfig.attr('sequencia_numeracao') == 'U'
+
+
+@pytest.mark.django_db(transaction=False)
+def test_fila_de_emails():
+    MensagemEmail.objects.bulk_create([
+        cria_mensagem_email('Assunto', 'Texto', '<p>Texto</p>',
+                            'usuario%s@teste.com' % i, 'sapl@teste.com')
+        for i in range(3)])
+
+    assert envia_emails_pendentes(lote=2) == (2, 0)
+    assert envia_emails_pendentes(lote=2) == (1, 0)
+    assert envia_emails_pendentes(lote=2) == (0, 0)
+
+    assert len(mail.outbox) == 3
+    assert not MensagemEmail.objects.exclude(
+        status=MensagemEmail.ENVIADA).exists()
+
+
+@pytest.mark.django_db(transaction=False)
+def test_fila_de_emails_sem_servidor():
+    MensagemEmail.objects.bulk_create([
+        cria_mensagem_email('Assunto', 'Texto', '<p>Texto</p>',
+                            'usuario%s@teste.com' % i, 'sapl@teste.com')
+        for i in range(2)])
+
+    conexao = mock.Mock()
+    conexao.open.side_effect = ConnectionRefusedError('recusada')
+    with mock.patch.object(email_utils, 'get_connection',
+                           return_value=conexao):
+        assert envia_emails_pendentes(lote=2, max_tentativas=2) == (0, 2)
+
+    # as mensagens são reagendadas, e não enviadas novamente de imediato
+    assert envia_emails_pendentes(lote=2) == (0, 0)
+    for mensagem in MensagemEmail.objects.all():
+        assert mensagem.status == MensagemEmail.PENDENTE
+        assert mensagem.tentativas == 1
+        assert mensagem.ultimo_erro == 'recusada'
+        assert mensagem.proximo_envio > timezone.now()
+
+
+@pytest.mark.django_db(transaction=False)
+def test_remove_emails_enviados():
+    MensagemEmail.objects.bulk_create([
+        cria_mensagem_email('Assunto', 'Texto', '<p>Texto</p>',
+                            'usuario%s@teste.com' % i, 'sapl@teste.com')
+        for i in range(3)])
+    antiga, recente, pendente = MensagemEmail.objects.all()
+    MensagemEmail.objects.filter(pk=antiga.pk).update(
+        status=MensagemEmail.ENVIADA,
+        enviada_em=timezone.now() - timedelta(days=31))
+    MensagemEmail.objects.filter(pk=recente.pk).update(
+        status=MensagemEmail.ENVIADA, enviada_em=timezone.now())
+
+    assert remove_emails_enviados(dias=30) == 1
+    assert set(MensagemEmail.objects.values_list('pk', flat=True)) == {
+        recente.pk, pendente.pk}
+
+
+@pytest.mark.django_db(transaction=False)
+def test_lista_inconsistencias_usa_ultima_verificacao(admin_client):
+    verifica_inconsistencias()
+    mommy.make(Mandato, data_inicio_mandato=None)
+
+    def mandatos(response):
+        return dict((nome, valor) for nome, titulo, valor in
+                    response.context_data['tabela_inconsistencias'])[
+            'mandato_sem_data_inicio']
+
+    url = reverse('sapl.base:lista_inconsistencias')
+    assert mandatos(admin_client.get(url)) == 0
+    assert mandatos(admin_client.get(url + '?atualizar')) == 1
+
+
+@pytest.mark.django_db(transaction=False)
+def test_relatorio_materias_por_ano_autor_tipo(admin_client):
+    tipo = mommy.make(TipoMateriaLegislativa, sigla='PL',
+                      descricao='Projeto de Lei')
+    autor = mommy.make(Autor, nome='Autor')
+    for numero in range(1, 4):
+        materia = mommy.make(MateriaLegislativa, tipo=tipo, numero=numero,
+                             ano=2018)
+        mommy.make(Autoria, materia=materia, autor=autor,
+                   primeiro_autor=True)
+
+    url = reverse('sapl.base:materia_por_ano_autor_tipo') + '?ano=2018'
+    response = admin_client.get(url)
+    assert response.context_data['qtdes'] == [('PL', 'Projeto de Lei', 3)]
+    assert response.context_data['relatorio'] == [
+        {'autor': 'Autor', 'materia': [('Projeto de Lei', 3)], 'total': 3}]
+    assert response.context_data['corelatorio'] == []
+
+    # o relatório do ano fica no cache até que as matérias do ano mudem
+    with CaptureQueriesContext(connection) as consultas:
+        admin_client.get(url)
+    assert not any('GROUP BY' in c['sql'] for c in consultas.captured_queries)
+
+    mommy.make(MateriaLegislativa, tipo=tipo, numero=4, ano=2018)
+    response = admin_client.get(url)
+    assert response.context_data['qtdes'] == [('PL', 'Projeto de Lei', 4)]
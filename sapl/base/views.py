@@ -9,11 +9,11 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.auth.models import Group, User
 from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied, ValidationError
 from django.core.mail import send_mail
 from django.core.urlresolvers import reverse, reverse_lazy
-from django.db import connection
-from django.db.models import Count, Q, ProtectedError
+from django.db.models import Count, Exists, OuterRef, Q, ProtectedError
 from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.template import TemplateDoesNotExist
 from django.template.loader import get_template
@@ -36,14 +36,16 @@ from sapl.comissoes.models import Reuniao, Comissao
 from sapl.crud.base import CrudAux, make_pagination
 from sapl.materia.models import (Autoria, MateriaLegislativa, Proposicao,
                                  TipoMateriaLegislativa, StatusTramitacao, UnidadeTramitacao)
-from sapl.norma.models import (NormaJuridica, NormaEstatisticas)
+from sapl.materia.utils import versao_materias_ano
+from sapl.norma.models import (NormaJuridica, NormaAcessosMes,
+                               contador_acessos_normas)
 from sapl.parlamentares.models import Parlamentar, Legislatura, Mandato, Filiacao
 from sapl.protocoloadm.models import Protocolo
 from sapl.sessao.models import (PresencaOrdemDia, SessaoPlenaria,
                                 SessaoPlenariaPresenca, Bancada)
 from sapl.utils import (parlamentares_ativos, gerar_hash_arquivo, SEPARADOR_HASH_PROPOSICAO,
                         show_results_filter_set, mail_service_configured,
-                        intervalos_tem_intersecao,)
+                        intervalos_sobrepostos,)
 
 from .forms import (AlterarSenhaForm, CasaLegislativaForm,
                     ConfiguracoesAppForm, RelatorioAtasFilterSet,
@@ -58,7 +60,7 @@ from .forms import (AlterarSenhaForm, CasaLegislativaForm,
                     UsuarioEditForm, RelatorioNormasMesFilterSet,
                     RelatorioNormasVigenciaFilterSet,
                     EstatisticasAcessoNormasForm, UsuarioFilterSet)
-from .models import AppConfig, CasaLegislativa
+from .models import AppConfig, CasaLegislativa, cache_configuracao
 
 
 def filtra_url_materias_em_tramitacao(qr, qs, campo_url, local_ou_status):
@@ -75,7 +77,7 @@ def filtra_url_materias_em_tramitacao(qr, qs, campo_url, local_ou_status):
 
 
 def get_casalegislativa():
-    return CasaLegislativa.objects.first()
+    return cache_configuracao.casa_legislativa()
 
 
 class ConfirmarEmailView(TemplateView):
@@ -293,7 +295,7 @@ class RelatoriosListView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(TemplateView, self).get_context_data(**kwargs)
-        estatisticas_acesso_normas = AppConfig.objects.first().estatisticas_acesso_normas
+        estatisticas_acesso_normas = AppConfig.attr('estatisticas_acesso_normas')
         if estatisticas_acesso_normas == 'S':
             context['estatisticas_acesso_normas'] = True
         else:
@@ -646,50 +648,61 @@ class RelatorioMateriasTramitacaoView(FilterView):
         return context
 
 
-class RelatorioMateriasPorAnoAutorTipoView(FilterView):
-    model = MateriaLegislativa
-    filterset_class = RelatorioMateriasPorAnoAutorTipoFilterSet
-    template_name = 'base/RelatorioMateriasPorAnoAutorTipo_filter.html'
-
-    def get_materias_autor_ano(self, ano, primeiro_autor):
+CHAVE_RELATORIO_MATERIAS_ANO = 'sapl_relatorio_materias_ano_{}'
 
-        autorias = Autoria.objects.filter(materia__ano=ano, primeiro_autor=primeiro_autor).values(
-            'autor',
-            'materia__tipo__sigla',
-            'materia__tipo__descricao').annotate(
-                total=Count('materia__tipo')).order_by(
-                    'autor',
-                    'materia__tipo')
 
-        autores_ids = set([i['autor'] for i in autorias])
+def autorias_por_tipo(ano, primeiro_autor):
+    autorias = Autoria.objects.filter(
+        materia__ano=ano, primeiro_autor=primeiro_autor).values(
+        'autor', 'materia__tipo__descricao').annotate(
+        total=Count('id')).order_by(
+        'autor', 'materia__tipo__sequencia_regimental',
+        'materia__tipo__descricao')
 
-        autores = dict((a.id, a) for a in Autor.objects.filter(
-            id__in=autores_ids))
+    autores = Autor.objects.in_bulk({a['autor'] for a in autorias})
 
-        relatorio = []
-        visitados = set()
-        curr = None
-
-        for a in autorias:
-            # se mudou autor, salva atual, caso existente, e reinicia `curr`
-            if a['autor'] not in visitados:
-                if curr:
-                    relatorio.append(curr)
-
-                curr = {}
-                curr['autor'] = autores[a['autor']]
-                curr['materia'] = []
-                curr['total'] = 0
-
-                visitados.add(a['autor'])
+    relatorio = []
+    for autor, grupo in itertools.groupby(autorias, key=lambda a: a['autor']):
+        materias = [(a['materia__tipo__descricao'], a['total'])
+                    for a in grupo]
+        relatorio.append({
+            'autor': str(autores[autor]),
+            'materia': materias,
+            'total': sum(total for descricao, total in materias),
+        })
+    return relatorio
+
+
+def relatorio_materias_ano(ano):
+    '''
+    Quantidade de matérias do ano por tipo e de autorias e coautorias por
+    autor e tipo, calculadas no banco por agrupamento.
+
+    O resultado é guardado no cache compartilhado junto com a versão das
+    matérias do ano e só é recalculado quando essa versão muda.
+    '''
+    versao = versao_materias_ano(ano)
+    chave = CHAVE_RELATORIO_MATERIAS_ANO.format(ano)
+    snapshot = cache.get(chave)
+    if not snapshot or snapshot[0] != versao:
+        qtdes = [(m['tipo__sigla'], m['tipo__descricao'], m['total'])
+                 for m in MateriaLegislativa.objects.filter(ano=ano).values(
+                     'tipo__sigla', 'tipo__descricao').annotate(
+                     total=Count('id')).order_by(
+                     'tipo__sequencia_regimental', 'tipo__descricao')]
+        snapshot = (versao, {
+            'qtdes': qtdes,
+            'relatorio': autorias_por_tipo(ano, True),
+            'corelatorio': autorias_por_tipo(ano, False),
+        })
+        cache.set(chave, snapshot, None)
+    return snapshot[1]
 
-            # atualiza valores
-            curr['materia'].append((a['materia__tipo__descricao'], a['total']))
-            curr['total'] += a['total']
-        # adiciona o ultimo
-        relatorio.append(curr)
 
-        return relatorio
+class RelatorioMateriasPorAnoAutorTipoView(FilterView):
+    model = MateriaLegislativa
+    filterset_class = RelatorioMateriasPorAnoAutorTipoFilterSet
+    template_name = 'base/RelatorioMateriasPorAnoAutorTipo_filter.html'
 
     def get_filterset_kwargs(self, filterset_class):
         super(RelatorioMateriasPorAnoAutorTipoView,
@@ -705,26 +718,13 @@ class RelatorioMateriasPorAnoAutorTipoView(FilterView):
         context['title'] = _('Matérias por Ano, Autor e Tipo')
         if not self.filterset.form.is_valid():
             return context
-        qtdes = {}
-        for tipo in TipoMateriaLegislativa.objects.all():
-            qs = kwargs['object_list']
-            qtde = len(qs.filter(tipo_id=tipo.id))
-            if qtde > 0:
-                qtdes[tipo] = qtde
-        context['qtdes'] = qtdes
 
         qr = self.request.GET.copy()
         context['filter_url'] = ('&' + qr.urlencode()) if len(qr) > 0 else ''
 
         context['show_results'] = show_results_filter_set(qr)
         context['ano'] = self.request.GET['ano']
-
-        if 'ano' in self.request.GET and self.request.GET['ano']:
-            ano = int(self.request.GET['ano'])
-            context['relatorio'] = self.get_materias_autor_ano(ano, True)
-            context['corelatorio'] = self.get_materias_autor_ano(ano, False)
-        else:
-            context['relatorio'] = []
+        context.update(relatorio_materias_ano(int(context['ano'])))
 
         return context
 
@@ -892,28 +892,23 @@ class EstatisticasAcessoNormas(TemplateView):
             return self.render_to_response(context)
 
         context['ano'] = self.request.GET['ano']
-        
-        query = '''
-                select norma_id, ano, extract(month from horario_acesso) as mes, count(*)
-                from norma_normaestatisticas
-                where ano = {}
-                group by mes, ano, norma_id
-                order by mes desc;
-                '''.format(context['ano'])
-        cursor = connection.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
+
+        # Acessos ainda não gravados por este processo entram no relatório
+        contador_acessos_normas.descarrega()
+
+        acessos = NormaAcessosMes.objects.filter(
+            ano=context['ano']).select_related(
+            'norma', 'norma__tipo').order_by('-mes', '-acessos')
 
         normas_mes = collections.OrderedDict()
         meses = {1: 'Janeiro', 2: 'Fevereiro', 3:'Março', 4: 'Abril', 5: 'Maio', 6:'Junho',
                 7: 'Julho', 8: 'Agosto', 9:'Setembro', 10:'Outubro', 11:'Novembro', 12:'Dezembro'}
-        
-        for row in rows:
-            if not meses[int(row[2])] in normas_mes:
-                normas_mes[meses[int(row[2])]] = []
-            norma_est = [NormaJuridica.objects.get(id=row[0]), row[3]]
-            normas_mes[meses[int(row[2])]].append(norma_est)
-        
+
+        for acesso in acessos:
+            if not meses[acesso.mes] in normas_mes:
+                normas_mes[meses[acesso.mes]] = []
+            normas_mes[meses[acesso.mes]].append([acesso.norma, acesso.acessos])
+
         # Ordena por acesso e limita em 5
         for n in normas_mes:
             sorted_by_value = sorted(normas_mes[n], key=lambda kv: kv[1], reverse=True)
@@ -931,75 +926,20 @@ class ListarInconsistenciasView(PermissionRequiredMixin, ListView):
     permission_required = ('base.list_appconfig',)
 
     def get_queryset(self):
-        tabela = []
-        tabela.append(
-            ('protocolos_duplicados',
-             'Protocolos duplicados',
-             len(protocolos_duplicados())
-             )
-        )
-        tabela.append(
-            ('protocolos_com_materias',
-             'Protocolos que excedem o limite de matérias vinculadas',
-             len(protocolos_com_materias())
-             )
-        )
-        tabela.append(
-            ('materias_protocolo_inexistente',
-             'Matérias Legislativas com protocolo inexistente',
-             len(materias_protocolo_inexistente())
-             )
-        )
-        tabela.append(
-            ('filiacoes_sem_data_filiacao',
-             'Filiações sem data filiação',
-             len(filiacoes_sem_data_filiacao())
-            )
-        )
-        tabela.append(
-            ('mandato_sem_data_inicio',
-             'Mandatos sem data inicial',
-            len(mandato_sem_data_inicio())
-            )
-        )
-        tabela.append(
-            ('parlamentares_duplicados',
-             'Parlamentares duplicados',
-             len(parlamentares_duplicados())
-            )
-        )
-        tabela.append(
-            ('parlamentares_mandatos_intersecao',
-             'Parlamentares com mandatos em interseção',
-             len(parlamentares_mandatos_intersecao())
-             )
-        )
-        tabela.append(
-            ('parlamentares_filiacoes_intersecao',
-             'Parlamentares com filiações em interseção',
-             len(parlamentares_filiacoes_intersecao())    
-            )
-        )
-        tabela.append(
-            ('autores_duplicados',
-             'Autores duplicados',
-             len(autores_duplicados())
-             )
-        )
-        tabela.append(
-            ('bancada_comissao_autor_externo',
-             'Bancadas e Comissões com autor externo',
-             len(bancada_comissao_autor_externo())
-             )
-        )
-        tabela.append(
-            ('legislatura_infindavel',
-             'Legislaturas sem data fim',
-             len(legislatura_infindavel())
-            )
-        )
+        # As verificações são executadas periodicamente pelo comando
+        # verifica_inconsistencias; a página exibe o último resultado
+        resultado = cache.get(CHAVE_INCONSISTENCIAS)
+        if resultado is None or 'atualizar' in self.request.GET:
+            resultado = verifica_inconsistencias()
+
+        self.verificado_em = resultado['verificado_em']
+        return [(nome, titulo, len(ids))
+                for nome, titulo, ids in resultado['inconsistencias']]
 
-        return tabela
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['verificado_em'] = self.verificado_em
+        return context
 
 
 def legislatura_infindavel():
@@ -1081,9 +1021,9 @@ class ListarBancadaComissaoAutorExternoView(PermissionRequiredMixin, ListView):
 
 
 def autores_duplicados():
-    return [autor.values() for autor in Autor.objects.values(
+    return list(Autor.objects.values(
         'nome', 'tipo__descricao').order_by(
-            "nome").annotate(count=Count('nome')).filter(count__gt=1)]
+            "nome").annotate(count=Count('nome')).filter(count__gt=1))
 
 
 class ListarAutoresDuplicadosView(PermissionRequiredMixin, ListView):
@@ -1110,25 +1050,16 @@ class ListarAutoresDuplicadosView(PermissionRequiredMixin, ListView):
 
 
 def parlamentares_filiacoes_intersecao():
-    intersecoes = []
-
-    for parlamentar in Parlamentar.objects.all().order_by('nome_parlamentar'):
-        filiacoes = parlamentar.filiacao_set.all()
-        combinacoes = itertools.combinations(filiacoes, 2)
+    filiacoes = Filiacao.objects.filter(data__isnull=False).select_related(
+        'parlamentar').order_by('parlamentar__nome_parlamentar',
+                                'parlamentar_id')
 
-        for c in combinacoes:
-            data_filiacao1 = c[0].data
-            data_desfiliacao1 = c[0].data_desfiliacao if c[0].data_desfiliacao else timezone.now().date()
-
-            data_filiacao2 = c[1].data
-            data_desfiliacao2 = c[1].data_desfiliacao if c[1].data_desfiliacao else timezone.now().date()
-
-            if data_filiacao1 and data_filiacao2:
-                exists = intervalos_tem_intersecao(
-                    data_filiacao1, data_desfiliacao1,
-                    data_filiacao2, data_desfiliacao2)
-                if exists:
-                    intersecoes.append((parlamentar, c[0], c[1]))
+    intersecoes = []
+    for parlamentar, grupo in itertools.groupby(
+            filiacoes, key=lambda f: f.parlamentar):
+        intersecoes.extend(
+            (parlamentar, a, b) for a, b in intervalos_sobrepostos(
+                grupo, lambda f: f.data, lambda f: f.data_desfiliacao))
     return intersecoes
 
 
@@ -1156,26 +1087,18 @@ class ListarParlFiliacoesIntersecaoView(PermissionRequiredMixin, ListView):
 
 
 def parlamentares_mandatos_intersecao():
-    intersecoes = []
-
-    for parlamentar in Parlamentar.objects.all().order_by('nome_parlamentar'):
-        mandatos = parlamentar.mandato_set.all()
-        combinacoes = itertools.combinations(mandatos, 2)
-
-        for c in combinacoes:
-            data_inicio_mandato1 = c[0].data_inicio_mandato
-            data_fim_mandato1 = c[0].data_fim_mandato if c[0].data_fim_mandato else timezone.now().date()
-
-            data_inicio_mandato2 = c[1].data_inicio_mandato
-            data_fim_mandato2 = c[1].data_fim_mandato if c[1].data_fim_mandato else timezone.now().date()
-
-            if data_inicio_mandato1 and data_inicio_mandato2:
-                exists = intervalos_tem_intersecao(
-                    data_inicio_mandato1, data_fim_mandato1,
-                    data_inicio_mandato2, data_fim_mandato2)
-                if exists:
-                    intersecoes.append((parlamentar, c[0], c[1]))
+    mandatos = Mandato.objects.filter(
+        data_inicio_mandato__isnull=False).select_related(
+        'parlamentar').order_by('parlamentar__nome_parlamentar',
+                                'parlamentar_id')
 
+    intersecoes = []
+    for parlamentar, grupo in itertools.groupby(
+            mandatos, key=lambda m: m.parlamentar):
+        intersecoes.extend(
+            (parlamentar, a, b) for a, b in intervalos_sobrepostos(
+                grupo, lambda m: m.data_inicio_mandato,
+                lambda m: m.data_fim_mandato))
     return intersecoes
 
 
@@ -1203,9 +1126,9 @@ class ListarParlMandatosIntersecaoView(PermissionRequiredMixin, ListView):
 
 
 def parlamentares_duplicados():
-    return [parlamentar.values() for parlamentar in Parlamentar.objects.values(
+    return list(Parlamentar.objects.values(
         'nome_parlamentar').order_by('nome_parlamentar').annotate(count=Count(
-            'nome_parlamentar')).filter(count__gt=1)]
+            'nome_parlamentar')).filter(count__gt=1))
 
 
 class ListarParlamentaresDuplicadosView(PermissionRequiredMixin, ListView):
@@ -1317,14 +1240,13 @@ class ListarFiliacoesSemDataFiliacaoView(PermissionRequiredMixin, ListView):
 
 
 def materias_protocolo_inexistente():
-    materias = []
-    for materia in MateriaLegislativa.objects.filter(numero_protocolo__isnull=False).order_by('-ano', 'numero'):
-        exists = Protocolo.objects.filter(
-            ano=materia.ano, numero=materia.numero_protocolo).exists()
-        if not exists:
-            materias.append(
-                (materia, materia.ano, materia.numero_protocolo))
-    return materias
+    protocolo = Protocolo.objects.filter(
+        ano=OuterRef('ano'), numero=OuterRef('numero_protocolo'))
+    return [(materia, materia.ano, materia.numero_protocolo)
+            for materia in MateriaLegislativa.objects.filter(
+                numero_protocolo__isnull=False).annotate(
+                protocolo_existe=Exists(protocolo)).filter(
+                protocolo_existe=False).order_by('-ano', 'numero')]
 
 
 class ListarMatProtocoloInexistenteView(PermissionRequiredMixin, ListView):
@@ -1352,15 +1274,19 @@ class ListarMatProtocoloInexistenteView(PermissionRequiredMixin, ListView):
 
 
 def protocolos_com_materias():
-    protocolos = {}
-    
-    for m in MateriaLegislativa.objects.filter(numero_protocolo__isnull=False).order_by('-ano', 'numero_protocolo'):
-        if Protocolo.objects.filter(numero=m.numero_protocolo, ano=m.ano).exists():
-            key = "{}/{}".format(m.numero_protocolo, m.ano)
-            val = protocolos.get(key, list())
-            val.append(m)
-            protocolos[key] = val
-    
+    protocolos = collections.OrderedDict()
+
+    protocolo = Protocolo.objects.filter(
+        ano=OuterRef('ano'), numero=OuterRef('numero_protocolo'))
+    for m in MateriaLegislativa.objects.filter(
+            numero_protocolo__isnull=False).annotate(
+            protocolo_existe=Exists(protocolo)).filter(
+            protocolo_existe=True).order_by('-ano', 'numero_protocolo'):
+        key = "{}/{}".format(m.numero_protocolo, m.ano)
+        val = protocolos.get(key, list())
+        val.append(m)
+        protocolos[key] = val
+
     return [(v[0], len(v)) for (k, v) in protocolos.items() if len(v) > 1]
 
 
@@ -1421,6 +1347,64 @@ class ListarProtocolosDuplicadosView(PermissionRequiredMixin, ListView):
         return context
 
 
+CHAVE_INCONSISTENCIAS = 'sapl_inconsistencias'
+# Sem o comando em execução, a página refaz as verificações após esse prazo
+VALIDADE_INCONSISTENCIAS = 24 * 60 * 60
+
+# (nome, título, verificação, identificação de cada inconsistência)
+INCONSISTENCIAS = (
+    ('protocolos_duplicados',
+     'Protocolos duplicados',
+     protocolos_duplicados, lambda i: i[0].pk),
+    ('protocolos_com_materias',
+     'Protocolos que excedem o limite de matérias vinculadas',
+     protocolos_com_materias, lambda i: i[0].pk),
+    ('materias_protocolo_inexistente',
+     'Matérias Legislativas com protocolo inexistente',
+     materias_protocolo_inexistente, lambda i: i[0].pk),
+    ('filiacoes_sem_data_filiacao',
+     'Filiações sem data filiação',
+     filiacoes_sem_data_filiacao, lambda i: i.pk),
+    ('mandato_sem_data_inicio',
+     'Mandatos sem data inicial',
+     mandato_sem_data_inicio, lambda i: i.pk),
+    ('parlamentares_duplicados',
+     'Parlamentares duplicados',
+     parlamentares_duplicados, lambda i: i['nome_parlamentar']),
+    ('parlamentares_mandatos_intersecao',
+     'Parlamentares com mandatos em interseção',
+     parlamentares_mandatos_intersecao, lambda i: (i[1].pk, i[2].pk)),
+    ('parlamentares_filiacoes_intersecao',
+     'Parlamentares com filiações em interseção',
+     parlamentares_filiacoes_intersecao, lambda i: (i[1].pk, i[2].pk)),
+    ('autores_duplicados',
+     'Autores duplicados',
+     autores_duplicados, lambda i: (i['nome'], i['tipo__descricao'])),
+    ('bancada_comissao_autor_externo',
+     'Bancadas e Comissões com autor externo',
+     bancada_comissao_autor_externo, lambda i: (i[2], i[1].pk)),
+    ('legislatura_infindavel',
+     'Legislaturas sem data fim',
+     legislatura_infindavel, lambda i: i.pk),
+)
+
+
+def verifica_inconsistencias():
+    '''
+    Executa todas as verificações de INCONSISTENCIAS e guarda no cache
+    compartilhado, com a data da verificação, a identificação dos registros
+    inconsistentes encontrados por cada uma.
+    '''
+    resultado = {
+        'verificado_em': timezone.now(),
+        'inconsistencias': [
+            (nome, titulo, [identifica(i) for i in verificacao()])
+            for nome, titulo, verificacao, identifica in INCONSISTENCIAS],
+    }
+    cache.set(CHAVE_INCONSISTENCIAS, resultado, VALIDADE_INCONSISTENCIAS)
+    return resultado
+
+
 class PesquisarUsuarioView(PermissionRequiredMixin, FilterView):
     model = User
     filterset_class = UsuarioFilterSet
@@ -0,0 +1,216 @@
+import json
+from xml.sax.saxutils import escape, quoteattr
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.html import strip_tags
+
+from sapl.compilacao.models import Dispositivo, Nota, TextoArticulado, Vide
+
+TAMANHO_LOTE_EXPORTACAO = 500
+
+NAMESPACE_LEXML = 'http://www.lexml.gov.br/1.0'
+
+# class_css do tipo de dispositivo -> elemento LexML
+ELEMENTOS_LEXML = {
+    'articulacao': 'Articulacao',
+    'ementa': 'Ementa',
+    'parte': 'Parte',
+    'livro': 'Livro',
+    'titulo': 'Titulo',
+    'capitulo': 'Capitulo',
+    'secao': 'Secao',
+    'subsecao': 'Subsecao',
+    'artigo': 'Artigo',
+    'caput': 'Caput',
+    'paragrafo': 'Paragrafo',
+    'inciso': 'Inciso',
+    'alinea': 'Alinea',
+    'item': 'Item',
+    'anexo': 'Anexo',
+    'bloco_alteracao': 'Alteracao',
+    'omissis': 'Omissis',
+}
+ELEMENTO_LEXML_GENERICO = 'DispositivoGenerico'
+
+
+def dados_texto_articulado(ta):
+    return {
+        'id': ta.pk,
+        'tipo': str(ta.tipo_ta) if ta.tipo_ta else '',
+        'numero': ta.numero,
+        'ano': ta.ano,
+        'data': ta.data,
+        'ementa': ta.ementa,
+        'observacao': ta.observacao,
+    }
+
+
+def dispositivos_para_exportacao(ta, lote=TAMANHO_LOTE_EXPORTACAO):
+    '''
+    Percorre os dispositivos do texto articulado em ordem, em lotes
+    paginados pela ordem, junto com suas notas públicas, vides e dados de
+    alteração. Apenas um lote fica em memória por vez.
+    '''
+    tas = {}
+    ultima = None
+    while True:
+        dpts = Dispositivo.objects.filter(ta=ta).order_by('ordem')
+        if ultima is not None:
+            dpts = dpts.filter(ordem__gt=ultima)
+        dpts = list(dpts.values(
+            'id', 'dispositivo_pai_id', 'nivel', 'ordem', 'rotulo', 'texto',
+            'texto_atualizador', 'tipo_dispositivo__nome',
+            'tipo_dispositivo__class_css', 'inicio_vigencia', 'fim_vigencia',
+            'inicio_eficacia', 'fim_eficacia', 'ta_publicado_id',
+            'dispositivo_atualizador_id', 'dispositivo_substituido_id',
+            'dispositivo_subsequente_id', 'dispositivo_vigencia_id')[:lote])
+        if not dpts:
+            return
+        ultima = dpts[-1]['ordem']
+        pks = [d['id'] for d in dpts]
+
+        notas = {}
+        for n in Nota.objects.filter(
+                dispositivo_id__in=pks, publicidade=Nota.NPUBL).values(
+                'dispositivo_id', 'tipo__nome', 'titulo', 'texto',
+                'url_externa', 'publicacao', 'efetividade'):
+            notas.setdefault(n.pop('dispositivo_id'), []).append(n)
+
+        vides = {}
+        for v in Vide.objects.filter(dispositivo_base_id__in=pks).values(
+                'dispositivo_base_id', 'tipo__nome', 'texto',
+                'dispositivo_ref_id', 'dispositivo_ref__ta_id'):
+            vides.setdefault(v.pop('dispositivo_base_id'), []).append(v)
+
+        novos = {d['ta_publicado_id'] for d in dpts
+                 if d['ta_publicado_id']} - set(tas)
+        if novos:
+            tas.update((pk, str(t)) for pk, t in TextoArticulado.objects.
+                       select_related('tipo_ta').in_bulk(novos).items())
+
+        for d in dpts:
+            alteracao = None
+            if d['ta_publicado_id']:
+                alteracao = {
+                    'ta_publicado': d['ta_publicado_id'],
+                    'ta_publicado_str': tas.get(d['ta_publicado_id'], ''),
+                    'dispositivo_atualizador': d['dispositivo_atualizador_id'],
+                }
+            yield {
+                'id': d['id'],
+                'pai': d['dispositivo_pai_id'],
+                'nivel': d['nivel'],
+                'tipo': d['tipo_dispositivo__nome'],
+                'class_css': d['tipo_dispositivo__class_css'],
+                'rotulo': d['rotulo'],
+                'texto': d['texto'],
+                'texto_atualizador': d['texto_atualizador'],
+                'inicio_vigencia': d['inicio_vigencia'],
+                'fim_vigencia': d['fim_vigencia'],
+                'inicio_eficacia': d['inicio_eficacia'],
+                'fim_eficacia': d['fim_eficacia'],
+                'dispositivo_substituido': d['dispositivo_substituido_id'],
+                'dispositivo_subsequente': d['dispositivo_subsequente_id'],
+                'dispositivo_vigencia': d['dispositivo_vigencia_id'],
+                'alteracao': alteracao,
+                'notas': notas.get(d['id'], []),
+                'vides': vides.get(d['id'], []),
+            }
+
+
+def arvore(dispositivos):
+    '''
+    Converte a sequência de dispositivos, em ordem, em eventos de abertura
+    e fechamento da árvore. Só a pilha de ancestrais do dispositivo atual é
+    mantida em memória.
+    '''
+    pilha = []
+    for d in dispositivos:
+        while pilha and pilha[-1]['id'] != d['pai']:
+            yield 'fecha', pilha.pop()
+        yield 'abre', d
+        pilha.append(d)
+    while pilha:
+        yield 'fecha', pilha.pop()
+
+
+def exporta_json(ta):
+    yield '{"texto_articulado": %s, "dispositivos": [' % json.dumps(
+        dados_texto_articulado(ta), cls=DjangoJSONEncoder)
+
+    # Cada nível aberto registra se já recebeu algum dispositivo
+    irmaos = [False]
+    for evento, d in arvore(dispositivos_para_exportacao(ta)):
+        if evento == 'abre':
+            separador = ', ' if irmaos[-1] else ''
+            irmaos[-1] = True
+            irmaos.append(False)
+            yield '%s%s, "filhos": [' % (
+                separador, json.dumps(d, cls=DjangoJSONEncoder)[:-1])
+        else:
+            irmaos.pop()
+            yield ']}'
+
+    yield ']}'
+
+
+def atributos_lexml(**atributos):
+    return ''.join(' %s=%s' % (nome, quoteattr(str(valor)))
+                   for nome, valor in atributos.items()
+                   if valor is not None)
+
+
+def paragrafo_lexml(html):
+    texto = strip_tags(html or '').strip()
+    return '<p>%s</p>' % escape(texto) if texto else ''
+
+
+def exporta_lexml(ta):
+    dados = dados_texto_articulado(ta)
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<LexML xmlns=%s><TextoArticulado%s><Epigrafe>%s</Epigrafe>' % (
+        quoteattr(NAMESPACE_LEXML),
+        atributos_lexml(id=dados['id'], numero=dados['numero'],
+                        ano=dados['ano'], data=dados['data']),
+        escape(str(ta)))
+
+    for evento, d in arvore(dispositivos_para_exportacao(ta)):
+        elemento = ELEMENTOS_LEXML.get(
+            d['class_css'], ELEMENTO_LEXML_GENERICO)
+        if evento == 'fecha':
+            yield '</%s>' % elemento
+            continue
+
+        alteracao = d['alteracao'] or {}
+        yield '<%s%s>' % (elemento, atributos_lexml(
+            id='d%s' % d['id'],
+            nome=d['tipo'] if elemento == ELEMENTO_LEXML_GENERICO else None,
+            inicioVigencia=d['inicio_vigencia'],
+            fimVigencia=d['fim_vigencia'],
+            inicioEficacia=d['inicio_eficacia'],
+            fimEficacia=d['fim_eficacia'],
+            alteradoPor=alteracao.get('ta_publicado')))
+        if d['rotulo']:
+            yield '<Rotulo>%s</Rotulo>' % escape(d['rotulo'])
+        yield paragrafo_lexml(d['texto'])
+
+        for n in d['notas']:
+            yield '<Nota%s>%s%s</Nota>' % (
+                atributos_lexml(tipo=n['tipo__nome'],
+                                publicacao=n['publicacao'].date()),
+                '<Titulo>%s</Titulo>' % escape(n['titulo'])
+                if n['titulo'] else '',
+                paragrafo_lexml(n['texto']))
+        for v in d['vides']:
+            yield '<Vide%s>%s</Vide>' % (
+                atributos_lexml(tipo=v['tipo__nome'],
+                                href='d%s' % v['dispositivo_ref_id']),
+                paragrafo_lexml(v['texto']))
+
+    yield '</TextoArticulado></LexML>'
+
+
+EXPORTACOES = {
+    'json': (exporta_json, 'application/json'),
+    'xml': (exporta_lexml, 'application/xml'),
+}
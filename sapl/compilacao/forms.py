@@ -21,7 +21,8 @@ from sapl.compilacao.models import (NOTAS_PUBLICIDADE_CHOICES,
                                     TipoDispositivo, TipoNota, TipoPublicacao,
                                     TipoTextoArticulado, TipoVide,
                                     VeiculoPublicacao, Vide)
-from sapl.compilacao.utils import DISPOSITIVO_SELECT_RELATED
+from sapl.compilacao.utils import (DISPOSITIVO_SELECT_RELATED,
+                                   atualiza_versao_textos_articulados)
 from sapl.crispy_layout_mixin import SaplFormHelper
 from sapl.crispy_layout_mixin import SaplFormLayout, to_column, to_row,\
     form_actions
@@ -1006,6 +1007,11 @@ class DispositivoEdicaoVigenciaForm(ModelForm):
                 fim_vigencia=inst.fim_eficacia,
                 fim_eficacia=inst.fim_eficacia)
 
+        atualiza_versao_textos_articulados(
+            [instance.ta_id] + list(
+                inst.dispositivos_vigencias_set.values_list(
+                    'ta_id', flat=True)))
+
         return inst
 
 
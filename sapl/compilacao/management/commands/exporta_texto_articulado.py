@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sapl.compilacao.exportacao import EXPORTACOES
+from sapl.compilacao.models import TextoArticulado
+
+
+class Command(BaseCommand):
+
+    help = 'Exporta um texto articulado em JSON ou XML no estilo LexML'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ta_id', type=int)
+        parser.add_argument(
+            '--formato', dest='formato', choices=sorted(EXPORTACOES),
+            default='json', help='Formato da exportação')
+        parser.add_argument(
+            '--saida', dest='saida', default=None,
+            help='Arquivo de saída; a saída padrão se omitido')
+
+    def handle(self, *args, **options):
+        try:
+            ta = TextoArticulado.objects.get(pk=options['ta_id'])
+        except TextoArticulado.DoesNotExist:
+            raise CommandError(
+                'Texto articulado {} não existe.'.format(options['ta_id']))
+
+        exporta = EXPORTACOES[options['formato']][0]
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as saida:
+                saida.writelines(exporta(ta))
+        else:
+            for parte in exporta(ta):
+                self.stdout.write(parte, ending='')
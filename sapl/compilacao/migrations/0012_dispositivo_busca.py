@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def atualiza_busca(apps, schema_editor):
+    Dispositivo = apps.get_model('compilacao', 'Dispositivo')
+    Dispositivo.objects.update(
+        busca=SearchVector('rotulo', weight='A', config='portuguese') +
+        SearchVector('texto', 'texto_atualizador', weight='B',
+                     config='portuguese'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compilacao', '0011_tipotextoarticulado_rodape_global'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispositivo',
+            name='busca',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='dispositivo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busca'], name='compilacao__busca_1e5e66_gin'),
+        ),
+        migrations.RunPython(atualiza_busca, migrations.RunPython.noop),
+    ]
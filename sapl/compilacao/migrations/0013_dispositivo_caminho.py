@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compilacao', '0012_dispositivo_busca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispositivo',
+            name='caminho',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='dispositivo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['caminho'], name='compilacao__caminho_702749_gin'),
+        ),
+        migrations.RunSQL(
+            '''
+            WITH RECURSIVE arvore(id, caminho) AS (
+                SELECT id, ARRAY[]::integer[]
+                  FROM compilacao_dispositivo
+                 WHERE dispositivo_pai_id IS NULL
+                UNION ALL
+                SELECT d.id, a.caminho || d.dispositivo_pai_id
+                  FROM compilacao_dispositivo d
+                  JOIN arvore a ON d.dispositivo_pai_id = a.id
+            )
+            UPDATE compilacao_dispositivo d
+               SET caminho = a.caminho
+              FROM arvore a
+             WHERE d.id = a.id
+            ''', migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compilacao', '0013_dispositivo_caminho'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            '''
+            CREATE FUNCTION compilacao_dispositivo_busca() RETURNS trigger AS $$
+            BEGIN
+                NEW.busca :=
+                    setweight(to_tsvector('portuguese',
+                        COALESCE(NEW.rotulo, '')), 'A') ||
+                    setweight(to_tsvector('portuguese',
+                        COALESCE(NEW.texto, '') || ' ' ||
+                        COALESCE(NEW.texto_atualizador, '')), 'B');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER compilacao_dispositivo_busca
+                BEFORE INSERT OR UPDATE OF rotulo, texto, texto_atualizador
+                ON compilacao_dispositivo
+                FOR EACH ROW EXECUTE PROCEDURE compilacao_dispositivo_busca();
+            ''',
+            '''
+            DROP TRIGGER compilacao_dispositivo_busca
+                ON compilacao_dispositivo;
+            DROP FUNCTION compilacao_dispositivo_busca();
+            '''),
+    ]
@@ -1,10 +1,19 @@
 
+from collections import OrderedDict
+from datetime import timedelta
+from types import SimpleNamespace
+
 from bs4 import BeautifulSoup
 from django.contrib import messages
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
 from django.db import models
-from django.db.models import F, Q
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.expressions import RawSQL
 from django.db.models.aggregates import Max
 from django.db.models.deletion import PROTECT
 from django.http.response import Http404
@@ -15,10 +24,13 @@ from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
 import reversion
 
-from sapl.compilacao.utils import (get_integrations_view_names, int_to_letter,
-                                   int_to_roman)
+from sapl.compilacao.utils import (atualiza_versao_texto_articulado,
+                                   get_integrations_view_names, int_to_letter,
+                                   int_to_roman, versao_texto_articulado)
 from sapl.utils import YES_NO_CHOICES, get_settings_auth_user_model
 
+CHAVE_VIGENCIAS_TA = 'sapl_compilacao_vigencias_{}'
+CHAVE_DESATIVADOS_VIGENCIA_TA = 'sapl_compilacao_desativados_{}_{}'
 
 @reversion.register()
 class TimestampedMixin(models.Model):
@@ -266,6 +278,70 @@ class TextoArticulado(TimestampedMixin):
         md5.update(data.encode('utf-8'))
         return md5.hexdigest()
 
+    def vigencias(self):
+        '''
+        Linha do tempo das vigências do texto, uma entrada por data de
+        início de vigência, com o fim de cada vigência calculado a partir
+        do início da seguinte. É calculada uma vez por versão do texto e
+        guardada no cache.
+        '''
+        versao = versao_texto_articulado(self.pk)
+        chave = CHAVE_VIGENCIAS_TA.format(self.pk)
+        vigencias = cache.get(chave)
+        if vigencias and vigencias[0] == versao:
+            return vigencias[1]
+
+        itens = list(Dispositivo.objects.filter(
+            ta_id=self.pk,
+        ).order_by(
+            'inicio_vigencia'
+        ).distinct(
+            'inicio_vigencia'
+        ).values_list('inicio_vigencia', 'ta_id', 'ta_publicado_id'))
+
+        tas = {ta.pk: ta for ta in TextoArticulado.objects.filter(
+            pk__in={i[1] for i in itens} | {i[2] for i in itens if i[2]}
+        ).select_related('tipo_ta')}
+
+        lista = []
+        for i, (inicio_vigencia, ta_id, ta_publicado_id) in enumerate(itens):
+            ta = tas[ta_id]
+            ta_publicado = tas.get(ta_publicado_id)
+            lista.append(SimpleNamespace(
+                ta_id=ta_id,
+                ta_publicado_id=ta_publicado_id,
+                ta=str(ta),
+                ta_publicado=str(ta_publicado) if ta_publicado else None,
+                ano=ta_publicado.ano if ta_publicado else ta.ano,
+                inicio_vigencia=inicio_vigencia,
+                fim_vigencia=itens[i + 1][0] - timedelta(days=1)
+                if i + 1 < len(itens) else None))
+
+        cache.set(chave, (versao, lista))
+        return lista
+
+    def desativados_na_vigencia(self, fim_vigencia):
+        '''
+        Retorna o conjunto dos pks dos dispositivos exibidos na vigência que
+        termina em fim_vigencia mas que, nesta vigência, já não estão
+        vigentes. O resultado é guardado no cache por versão do texto e
+        vigência.
+        '''
+        versao = versao_texto_articulado(self.pk)
+        chave = CHAVE_DESATIVADOS_VIGENCIA_TA.format(self.pk, fim_vigencia)
+        vigencia = cache.get(chave)
+        if vigencia and vigencia[0] == versao:
+            return vigencia[1]
+
+        desativados = set(Dispositivo.objects.filter(
+            ta_id=self.pk,
+            ordem__gt=0,
+            inicio_vigencia__lte=fim_vigencia,
+            fim_vigencia__lt=fim_vigencia).values_list('pk', flat=True))
+
+        cache.set(chave, (versao, desativados))
+        return desativados
+
     def can_use_dynamic_editing(self, user):
         return not self.editing_locked and\
             (not self.editable_only_by_owners and
@@ -438,20 +514,21 @@ class TextoArticulado(TimestampedMixin):
 
         ta = TextoArticulado.update_or_create(view_integracao, obj)
 
-        dispositivos = Dispositivo.objects.filter(ta=self).order_by('ordem')
-
-        map_ids = {}
+        # TODO
+        # validar isso: é o suficiente para pegar apenas o texto válido?
+        # exemplo:
+        #  quando uma matéria for alterada por uma emenda
+        #  ao usar esta função para gerar uma norma deve vir apenas
+        #  o texto válido, compilado...
+        dispositivos = list(Dispositivo.objects.filter(
+            ta=self, dispositivo_subsequente__isnull=True).order_by('ordem'))
+
+        # Primeira fase: os dispositivos são inseridos em lote, sem pai e
+        # sem raiz, que referenciam dispositivos ainda não clonados
+        ids_antigos = [d.id for d in dispositivos]
+        pais = {}
         for d in dispositivos:
-            id_old = d.id
-
-            # TODO
-            # validar isso: é o suficiente para pegar apenas o texto válido?
-            # exemplo:
-            #  quando uma matéria for alterada por uma emenda
-            #  ao usar esta função para gerar uma norma deve vir apenas
-            #  o texto válido, compilado...
-            if d.dispositivo_subsequente:
-                continue
+            pais[d.id] = d.dispositivo_pai_id
 
             d.id = None
             d.inicio_vigencia = ta.data
@@ -461,72 +538,108 @@ class TextoArticulado(TimestampedMixin):
             d.publicacao = None
             d.ta = ta
             d.ta_publicado = None
+            d.dispositivo_pai = None
+            d.dispositivo_raiz = None
+            d.caminho = []
             d.dispositivo_subsequente = None
             d.dispositivo_substituido = None
             d.dispositivo_vigencia = None
             d.dispositivo_atualizador = None
-            d.save()
-            map_ids[id_old] = d.id
-
-        dispositivos = Dispositivo.objects.filter(ta=ta).order_by('ordem')
 
-        for d in dispositivos:
-            if not d.dispositivo_pai:
+        Dispositivo.objects.bulk_create(dispositivos)
+        # a ordem de dispositivos é a única correspondência confiável entre
+        # os ids antigos e os novos
+        map_ids = dict(zip(ids_antigos, (d.id for d in dispositivos)))
+
+        # Segunda fase: pai, raiz e caminho apontam para os dispositivos
+        # clonados
+        def caminho(id_old):
+            c = []
+            while pais[id_old]:
+                id_old = pais[id_old]
+                c.insert(0, map_ids[id_old])
+            return c
+
+        arvore = []
+        for id_old in ids_antigos:
+            pai_old = pais[id_old]
+            if not pai_old:
                 continue
-
-            d.dispositivo_pai_id = map_ids[d.dispositivo_pai_id]
-            d.save()
+            c = caminho(id_old)
+            arvore.append((map_ids[id_old], map_ids[pai_old], c[0], c))
+
+        tamanho = Dispositivo.TAMANHO_LOTE_ORDEM
+        for inicio in range(0, len(arvore), tamanho):
+            lote = arvore[inicio:inicio + tamanho]
+            Dispositivo.objects.filter(pk__in=[i[0] for i in lote]).update(
+                dispositivo_pai_id=Case(
+                    *[When(pk=pk, then=Value(pai))
+                      for pk, pai, r, c in lote],
+                    output_field=models.IntegerField()),
+                dispositivo_raiz_id=Case(
+                    *[When(pk=pk, then=Value(r)) for pk, pai, r, c in lote],
+                    output_field=models.IntegerField()),
+                caminho=Case(
+                    *[When(pk=pk, then=Value(c)) for pk, pai, r, c in lote],
+                    output_field=ArrayField(models.IntegerField())))
 
         return ta
 
-    def reagrupar_ordem_de_dispositivos(self):
-
+    def atualizar_ordem_de_dispositivos(self, pks):
+        '''
+        Grava a ordem dos dispositivos do texto conforme a sequência pks,
+        com espaçamento INTERVALO_ORDEM, em UPDATEs de até
+        TAMANHO_LOTE_ORDEM dispositivos cada.
+        '''
         dpts = Dispositivo.objects.filter(ta=self)
 
-        if not dpts.exists():
-            return
+        # Afasta as ordens atuais da faixa que será gravada para não violar
+        # a restrição de unicidade (ta, ordem) durante a atualização
+        ordem_max = dpts.aggregate(Max('ordem'))['ordem__max'] or 0
+        dpts.update(ordem=F('ordem') + max(
+            ordem_max, len(pks) * Dispositivo.INTERVALO_ORDEM) +
+            Dispositivo.INTERVALO_ORDEM)
 
-        ordem_max = dpts.last().ordem
-        dpts.update(ordem=F('ordem') + ordem_max)
+        Dispositivo.gravar_ordens(
+            [(pk, (i + 1) * Dispositivo.INTERVALO_ORDEM)
+             for i, pk in enumerate(pks)])
+        atualiza_versao_texto_articulado(self.pk)
 
-        dpts = Dispositivo.objects.filter(
-            ta=self).values_list('pk', flat=True).order_by('ordem')
+    def reagrupar_ordem_de_dispositivos(self):
 
-        count = 0
-        for d in dpts:
-            count += Dispositivo.INTERVALO_ORDEM
-            Dispositivo.objects.filter(pk=d).update(ordem=count)
+        pks = list(Dispositivo.objects.filter(
+            ta=self).values_list('pk', flat=True).order_by('ordem'))
+
+        if pks:
+            self.atualizar_ordem_de_dispositivos(pks)
 
     def reordenar_dispositivos(self):
 
-        dpts = Dispositivo.objects.filter(ta=self)
+        dpts = list(Dispositivo.objects.filter(ta=self).values_list(
+            'pk', 'dispositivo_pai_id').order_by('ordem'))
 
-        if not dpts.exists():
+        if not dpts:
             return
 
-        ordem_max = dpts.last().ordem
-        dpts.update(ordem=F('ordem') + ordem_max)
+        # Árvore carregada em uma única consulta; a nova ordem é a de um
+        # percurso em profundidade, respeitando a ordem atual entre irmãos
+        filhos = OrderedDict()
+        for pk, pai_id in dpts:
+            filhos.setdefault(pai_id, []).append(pk)
+            filhos.setdefault(pk, [])
 
-        raizes = Dispositivo.objects.filter(
-            ta=self,
-            dispositivo_pai__isnull=True).values_list(
-                'pk', flat=True).order_by('ordem')
+        pks = []
+        pilha = list(reversed(filhos.get(None, [])))
+        while pilha:
+            pk = pilha.pop()
+            pks.append(pk)
+            pilha.extend(reversed(filhos[pk]))
 
-        count = []
-        count.append(Dispositivo.INTERVALO_ORDEM)
+        # Dispositivos cujo pai pertence a outro texto vão para o final
+        visitados = set(pks)
+        pks.extend(pk for pk, pai_id in dpts if pk not in visitados)
 
-        def update(dpk):
-            Dispositivo.objects.filter(pk=dpk).update(ordem=count[0])
-            count[0] = count[0] + Dispositivo.INTERVALO_ORDEM
-            filhos = Dispositivo.objects.filter(
-                dispositivo_pai_id=dpk).values_list(
-                'pk', flat=True).order_by('ordem')
-
-            for dpk in filhos:
-                update(dpk)
-
-        for dpk in raizes:
-            update(dpk)
+        self.atualizar_ordem_de_dispositivos(pks)
 
 
 @reversion.register()
@@ -876,6 +989,8 @@ class Publicacao(TimestampedMixin):
 class Dispositivo(BaseModel, TimestampedMixin):
     TEXTO_PADRAO_DISPOSITIVO_REVOGADO = force_text(_('(Revogado)'))
     INTERVALO_ORDEM = 1000
+    TAMANHO_LOTE_ORDEM = 500
+    ESPACO_MINIMO = INTERVALO_ORDEM // 10
     ordem = models.PositiveIntegerField(
         default=0,
         verbose_name=_('Ordem de Renderização'))
@@ -1021,10 +1136,20 @@ class Dispositivo(BaseModel, TimestampedMixin):
         default=False,
         choices=YES_NO_CHOICES, verbose_name=_('Contagem contínua'))
 
+    # Vetor de busca textual de rótulo e texto, mantido por um trigger no
+    # banco (migração 0014) em toda gravação desses campos, inclusive em
+    # bulk_create e update
+    busca = SearchVectorField(null=True, editable=False)
+
+    # Pks dos ancestrais, da raiz ao pai, mantidos pelo save
+    caminho = ArrayField(models.IntegerField(), default=list, blank=True,
+                         editable=False)
+
     class Meta:
         verbose_name = _('Dispositivo')
         verbose_name_plural = _('Dispositivos')
         ordering = ['ta', 'ordem']
+        indexes = [GinIndex(fields=['busca']), GinIndex(fields=['caminho'])]
         unique_together = (
             ('ta', 'ordem',),
             ('ta',
@@ -1107,12 +1232,15 @@ class Dispositivo(BaseModel, TimestampedMixin):
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None, clean=True):
 
-        self.dispositivo_raiz = self.get_raiz()
-        if self.dispositivo_raiz == self:
-            self.dispositivo_raiz = None
-
         self.contagem_continua = self.tipo_dispositivo.contagem_continua
 
+        caminho = self.calcula_caminho()
+        mover_subarvore = self.pk and caminho != self.caminho
+        self.caminho = caminho
+
+        # a raiz é o primeiro ancestral do caminho
+        self.dispositivo_raiz_id = caminho[0] if caminho else None
+
         try:
             if self.texto:
                 self.texto = str(BeautifulSoup(self.texto, "html.parser"))
@@ -1122,10 +1250,35 @@ class Dispositivo(BaseModel, TimestampedMixin):
         except:
             pass
 
-        return super().save(
+        r = super().save(
             force_insert=force_insert, force_update=force_update, using=using,
             update_fields=update_fields, clean=clean)
 
+        if mover_subarvore:
+            self.mover_subarvore()
+        return r
+
+    def calcula_caminho(self):
+        if self.dispositivo_pai_id is None:
+            return []
+        return Dispositivo.objects.values_list('caminho', flat=True).get(
+            pk=self.dispositivo_pai_id) + [self.dispositivo_pai_id]
+
+    def mover_subarvore(self):
+        '''
+        Troca, em uma única atualização, o prefixo do caminho de todos os
+        descendentes de self pelo caminho atual de self.
+        '''
+        Dispositivo.objects.filter(caminho__contains=[self.pk]).update(
+            caminho=RawSQL(
+                '%s::integer[] || caminho[array_position(caminho, %s):'
+                'array_length(caminho, 1)]', (self.caminho, self.pk)),
+            dispositivo_raiz_id=self.caminho[0] if self.caminho else self.pk)
+        atualiza_versao_texto_articulado(self.ta_id)
+
+    def get_descendentes(self):
+        return Dispositivo.objects.filter(caminho__contains=[self.pk])
+
     def __str__(self):
         return '%(rotulo)s' % {
             'rotulo': (self.rotulo if self.rotulo else self.tipo_dispositivo)}
@@ -1403,7 +1556,33 @@ class Dispositivo(BaseModel, TimestampedMixin):
 
         return result
 
+    @staticmethod
+    def gravar_ordens(ordens):
+        '''
+        Grava as ordens da lista de pares (pk, ordem) em UPDATEs de até
+        TAMANHO_LOTE_ORDEM dispositivos cada.
+        '''
+        tamanho = Dispositivo.TAMANHO_LOTE_ORDEM
+        for inicio in range(0, len(ordens), tamanho):
+            lote = ordens[inicio:inicio + tamanho]
+            Dispositivo.objects.filter(pk__in=[pk for pk, o in lote]).update(
+                ordem=Case(*[When(pk=pk, then=Value(o)) for pk, o in lote],
+                           output_field=models.PositiveIntegerField()))
+
     def criar_espaco(self, espaco_a_criar, local=None):
+        return self.reservar_ordens(espaco_a_criar, local)[0]
+
+    def reservar_ordens(self, espaco_a_criar, local=None):
+        '''
+        Retorna espaco_a_criar ordens livres e crescentes no ponto de
+        inserção definido por local.
+
+        As ordens são tomadas do intervalo entre o ponto de inserção e o
+        dispositivo anterior, sem alterar nenhum dispositivo. Somente quando
+        o intervalo se esgota os dispositivos seguintes são redistribuídos,
+        numa janela que cresce até haver folga de ao menos ESPACO_MINIMO
+        entre eles, ou até o fim do texto.
+        '''
 
         if local == 'json_add_next':
             proximo_bloco = Dispositivo.objects.filter(
@@ -1425,51 +1604,87 @@ class Dispositivo(BaseModel, TimestampedMixin):
                 ordem__gte=self.ordem,
                 ta_id=self.ta_id).first()
 
-        if proximo_bloco:
-            ordem = proximo_bloco.ordem
-            proximo_bloco = Dispositivo.objects.order_by('-ordem').filter(
-                ordem__gte=ordem,
-                ta_id=self.ta_id)
+        dpts = Dispositivo.objects.filter(ta_id=self.ta_id)
 
-            proximo_bloco.update(ordem=F('ordem') + 1)
-            proximo_bloco.update(
-                ordem=F('ordem') + (
-                    Dispositivo.INTERVALO_ORDEM * espaco_a_criar - 1))
-        else:
+        if not proximo_bloco:
             # inserção no fim do ta
-            ordem_max = Dispositivo.objects.order_by(
-                'ordem').filter(
-                ta_id=self.ta_id).aggregate(
-                Max('ordem'))
+            ordem_max = dpts.aggregate(Max('ordem'))
             if ordem_max['ordem__max'] is None:
                 raise Exception(
                     _('Não existem registros base neste Texto Articulado'))
-            ordem = ordem_max['ordem__max'] + Dispositivo.INTERVALO_ORDEM
-        return ordem
+            return [ordem_max['ordem__max'] + Dispositivo.INTERVALO_ORDEM * i
+                    for i in range(1, espaco_a_criar + 1)]
+
+        anterior = dpts.filter(
+            ordem__lt=proximo_bloco.ordem).aggregate(
+            Max('ordem'))['ordem__max'] or 0
+
+        passo = (proximo_bloco.ordem - anterior) // (espaco_a_criar + 1)
+        if passo:
+            return [anterior + passo * i
+                    for i in range(1, espaco_a_criar + 1)]
+
+        # Intervalo esgotado: redistribui uma janela local
+        seguintes = dpts.filter(
+            ordem__gte=proximo_bloco.ordem).order_by('ordem').values_list(
+            'pk', 'ordem')
+        tamanho = 16
+        while True:
+            janela = list(seguintes[:tamanho + 1])
+            if len(janela) <= tamanho:
+                passo = Dispositivo.INTERVALO_ORDEM
+                break
+            limite = janela.pop()[1]
+            passo = (limite - anterior) // (len(janela) + espaco_a_criar + 1)
+            if passo >= Dispositivo.ESPACO_MINIMO:
+                break
+            tamanho *= 2
+
+        # Afasta a janela para depois do último dispositivo do texto antes
+        # de gravar as novas ordens, preservando a unicidade (ta, ordem)
+        ordem_max = dpts.aggregate(Max('ordem'))['ordem__max']
+        dpts.filter(pk__in=[pk for pk, o in janela]).update(
+            ordem=F('ordem') + ordem_max)
+
+        Dispositivo.gravar_ordens(
+            [(pk, anterior + passo * (espaco_a_criar + 1 + i))
+             for i, (pk, o) in enumerate(janela)])
+        atualiza_versao_texto_articulado(self.ta_id)
+
+        return [anterior + passo * i for i in range(1, espaco_a_criar + 1)]
 
     def organizar_niveis(self):
+        '''
+        Recalcula o nível de toda a subárvore de self a partir do nível do
+        seu pai. Apenas a subárvore é carregada, pelo caminho de ancestrais,
+        e os níveis alterados são gravados em lote, sem passar pelo save dos
+        dispositivos.
+        '''
         if self.dispositivo_pai is None:
             self.nivel = 0
         else:
             self.nivel = self.dispositivo_pai.nivel + 1
 
-        filhos = Dispositivo.objects.filter(
-            dispositivo_pai_id=self.pk)
+        # a profundidade de cada descendente em relação a self é dada pela
+        # posição de self em seu caminho
+        alterados = {}
+        for pk, caminho, nivel in self.get_descendentes().values_list(
+                'pk', 'caminho', 'nivel'):
+            novo = self.nivel + len(caminho) - caminho.index(self.pk)
+            if nivel != novo:
+                alterados.setdefault(novo, []).append(pk)
 
-        for filho in filhos:
-            filho.nivel = self.nivel + 1
-            filho.save()
-            filho.organizar_niveis()
+        for nivel, pks in alterados.items():
+            Dispositivo.objects.filter(pk__in=pks).update(nivel=nivel)
+        if alterados:
+            atualiza_versao_texto_articulado(self.ta_id)
 
     def get_parents(self, ordem='desc'):
-        dp = self
-        p = []
-        while dp.dispositivo_pai:
-            dp = dp.dispositivo_pai
-            if ordem == 'desc':
-                p.append(dp)
-            else:
-                p.insert(0, dp)
+        parents = Dispositivo.objects.select_related(
+            'tipo_dispositivo').in_bulk(self.caminho)
+        p = [parents[pk] for pk in self.caminho]
+        if ordem == 'desc':
+            p.reverse()
 
         return p
 
@@ -1716,6 +1931,8 @@ class Dispositivo(BaseModel, TimestampedMixin):
             Dispositivo.objects.filter(pk=d).update(
                 ordem_bloco_atualizador=count)
 
+        atualiza_versao_texto_articulado(self.ta_id)
+
 
 @reversion.register()
 class Vide(TimestampedMixin):
@@ -1,14 +1,18 @@
 
 from django import template
+from django.core.cache import cache
 from django.core.signing import Signer
 from django.db.models import Q
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from sapl.compilacao.models import Dispositivo
+from sapl.compilacao.utils import versao_texto_articulado
 
 register = template.Library()
 
+CHAVE_HERANCAS = 'sapl_compilacao_herancas_{}'
+
 
 class DispositivoTreeNode(template.Node):
 
@@ -64,7 +68,13 @@ def get_bloco_atualizador(pk_atualizador):
 
 
 @register.simple_tag
-def dispositivo_desativado(dispositivo, inicio_vigencia, fim_vigencia):
+def dispositivo_desativado(dispositivo, inicio_vigencia, fim_vigencia,
+                           desativados=None):
+    # desativados: pks pré-calculados por
+    # TextoArticulado.desativados_na_vigencia
+    if desativados is not None:
+        return 'desativado' if dispositivo.pk in desativados else ''
+
     if inicio_vigencia and fim_vigencia:
         if dispositivo.fim_vigencia is None:
             return ''
@@ -185,55 +195,52 @@ def update_dispositivos_parents(dpts_parents, ta_id):
     dpts = Dispositivo.objects.order_by('ordem').filter(
         ta_id=ta_id).values_list(
         'pk', 'dispositivo_pai_id', 'rotulo', 'tipo_dispositivo__nome',
-        'tipo_dispositivo__rotulo_prefixo_texto')
+        'tipo_dispositivo__rotulo_prefixo_texto', 'caminho')
 
+    # O caminho traz os ancestrais da raiz ao pai; a herança os usa do pai
+    # para a raiz
     for d in dpts:
         dpts_parents[str(d[0])] = {
-            'd': d, 'p': [], 'h': None}
-
-    def parents(k):
-        pai = dpts_parents[str(k)]['d'][1]
-        p = dpts_parents[str(k)]['p']
-        if not p:
-            if pai:
-                parent_k = [pai, ] + parents(pai)
-            else:
-                parent_k = []
-        else:
-            parent_k = p
+            'd': d[:5], 'p': d[5][::-1], 'h': None}
+
+
+def herancas_texto_articulado(ta_id, forcar=False):
+    '''
+    Mapa de ancestrais dos dispositivos do texto articulado ta_id. O mapa
+    é montado uma vez por versão do texto e compartilhado entre usuários
+    e workers através do cache; forcar o remonta sob a versão atual.
+    '''
+    versao = versao_texto_articulado(ta_id)
+    chave = CHAVE_HERANCAS.format(ta_id)
 
-        return parent_k
+    herancas = None if forcar else cache.get(chave)
+    if not herancas or herancas[0] != versao:
+        dpts_parents = {}
+        update_dispositivos_parents(dpts_parents, ta_id)
+        herancas = (versao, dpts_parents)
+        cache.set(chave, herancas)
 
-    for k in dpts_parents:
-        dpts_parents[str(k)]['p'] = parents(k)
+    return herancas[1]
 
 
 @register.simple_tag
 def heranca(request, d, ignore_ultimo=0, ignore_primeiro=0):
-    ta_dpts_parents = request.session.get('herancas')
-
-    if not ta_dpts_parents:
-        ta_dpts_parents = {}
+    # O mapa é obtido do cache uma vez por requisição e texto articulado
+    if not hasattr(request, 'herancas'):
+        request.herancas = {}
+    ta_dpts_parents = request.herancas
 
     ta_id = str(d.ta_id)
     d_pk = str(d.pk)
-    if ta_id not in ta_dpts_parents or d_pk not in ta_dpts_parents[ta_id]:
-        # print('recarregando estrutura temporaria de heranças')
-        dpts_parents = {}
-        ta_dpts_parents[ta_id] = dpts_parents
-        update_dispositivos_parents(dpts_parents, ta_id)
-
-        herancas_fila = request.session.get('herancas_fila')
-        if not herancas_fila:
-            herancas_fila = []
-
-        herancas_fila.append(ta_id)
-        if len(herancas_fila) > 100:
-            ta_remove = herancas_fila.pop(0)
-            del ta_dpts_parents[str(ta_remove)]
-
-        request.session['herancas_fila'] = herancas_fila
-        request.session['herancas'] = ta_dpts_parents
+    if ta_id not in ta_dpts_parents:
+        ta_dpts_parents[ta_id] = herancas_texto_articulado(ta_id)
+
+    if d_pk not in ta_dpts_parents[ta_id]:
+        # Remonta o mapa sem alterar a versão do texto, que invalidaria os
+        # demais caches do texto articulado
+        ta_dpts_parents[ta_id] = herancas_texto_articulado(ta_id, forcar=True)
+        if d_pk not in ta_dpts_parents[ta_id]:
+            return ''
 
     h = ta_dpts_parents[ta_id][d_pk]['h']
 
@@ -269,16 +276,14 @@ def heranca(request, d, ignore_ultimo=0, ignore_primeiro=0):
 
 @register.simple_tag
 def nomenclatura_heranca(d, ignore_ultimo=0, ignore_primeiro=0):
-    result = ''
-    while d is not None:
-
-        if ignore_ultimo and d.dispositivo_pai is None:
-            break
-        if ignore_primeiro:
-            ignore_primeiro = 0
-            d = d.dispositivo_pai
-            continue
+    dpts = [d] + d.get_parents()
+    if ignore_ultimo:
+        dpts = dpts[:-1]
+    if ignore_primeiro:
+        dpts = dpts[1:]
 
+    result = ''
+    for d in dpts:
         if d.rotulo != '':
             if d.tipo_dispositivo.rotulo_prefixo_texto != '':
                 result = d.rotulo + ' ' + result
@@ -288,7 +293,6 @@ def nomenclatura_heranca(d, ignore_ultimo=0, ignore_primeiro=0):
         else:
             result = '(' + d.tipo_dispositivo.nome + \
                 d.rotulo_padrao() + ')' + ' ' + result
-        d = d.dispositivo_pai
 
     return result
 
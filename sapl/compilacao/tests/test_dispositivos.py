@@ -0,0 +1,410 @@
+from datetime import date
+from xml.etree import ElementTree
+import json
+
+import pytest
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
+
+from sapl.compilacao.models import (STATUS_TA_PUBLIC, Dispositivo,
+                                    TextoArticulado, TipoDispositivo,
+                                    TipoTextoArticulado)
+from sapl.compilacao.templatetags.compilacao_filters import (
+    heranca, nomenclatura_heranca)
+from sapl.compilacao.utils import versao_texto_articulado
+from sapl.compilacao.views import DispositivoSearchFragmentFormView
+from sapl.materia.models import MateriaLegislativa
+import sapl.materia.views  # noqa: registra a integração com matérias
+
+
+def cria_texto_sintetico(larguras):
+    '''
+    Cria um texto articulado em que cada nível da árvore de dispositivos
+    tem, para cada dispositivo do nível anterior, larguras[nivel] filhos.
+    Os dispositivos são ordenados nível a nível, e não pelo percurso em
+    profundidade, para que precisem ser reordenados.
+    '''
+    ta = mommy.make(TextoArticulado)
+    tipo = mommy.make(TipoDispositivo)
+
+    pais = [None]
+    dispositivos = []
+    for nivel, largura in enumerate(larguras):
+        novos = Dispositivo.objects.bulk_create([
+            Dispositivo(ta=ta,
+                        tipo_dispositivo=tipo,
+                        dispositivo_pai=pai,
+                        caminho=pai.caminho + [pai.pk] if pai else [],
+                        dispositivo0=len(dispositivos) + i + 1,
+                        nivel=nivel,
+                        ordem=(len(dispositivos) + i + 1) *
+                        Dispositivo.INTERVALO_ORDEM,
+                        inicio_vigencia=date(2019, 1, 1),
+                        inicio_eficacia=date(2019, 1, 1))
+            for i, pai in enumerate(
+                [pai for pai in pais for _ in range(largura)])])
+        dispositivos += novos
+        pais = novos
+
+    return ta
+
+
+def percurso_em_profundidade(ta):
+    filhos = {}
+    for d in Dispositivo.objects.filter(ta=ta).order_by('ordem'):
+        filhos.setdefault(d.dispositivo_pai_id, []).append(d.pk)
+
+    def percorre(pai_id):
+        for pk in filhos.get(pai_id, []):
+            yield pk
+            yield from percorre(pk)
+
+    return list(percorre(None))
+
+
+def reordena(larguras):
+    ta = cria_texto_sintetico(larguras)
+    esperado = percurso_em_profundidade(ta)
+
+    with CaptureQueriesContext(connection) as consultas:
+        ta.reordenar_dispositivos()
+
+    ordens = list(Dispositivo.objects.filter(ta=ta).order_by(
+        'ordem').values_list('pk', 'ordem'))
+    assert [pk for pk, ordem in ordens] == esperado
+    assert [ordem for pk, ordem in ordens] == [
+        (i + 1) * Dispositivo.INTERVALO_ORDEM for i in range(len(ordens))]
+
+    return len(consultas)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_reordenar_dispositivos():
+    # 3 + 9 + 27 dispositivos contra 7 + 49 + 343: o número de consultas
+    # não depende do tamanho do texto enquanto couber em um lote
+    assert reordena((3, 3, 3)) == reordena((7, 7, 7))
+
+
+@pytest.mark.django_db(transaction=False)
+def test_reagrupar_ordem_de_dispositivos():
+    ta = cria_texto_sintetico((2, 2))
+    Dispositivo.objects.filter(ta=ta).update(ordem=F('ordem') * 3 + 7)
+    pks = list(Dispositivo.objects.filter(ta=ta).order_by(
+        'ordem').values_list('pk', flat=True))
+
+    ta.reagrupar_ordem_de_dispositivos()
+
+    assert list(Dispositivo.objects.filter(ta=ta).order_by(
+        'ordem').values_list('pk', 'ordem')) == [
+        (pk, (i + 1) * Dispositivo.INTERVALO_ORDEM)
+        for i, pk in enumerate(pks)]
+
+
+@pytest.mark.django_db(transaction=False)
+def test_criar_espaco_usa_intervalo_entre_dispositivos():
+    ta = cria_texto_sintetico((3, 10))
+    dpts = list(Dispositivo.objects.filter(ta=ta).order_by('ordem'))
+    base = dpts[1]
+
+    with CaptureQueriesContext(connection) as consultas:
+        ordens = base.reservar_ordens(2)
+    assert not [q for q in consultas if q['sql'].startswith('UPDATE')]
+    assert dpts[0].ordem < ordens[0] < ordens[1] < base.ordem
+
+    # sem intervalo livre, apenas uma janela local é redistribuída
+    Dispositivo.objects.filter(pk=base.pk).update(ordem=dpts[0].ordem + 1)
+    base.refresh_from_db()
+    ordens = base.reservar_ordens(1)
+
+    novas = list(Dispositivo.objects.filter(ta=ta).order_by(
+        'ordem').values_list('pk', 'ordem'))
+    assert [pk for pk, ordem in novas] == [d.pk for d in dpts]
+    assert novas[0][1] < ordens[0] < novas[1][1]
+    assert novas[0][1] == dpts[0].ordem
+    assert novas[-1][1] == dpts[-1].ordem
+
+
+@pytest.mark.django_db(transaction=False)
+def test_organizar_niveis():
+    ta = cria_texto_sintetico((2, 2, 2))
+    raizes = Dispositivo.objects.filter(ta=ta, dispositivo_pai__isnull=True)
+    movido = raizes[1]
+    movido.dispositivo_pai = raizes[0]
+    movido.save()
+
+    with CaptureQueriesContext(connection) as consultas:
+        movido.organizar_niveis()
+    # uma consulta para a subárvore e um UPDATE por nível alterado
+    assert len(consultas) == 3
+    assert '@>' in consultas.captured_queries[0]['sql']
+
+    assert movido.nivel == 1
+    movido.save()
+    for d in Dispositivo.objects.filter(ta=ta):
+        pai = d.dispositivo_pai
+        assert d.nivel == (pai.nivel + 1 if pai else 0)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_heranca_compartilhada_entre_requisicoes():
+    ta = cria_texto_sintetico((1, 1))
+    pai, filho = Dispositivo.objects.filter(ta=ta).order_by('ordem')
+    pai.rotulo = 'Art. 1º'
+    pai.save()
+
+    assert 'Art. 1º' in heranca(RequestFactory().get('/'), filho)
+
+    request = RequestFactory().get('/')
+    with CaptureQueriesContext(connection) as consultas:
+        assert 'Art. 1º' in heranca(request, filho)
+    assert len(consultas) == 0
+    assert not hasattr(request, 'session')
+
+    # alterar um dispositivo do texto invalida o mapa de heranças
+    pai.rotulo = 'Art. 2º'
+    pai.save()
+    assert 'Art. 2º' in heranca(RequestFactory().get('/'), filho)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_heranca_de_dispositivo_fora_do_mapa():
+    ta = cria_texto_sintetico((1,))
+    pai = Dispositivo.objects.get(ta=ta)
+    pai.rotulo = 'Art. 1º'
+    pai.save()
+    heranca(RequestFactory().get('/'), pai)
+
+    # bulk_create não dispara sinais, então o mapa em cache não o conhece
+    novo, = Dispositivo.objects.bulk_create([Dispositivo(
+        ta=ta, tipo_dispositivo=pai.tipo_dispositivo, dispositivo_pai=pai,
+        caminho=[pai.pk], nivel=1, dispositivo0=2, ordem=pai.ordem + 1,
+        inicio_vigencia=pai.inicio_vigencia,
+        inicio_eficacia=pai.inicio_eficacia)])
+    versao = versao_texto_articulado(ta.pk)
+
+    assert 'Art. 1º' in heranca(RequestFactory().get('/'), novo)
+    # remontar o mapa não invalida os demais caches do texto
+    assert versao_texto_articulado(ta.pk) == versao
+
+    assert heranca(RequestFactory().get('/'),
+                   Dispositivo(pk=0, ta=ta)) == ''
+
+
+@pytest.mark.django_db(transaction=False)
+def test_texto_renderizado_em_cache(client):
+    ta = cria_texto_sintetico((2, 2))
+    ta.privacidade = STATUS_TA_PUBLIC
+    ta.save()
+    url = reverse('sapl.compilacao:ta_text', kwargs={'ta_id': ta.pk})
+    dispositivo = Dispositivo.objects.filter(ta=ta).last()
+
+    with CaptureQueriesContext(connection) as primeira:
+        response = client.get(url + '?embedded')
+    assert 'dptt%s' % dispositivo.pk in response.content.decode()
+
+    with CaptureQueriesContext(connection) as segunda:
+        assert client.get(url + '?embedded').content == response.content
+    assert len(segunda) < len(primeira)
+
+    # alterações no texto geram uma nova versão do texto renderizado
+    dispositivo.texto = 'Texto alterado'
+    dispositivo.save()
+    assert 'Texto alterado' in client.get(url + '?embedded').content.decode()
+
+
+@pytest.mark.django_db(transaction=False)
+def test_vigencias_pre_calculadas():
+    ta = cria_texto_sintetico((2, 2))
+    dpts = list(Dispositivo.objects.filter(ta=ta).order_by('ordem'))
+
+    # o último dispositivo passa a viger depois dos demais e o primeiro
+    # deixa de viger na vigência seguinte
+    dpts[-1].inicio_vigencia = date(2019, 6, 1)
+    dpts[-1].save()
+    dpts[0].fim_vigencia = date(2019, 5, 31)
+    dpts[0].save()
+
+    vigencias = ta.vigencias()
+    assert [(v.inicio_vigencia, v.fim_vigencia) for v in vigencias] == [
+        (date(2019, 1, 1), date(2019, 5, 31)), (date(2019, 6, 1), None)]
+
+    with CaptureQueriesContext(connection) as consultas:
+        ta.vigencias()
+    assert len(consultas) == 0
+
+    assert not ta.desativados_na_vigencia(date(2019, 5, 31))
+    assert ta.desativados_na_vigencia(date(2019, 12, 31)) == {dpts[0].pk}
+
+    with CaptureQueriesContext(connection) as consultas:
+        ta.desativados_na_vigencia(date(2019, 12, 31))
+    assert len(consultas) == 0
+
+
+@pytest.mark.django_db(transaction=False)
+def test_busca_textual_de_dispositivos():
+    ta = cria_texto_sintetico((1, 2))
+    raiz, primeiro, segundo = Dispositivo.objects.filter(
+        ta=ta).order_by('ordem')
+    primeiro.texto = 'Compete ao Município legislar sobre assuntos locais'
+    primeiro.save()
+    segundo.texto = 'O Município poderá celebrar convênios'
+    segundo.save()
+
+    def busca(texto):
+        view = DispositivoSearchFragmentFormView()
+        view.request = RequestFactory().get('/', {'texto': texto})
+        return list(view.get_queryset())
+
+    # a busca casa prefixos das palavras, em qualquer ordem
+    assert busca('legisl munic') == [primeiro]
+    assert set(busca('município')) == {primeiro, segundo}
+    assert busca('inexistente') == []
+
+    # palavras irrelevantes não restringem a busca
+    assert busca('ao município') == busca('município')
+    assert set(busca('de ao')) == {primeiro, segundo}
+
+    # o vetor de busca é mantido também em atualizações em lote, sem que o
+    # save execute um segundo UPDATE
+    Dispositivo.objects.filter(pk=segundo.pk).update(
+        texto='O Município poderá firmar consórcios')
+    assert busca('consórc') == [segundo]
+
+    primeiro.texto = 'Compete ao Município tributar'
+    with CaptureQueriesContext(connection) as consultas:
+        primeiro.save()
+    assert len([c for c in consultas.captured_queries
+                if c['sql'].startswith('UPDATE')]) == 1
+    assert busca('tribut') == [primeiro]
+
+
+@pytest.mark.django_db(transaction=False)
+def test_clone_for_copia_arvore_em_lote():
+    ta = cria_texto_sintetico((2, 3, 2))
+    ta.tipo_ta = mommy.make(TipoTextoArticulado)
+    ta.tipo_ta.content_type = ContentType.objects.get_for_model(
+        MateriaLegislativa)
+    ta.tipo_ta.save()
+    ta.save()
+    materia = mommy.make(MateriaLegislativa)
+
+    def arvore(ta):
+        dpts = list(Dispositivo.objects.filter(ta=ta).order_by('ordem'))
+        posicao = {d.pk: i for i, d in enumerate(dpts)}
+        return [(d.ordem, d.nivel, d.dispositivo0,
+                 posicao.get(d.dispositivo_pai_id)) for d in dpts]
+
+    with CaptureQueriesContext(connection) as consultas:
+        clone = ta.clone_for(materia)
+    # a árvore é copiada com um INSERT e um UPDATE, qualquer que seja o
+    # número de dispositivos
+    sql = [q['sql'] for q in consultas]
+    assert len([q for q in sql if q.startswith(
+        'INSERT INTO "compilacao_dispositivo"')]) == 1
+    assert len([q for q in sql if q.startswith(
+        'UPDATE "compilacao_dispositivo"')]) == 1
+
+    assert clone.pk != ta.pk
+    assert arvore(clone) == arvore(ta)
+    for d in Dispositivo.objects.filter(ta=clone):
+        raiz = d
+        while raiz.dispositivo_pai:
+            raiz = raiz.dispositivo_pai
+        assert d.dispositivo_raiz_id == (raiz.pk if raiz != d else None)
+        assert d.caminho == [p.pk for p in d.get_parents_asc()]
+
+
+@pytest.mark.django_db(transaction=False)
+def test_caminho_de_ancestrais():
+    ta = cria_texto_sintetico((2, 2, 2))
+    raizes = list(Dispositivo.objects.filter(
+        ta=ta, dispositivo_pai__isnull=True).order_by('ordem'))
+    folha = Dispositivo.objects.filter(ta=ta, nivel=2).last()
+
+    with CaptureQueriesContext(connection) as consultas:
+        parents = folha.get_parents()
+    assert len(consultas) == 1
+    assert parents == [folha.dispositivo_pai, raizes[1]]
+
+    tipo = folha.tipo_dispositivo
+    tipo.rotulo_prefixo_texto = 'Art.'
+    tipo.save()
+    for i, d in enumerate([folha] + parents):
+        d.rotulo = 'D%s' % i
+        d.save()
+    folha.refresh_from_db()
+    assert nomenclatura_heranca(folha).split() == ['D2', 'D1', 'D0']
+    assert nomenclatura_heranca(folha, 1, 1).split() == ['D1']
+
+    # o save não percorre os ancestrais: a raiz vem do caminho
+    def consultas_save(dispositivo):
+        dispositivo = Dispositivo.objects.get(pk=dispositivo.pk)
+        with CaptureQueriesContext(connection) as consultas:
+            dispositivo.save()
+        return len(consultas)
+
+    assert consultas_save(folha) == consultas_save(folha.dispositivo_pai)
+    assert Dispositivo.objects.get(pk=folha.pk).dispositivo_raiz == raizes[1]
+
+    # mover um dispositivo reescreve o caminho de toda a sua subárvore
+    # em uma única atualização
+    movido = raizes[1]
+    movido.dispositivo_pai = raizes[0]
+    with CaptureQueriesContext(connection) as consultas:
+        movido.save()
+    assert len([q for q in consultas
+                if 'array_position' in q['sql']]) == 1
+
+    assert set(raizes[0].get_descendentes()) == set(
+        Dispositivo.objects.filter(ta=ta).exclude(pk=raizes[0].pk))
+    for d in Dispositivo.objects.filter(ta=ta):
+        pai = d.dispositivo_pai
+        assert d.caminho == (pai.caminho + [pai.pk] if pai else [])
+        assert d.dispositivo_raiz_id == (
+            raizes[0].pk if d != raizes[0] else None)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_exportacao_do_texto_articulado(client):
+    ta = cria_texto_sintetico((2, 3))
+    ta.privacidade = STATUS_TA_PUBLIC
+    ta.save()
+    Dispositivo.objects.filter(ta=ta).update(rotulo='R')
+
+    def filhos(pai_id):
+        return list(Dispositivo.objects.filter(
+            ta=ta, dispositivo_pai_id=pai_id).order_by(
+            'ordem').values_list('pk', flat=True))
+
+    url = reverse('sapl.compilacao:ta_text_export',
+                  kwargs={'ta_id': ta.pk, 'formato': 'json'})
+    response = client.get(url)
+    assert response.streaming
+    dados = json.loads(b''.join(response.streaming_content).decode())
+    assert dados['texto_articulado']['id'] == ta.pk
+    assert [d['id'] for d in dados['dispositivos']] == filhos(None)
+    for d in dados['dispositivos']:
+        assert [f['id'] for f in d['filhos']] == filhos(d['id'])
+
+    # o ETag acompanha a versão do texto articulado
+    etag = response['ETag']
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    d = Dispositivo.objects.filter(ta=ta).first()
+    d.texto = 'Texto alterado'
+    d.save()
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    response = client.get(reverse(
+        'sapl.compilacao:ta_text_export',
+        kwargs={'ta_id': ta.pk, 'formato': 'xml'}))
+    xml = ElementTree.fromstring(b''.join(response.streaming_content))
+    texto = xml[0]
+    assert len([e for e in texto if e.tag.endswith('DispositivoGenerico')
+                ]) == 2
+    assert len(texto.findall('.//{%s}Rotulo' % 'http://www.lexml.gov.br/1.0'
+                             )) == 8
@@ -26,6 +26,9 @@ urlpatterns_compilacao = [
     url(r'^(?P<ta_id>[0-9]+)/text/vigencia/(?P<sign>.+)/$',
         views.TextView.as_view(), name='ta_vigencia'),
 
+    url(r'^(?P<ta_id>[0-9]+)/text/export\.(?P<formato>json|xml)$',
+        views.TextExportView.as_view(), name='ta_text_export'),
+
     url(r'^(?P<ta_id>[0-9]+)/text/edit',
         views.TextEditView.as_view(), name='ta_text_edit'),
 
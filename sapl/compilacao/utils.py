@@ -1,5 +1,7 @@
 import sys
 
+from sapl.utils import incrementa_versao, versao_compartilhada
+
 DISPOSITIVO_SELECT_RELATED = (
     'tipo_dispositivo',
     'ta_publicado',
@@ -26,6 +28,34 @@ DISPOSITIVO_SELECT_RELATED_EDIT = (
     'ta',)
 
 
+CHAVE_VERSAO_TA = 'sapl_compilacao_ta_versao_{}'
+CHAVE_VERSAO_GLOBAL_TA = 'sapl_compilacao_ta_versao'
+
+
+def versao_texto_articulado(ta_id):
+    '''
+    Versão do conteúdo do texto articulado ta_id, compartilhada entre os
+    workers através do cache. Muda sempre que dispositivos do texto são
+    alterados ou quando tipos de dispositivo, comuns a todos os textos,
+    mudam.
+    '''
+    return versao_compartilhada(
+        (CHAVE_VERSAO_GLOBAL_TA, CHAVE_VERSAO_TA.format(ta_id)))
+
+
+def atualiza_versao_texto_articulado(ta_id):
+    incrementa_versao(CHAVE_VERSAO_TA.format(ta_id))
+
+
+def atualiza_versao_textos_articulados(ta_ids):
+    for ta_id in set(ta_ids):
+        atualiza_versao_texto_articulado(ta_id)
+
+
+def atualiza_versao_global_texto_articulado():
+    incrementa_versao(CHAVE_VERSAO_GLOBAL_TA)
+
+
 def int_to_roman(int_value):
     # if isinstance(int_value, type(1)):
     #    raise TypeError("expected integer, got %s" % type(int_value))
@@ -1,6 +1,7 @@
 from collections import OrderedDict
 from datetime import timedelta
 import logging
+import re
 import sys
 
 from braces.views import FormMessagesMixin
@@ -10,26 +11,33 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.signing import Signer
 from django.core.urlresolvers import reverse, reverse_lazy
-from django.db import transaction
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import F, Q
 from django.db.models.query import QuerySet
 from django.http.response import (HttpResponse, HttpResponseRedirect,
-                                  JsonResponse, Http404)
+                                  JsonResponse, Http404, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
 from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
 from django.utils.translation import string_concat
 from django.utils.translation import ugettext_lazy as _
-from django.views.generic.base import TemplateView
+from django.views.decorators.http import condition
+from django.views.generic.base import TemplateView, View
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import (CreateView, DeleteView, FormView,
                                        UpdateView)
 from django.views.generic.list import ListView
 
 from sapl.compilacao.apps import AppConfig
+from sapl.compilacao.exportacao import EXPORTACOES
 from sapl.compilacao.forms import (DispositivoDefinidorVigenciaForm,
                                    DispositivoEdicaoAlteracaoForm,
                                    DispositivoEdicaoBasicaForm,
@@ -49,11 +57,15 @@ from sapl.compilacao.models import (STATUS_TA_EDITION, STATUS_TA_PRIVATE,
                                     VeiculoPublicacao, Vide)
 from sapl.compilacao.utils import (DISPOSITIVO_SELECT_RELATED,
                                    DISPOSITIVO_SELECT_RELATED_EDIT,
-                                   get_integrations_view_names)
+                                   atualiza_versao_textos_articulados,
+                                   get_integrations_view_names,
+                                   versao_texto_articulado)
 from sapl.crud.base import RP_DETAIL, RP_LIST, Crud, CrudAux, CrudListView,\
     make_pagination
 from sapl.settings import BASE_DIR
 
+CHAVE_TEXTO_RENDERIZADO = 'sapl_compilacao_texto_{}_{}_{}'
+
 
 TipoNotaCrud = CrudAux.build(TipoNota, 'tipo_nota')
 TipoVideCrud = CrudAux.build(TipoVide, 'tipo_vide')
@@ -833,6 +845,11 @@ class PublicacaoDeleteView(PublicacaoMixin, DeleteView):
 class TextView(CompMixin, ListView):
     template_name = 'compilacao/text_list.html'
 
+    # O texto renderizado para usuários anônimos é guardado no cache,
+    # por texto articulado, vigência e versão do conteúdo do texto
+    cache_texto = True
+    texto_renderizado = None
+
     flag_alteradora = -1
 
     flag_nivel_ini = 0
@@ -843,24 +860,42 @@ class TextView(CompMixin, ListView):
     inicio_vigencia = None
     fim_vigencia = None
     ta_vigencia = None
+    desativados = None
 
     def has_permission(self):
         self.object = self.ta
         return self.object.has_view_permission(self.request)
 
     def get(self, request, *args, **kwargs):
+        self.chave_texto = self.chave_texto_renderizado()
+        if self.chave_texto:
+            self.texto_renderizado = cache.get(self.chave_texto)
+
         if 'print' in request.GET:
             self.template_name = 'compilacao/text_list__print_version.html'
         if 'embedded' in request.GET:
-            self.template_name = 'compilacao/text_list__embedded.html'
+            self.template_name = 'compilacao/text_list__fragment.html' \
+                if self.chave_texto else 'compilacao/text_list__embedded.html'
         return ListView.get(self, request, *args, **kwargs)
 
+    def chave_texto_renderizado(self):
+        if not self.cache_texto or self.request.user.is_authenticated():
+            return None
+        return CHAVE_TEXTO_RENDERIZADO.format(
+            self.kwargs['ta_id'],
+            self.kwargs.get('sign', ''),
+            versao_texto_articulado(self.kwargs['ta_id']))
+
     def get_context_data(self, **kwargs):
         context = super(TextView, self).get_context_data(**kwargs)
 
         context['object'] = TextoArticulado.objects.get(
             pk=self.kwargs['ta_id'])
 
+        if self.texto_renderizado is not None:
+            context['texto_renderizado'] = mark_safe(self.texto_renderizado)
+            return context
+
         cita = Vide.objects.filter(
             Q(dispositivo_base__ta_id=self.kwargs['ta_id'])).\
             select_related(
@@ -908,6 +943,12 @@ class TextView(CompMixin, ListView):
 
         # context['vigencias'] = self.get_vigencias()
 
+        if self.chave_texto:
+            texto = render_to_string(
+                'compilacao/text_list__embedded.html', context, self.request)
+            cache.set(self.chave_texto, texto)
+            context['texto_renderizado'] = mark_safe(texto)
+
         return context
 
     def get_queryset(self):
@@ -918,6 +959,7 @@ class TextView(CompMixin, ListView):
         self.inicio_vigencia = None
         self.fim_vigencia = None
         self.ta_vigencia = None
+        self.desativados = None
         if 'sign' in self.kwargs:
             signer = Signer()
             try:
@@ -931,6 +973,8 @@ class TextView(CompMixin, ListView):
                     ta_id=self.kwargs['ta_id'],
                 ).select_related(*DISPOSITIVO_SELECT_RELATED)
 
+            self.desativados = self.object.desativados_na_vigencia(
+                self.fim_vigencia)
             return Dispositivo.objects.filter(
                 inicio_vigencia__lte=self.fim_vigencia,
                 ordem__gt=0,
@@ -946,31 +990,7 @@ class TextView(CompMixin, ListView):
             return r
 
     def get_vigencias(self):
-        itens = Dispositivo.objects.filter(
-            ta_id=self.kwargs['ta_id'],
-        ).order_by(
-            'inicio_vigencia'
-        ).distinct(
-            'inicio_vigencia'
-        ).select_related(
-            'ta_publicado',
-            'ta',
-            'ta_publicado__tipo_ta',
-            'ta__tipo_ta',)
-
-        ajuste_datas_vigencia = []
-
-        for item in itens:
-            ajuste_datas_vigencia.append(item)
-
-        lenLista = len(ajuste_datas_vigencia)
-        for i in range(lenLista):
-            if i + 1 < lenLista:
-                ajuste_datas_vigencia[
-                    i].fim_vigencia = ajuste_datas_vigencia[
-                        i + 1].inicio_vigencia - timedelta(days=1)
-            else:
-                ajuste_datas_vigencia[i].fim_vigencia = None
+        ajuste_datas_vigencia = self.object.vigencias()
 
         self.itens_de_vigencia = {}
 
@@ -983,8 +1003,7 @@ class TextView(CompMixin, ListView):
                 continue
 
             if idx + 1 < length:
-                ano = item.ta_publicado.ano if item.ta_publicado else\
-                    item.ta.ano
+                ano = item.ano
                 if ano in self.itens_de_vigencia:
                     self.itens_de_vigencia[ano].append(item)
                 else:
@@ -1011,6 +1030,7 @@ class TextView(CompMixin, ListView):
 class DispositivoView(TextView):
     # template_name = 'compilacao/index.html'
     template_name = 'compilacao/text_list_bloco.html'
+    cache_texto = False
 
     def get_queryset(self):
         self.flag_alteradora = -1
@@ -1044,6 +1064,33 @@ class DispositivoView(TextView):
         return itens
 
 
+def etag_exportacao(request, ta_id, formato):
+    return '{}-{}-{}'.format(ta_id, formato, versao_texto_articulado(ta_id))
+
+
+class TextExportView(CompMixin, View):
+    '''
+    Exporta o texto articulado em JSON ou XML no estilo LexML. A resposta é
+    gerada sob demanda, em partes, e identificada por um ETag derivado da
+    versão do conteúdo do texto.
+    '''
+
+    def has_permission(self):
+        self.object = self.ta
+        return self.object.has_view_permission(self.request)
+
+    @method_decorator(condition(etag_func=etag_exportacao))
+    def get(self, request, *args, **kwargs):
+        exporta, content_type = EXPORTACOES[kwargs['formato']]
+        response = StreamingHttpResponse(
+            exporta(self.object),
+            content_type='{}; charset=utf-8'.format(content_type))
+        response['Content-Disposition'] = \
+            'inline; filename="texto_articulado_{}.{}"'.format(
+                self.object.pk, kwargs['formato'])
+        return response
+
+
 class TextEditView(CompMixin, TemplateView):
     template_name = 'compilacao/text_edit.html'
 
@@ -1386,6 +1433,7 @@ class ActionDragAndMoveDispositivoAlteradoMixin(ActionsCommonsMixin):
 
         if dpt.tipo_dispositivo.dispositivo_de_alteracao:
             dpt.dispositivo_pai = bloco
+            dpt.organizar_niveis()
         else:
             dpt.dispositivo_atualizador = bloco
 
@@ -1505,9 +1553,10 @@ class ActionDeleteDispositivoMixin(ActionsCommonsMixin):
                     p.fim_eficacia = None
 
                 try:
-                    for d in base.dispositivos_filhos_set.all():
-                        p.dispositivos_filhos_set.add(d)
                     p.save()
+                    for d in base.dispositivos_filhos_set.all():
+                        d.dispositivo_pai = p
+                        d.save()
                 except Exception as e:
                     self.logger.error("user=" + username + '. ' + str(e))
                     print(e)
@@ -2101,6 +2150,10 @@ class ActionDispositivoCreateMixin(ActionsCommonsMixin):
                 inicio_vigencia=dvt.inicio_eficacia,
                 inicio_eficacia=dvt.inicio_eficacia)
 
+            atualiza_versao_textos_articulados(
+                [dvt.ta_id] + list(Dispositivo.objects.filter(
+                    ta_publicado=dvt.ta).values_list('ta_id', flat=True)))
+
             dps = Dispositivo.objects.filter(dispositivo_vigencia=dvt)
             for d in dps:
                 if d.dispositivo_substituido:
@@ -2242,7 +2295,7 @@ class ActionDispositivoCreateMixin(ActionsCommonsMixin):
             dp.publicacao = pub_last
             dp.save()
 
-            count_auto_insert = 0
+            tipos_auto_insert = []
             if create_auto_inserts:
                 for perfil in perfil_parents:
                     tipos_dp_auto_insert = tipo.filhos_permitidos.filter(
@@ -2258,23 +2311,24 @@ class ActionDispositivoCreateMixin(ActionsCommonsMixin):
                                 tipo_dispositivo_id=tipoauto.filho_permitido.pk
                             ).count()
                             if qtdp > 0:
-                                count_auto_insert += 1
+                                tipos_auto_insert.append(tipoauto)
                         else:
-                            count_auto_insert += 1
+                            tipos_auto_insert.append(tipoauto)
 
-                    if count_auto_insert:
+                    if tipos_auto_insert:
                         break
 
             # Inserção automática
-            if count_auto_insert:
+            if tipos_auto_insert:
 
-                ordem = dp.criar_espaco(
-                    espaco_a_criar=count_auto_insert, local='json_add_in')
+                ordens = dp.reservar_ordens(
+                    espaco_a_criar=len(tipos_auto_insert),
+                    local='json_add_in')
 
                 dp_pk = dp.pk
-                dp.ordem = ordem
                 dp.nivel += 1
-                for tipoauto in tipos_dp_auto_insert:
+                for tipoauto, ordem in zip(tipos_auto_insert, ordens):
+                    dp.ordem = ordem
                     dp.dispositivo_pai_id = dp_pk
                     dp.pk = None
                     dp.tipo_dispositivo = tipoauto.filho_permitido
@@ -2290,7 +2344,6 @@ class ActionDispositivoCreateMixin(ActionsCommonsMixin):
                     dp.save()
                     dp_auto_insert = dp
 
-                    ordem += Dispositivo.INTERVALO_ORDEM
                 dp = Dispositivo.objects.get(pk=dp_pk)
 
             ''' Reenquadrar todos os dispositivos que possuem pai
@@ -2931,6 +2984,42 @@ class DispositivoDinamicEditView(
         return JsonResponse(data, safe=False)
 
 
+class BuscaPrefixo(SearchQuery):
+    '''
+    Consulta textual que casa as palavras iniciadas pelo termo, permitindo
+    que a busca de dispositivos seja feita enquanto o termo é digitado.
+
+    O SearchQuery do Django 1.11 gera apenas plainto_tsquery, que não aceita
+    o operador de prefixo; as_sql troca a função por to_tsquery, mantendo o
+    restante da compilação a cargo do SearchQuery.
+    '''
+
+    def __init__(self, termo, **kwargs):
+        super().__init__(termo + ':*', **kwargs)
+
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        return sql.replace('plainto_tsquery(', 'to_tsquery('), params
+
+    @staticmethod
+    def termos(texto, config='portuguese'):
+        '''
+        Palavras de texto que restringem a busca, descartando as que a
+        configuração considera irrelevantes (stop words), numa só consulta.
+        '''
+        termos = [t for t in (re.sub(r'\W', '', p) for p in texto.split())
+                  if t]
+        if not termos:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT t FROM unnest(%s::text[]) AS t '
+                'WHERE numnode(to_tsquery(%s::regconfig, t || \':*\')) > 0',
+                [termos, config])
+            significativos = {t for t, in cursor.fetchall()}
+        return [t for t in termos if t in significativos]
+
+
 class DispositivoSearchFragmentFormView(ListView):
     template_name = 'compilacao/dispositivo_form_search_fragment.html'
     logger = logging.getLogger(__name__)
@@ -2991,7 +3080,6 @@ class DispositivoSearchFragmentFormView(ListView):
                 return result[:n]
 
             str_texto = ''
-            texto = ''
             rotulo = ''
             num_ta = ''
             ano_ta = ''
@@ -2999,22 +3087,20 @@ class DispositivoSearchFragmentFormView(ListView):
             if 'texto' in self.request.GET:
                 str_texto = self.request.GET['texto']
 
-            texto = str_texto.split(' ')
-
             if 'rotulo' in self.request.GET:
                 rotulo = self.request.GET['rotulo']
                 if rotulo:
                     q = q & Q(rotulo__icontains=rotulo)
 
-            for item in texto:
-                if not item:
-                    continue
-                if q:
-                    q = q & (Q(texto__icontains=item) |
-                             Q(texto_atualizador__icontains=item))
-                else:
-                    q = (Q(texto__icontains=item) |
-                         Q(texto_atualizador__icontains=item))
+            # Busca textual indexada: cada palavra casa, por prefixo, com
+            # o vetor de busca de rótulo e texto do dispositivo. Palavras
+            # sem relevância para a busca (stop words) são ignoradas.
+            busca = None
+            for item in BuscaPrefixo.termos(str_texto):
+                termo = BuscaPrefixo(item, config='portuguese')
+                busca = busca & termo if busca else termo
+            if busca:
+                q = q & Q(busca=busca)
 
             if 'tipo_ta' in self.request.GET:
                 tipo_ta = self.request.GET['tipo_ta']
@@ -3035,12 +3121,14 @@ class DispositivoSearchFragmentFormView(ListView):
                 n = 10
             q = q & Q(nivel__gt=0)
 
-            result = Dispositivo.objects.order_by(
-                '-ta__data',
-                '-ta__ano',
-                '-ta__numero',
-                'ta',
-                'ordem').filter(q).select_related('ta')
+            ordem = ('-ta__data', '-ta__ano', '-ta__numero', 'ta', 'ordem')
+            result = Dispositivo.objects.filter(q).select_related('ta')
+            if busca:
+                result = result.annotate(
+                    rank=SearchRank(F('busca'), busca)).order_by(
+                    '-rank', *ordem)
+            else:
+                result = result.order_by(*ordem)
 
             if 'data_type_selection' in self.request.GET and\
                     self.request.GET['data_type_selection'] == 'checkbox':
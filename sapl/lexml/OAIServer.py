@@ -8,7 +8,7 @@ from django.urls import reverse
 from lxml import etree
 from lxml.builder import ElementMaker
 
-from sapl.base.models import AppConfig, CasaLegislativa
+from sapl.base.models import AppConfig, CasaLegislativa, cache_configuracao
 from sapl.lexml.models import LexmlPublicador, LexmlProvedor
 from sapl.norma.models import NormaJuridica
 
@@ -96,8 +96,7 @@ class OAIServer:
         return oaipmh.common.Header(None, oai_id, timestamp, sets, deleted)
 
     def get_esfera_federacao(self):
-        appconfig = AppConfig.objects.first()
-        return appconfig.esfera_federacao
+        return AppConfig.attr('esfera_federacao')
 
     def recupera_norma(self, offset, batch_size, from_, until, identifier, esfera):
         kwargs = {'data__lte': until}
@@ -254,7 +253,7 @@ casa = None
 def casa_legislativa():
     global casa
     if not casa:
-        casa = CasaLegislativa.objects.first()
+        casa = cache_configuracao.casa_legislativa()
     return casa if casa else CasaLegislativa()  # retorna objeto dummy
 
 
@@ -988,34 +988,27 @@ class MateriaLegislativaFilterSet(django_filters.FilterSet):
 
 
 def pega_ultima_tramitacao():
-    return Tramitacao.objects.values(
-        'materia_id').annotate(data_encaminhamento=Max(
-            'data_encaminhamento'),
-        id=Max('id')).values_list('id', flat=True)
+    return MateriaLegislativa.objects.filter(
+        ultima_tramitacao__isnull=False).values_list(
+            'ultima_tramitacao_id', flat=True)
 
 
 def filtra_tramitacao_status(status):
-    lista = pega_ultima_tramitacao()
-    return Tramitacao.objects.filter(
-        id__in=lista,
-        status=status).distinct().values_list('materia_id', flat=True)
+    return MateriaLegislativa.objects.filter(
+        ultima_tramitacao__status=status).values_list('id', flat=True)
 
 
 def filtra_tramitacao_destino(destino):
-    lista = pega_ultima_tramitacao()
-    return Tramitacao.objects.filter(
-        id__in=lista,
-        unidade_tramitacao_destino=destino).distinct().values_list(
-            'materia_id', flat=True)
+    return MateriaLegislativa.objects.filter(
+        ultima_tramitacao__unidade_tramitacao_destino=destino).values_list(
+            'id', flat=True)
 
 
 def filtra_tramitacao_destino_and_status(status, destino):
-    lista = pega_ultima_tramitacao()
-    return Tramitacao.objects.filter(
-        id__in=lista,
-        status=status,
-        unidade_tramitacao_destino=destino).distinct().values_list(
-            'materia_id', flat=True)
+    return MateriaLegislativa.objects.filter(
+        ultima_tramitacao__status=status,
+        ultima_tramitacao__unidade_tramitacao_destino=destino).values_list(
+            'id', flat=True)
 
 
 class DespachoInicialForm(ModelForm):
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from sapl.materia.models import MateriaLegislativa, atualiza_ultima_tramitacao
+
+
+class Command(BaseCommand):
+
+    help = 'Recalcula a última tramitação de cada matéria legislativa'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=10000,
+            dest='lote',
+            help='Quantidade de matérias atualizadas por UPDATE',
+        )
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        maior_id = MateriaLegislativa.objects.aggregate(
+            Max('id'))['id__max'] or 0
+
+        total = 0
+        for inicio in range(0, maior_id + 1, lote):
+            total += atualiza_ultima_tramitacao(
+                MateriaLegislativa.objects.filter(
+                    id__gte=inicio, id__lt=inicio + lote))
+
+        self.stdout.write(
+            '{} matérias legislativas atualizadas.'.format(total))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def atualiza_ultima_tramitacao(apps, schema_editor):
+    MateriaLegislativa = apps.get_model('materia', 'MateriaLegislativa')
+    Tramitacao = apps.get_model('materia', 'Tramitacao')
+
+    ultima = Tramitacao.objects.filter(
+        materia_id=OuterRef('pk')).order_by('-id').values('id')[:1]
+    MateriaLegislativa.objects.update(ultima_tramitacao=Subquery(ultima))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materia', '0044_auto_20190327_1409'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materialegislativa',
+            name='ultima_tramitacao',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='materia.Tramitacao', verbose_name='Última Tramitação'),
+        ),
+        migrations.RunPython(atualiza_ultima_tramitacao,
+                             migrations.RunPython.noop),
+    ]
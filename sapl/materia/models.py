@@ -3,6 +3,7 @@ from django.contrib.auth.models import Group
 from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models import OuterRef, Subquery
 from django.db.models.functions import Concat
 from django.template import defaultfilters
 from django.utils import formats, timezone
@@ -279,6 +280,16 @@ class MateriaLegislativa(models.Model):
         auto_now=True,
         verbose_name=_('Data'))
 
+    # Desnormalização da última tramitação (maior id) da matéria, mantida
+    # por atualiza_ultima_tramitacao a cada inclusão/exclusão de Tramitacao
+    ultima_tramitacao = models.ForeignKey(
+        'Tramitacao',
+        blank=True, null=True,
+        editable=False,
+        related_name='+',
+        on_delete=models.SET_NULL,
+        verbose_name=_('Última Tramitação'))
+
     class Meta:
         verbose_name = _('Matéria Legislativa')
         verbose_name_plural = _('Matérias Legislativas')
@@ -1013,3 +1024,17 @@ class Tramitacao(models.Model):
             'materia': self.materia,
             'status': self.status,
             'data': self.data_tramitacao.strftime("%d/%m/%Y")}
+
+
+def atualiza_ultima_tramitacao(materias=None):
+    '''
+    Atualiza MateriaLegislativa.ultima_tramitacao em um único UPDATE.
+
+    :param materias: queryset de matérias a atualizar; todas se omitido
+    '''
+    if materias is None:
+        materias = MateriaLegislativa.objects.all()
+
+    ultima = Tramitacao.objects.filter(
+        materia_id=OuterRef('pk')).order_by('-id').values('id')[:1]
+    return materias.update(ultima_tramitacao=Subquery(ultima))
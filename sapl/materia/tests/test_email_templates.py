@@ -1,6 +1,16 @@
+from unittest import mock
+
+import pytest
 from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
 
+from sapl.base import email_utils
 from sapl.base.email_utils import enviar_emails, load_email_templates
+from sapl.base.models import CasaLegislativa, MensagemEmail
+from sapl.materia.models import (AcompanhamentoMateria, MateriaLegislativa,
+                                 Tramitacao)
 
 
 def test_email_template_loading():
@@ -64,3 +74,38 @@ def test_enviar_same_email():
 
     enviar_emails('test@sapl.com', recipients, [messages[0]])
     assert len(mail.outbox) == 1
+
+
+def envia_email_tramitacao(quantidade):
+    materia = mommy.make(MateriaLegislativa)
+    tramitacao = mommy.make(Tramitacao, materia=materia)
+    for i in range(quantidade):
+        mommy.make(AcompanhamentoMateria, materia=materia, confirmado=True,
+                   email='user-%s@test.com' % i, hash='h%s' % i)
+
+    with mock.patch.object(email_utils, 'load_email_templates',
+                           wraps=email_utils.load_email_templates) as render,\
+            CaptureQueriesContext(connection) as consultas:
+        email_utils.do_envia_email_tramitacao(
+            'http://localhost:8000', 'materia', materia, tramitacao.status,
+            tramitacao.unidade_tramitacao_destino)
+
+    mensagens = {m.destinatario: m for m in MensagemEmail.objects.all()}
+    assert len(mensagens) == quantidade
+    for i in range(quantidade):
+        mensagem = mensagens['user-%s@test.com' % i]
+        assert 'hash_txt=h%s' % i in mensagem.texto
+        assert 'hash_txt=h%s' % i in mensagem.html
+    MensagemEmail.objects.all().delete()
+
+    return render.call_count, len(consultas)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_email_tramitacao_renderizado_uma_vez():
+    mommy.make(CasaLegislativa)
+
+    # o custo de cada destinatário adicional não inclui renderização de
+    # templates nem consultas, apenas a substituição do hash
+    assert envia_email_tramitacao(2) == envia_email_tramitacao(10)
+    assert envia_email_tramitacao(10)[0] == 1
@@ -8,6 +8,7 @@ import pytest
 
 from sapl.base.models import Autor, TipoAutor
 from sapl.comissoes.models import Comissao, TipoComissao
+from sapl.materia.forms import filtra_tramitacao_status
 from sapl.materia.models import (Anexada, Autoria, DespachoInicial,
                                  DocumentoAcessorio, MateriaLegislativa,
                                  Numeracao, Proposicao, RegimeTramitacao,
@@ -301,6 +302,106 @@ def test_tramitacao_submit(admin_client):
     assert tramitacao.urgente is True
 
 
+@pytest.mark.django_db(transaction=False)
+def test_ultima_tramitacao():
+    materia = mommy.make(MateriaLegislativa)
+    status_a, status_b = mommy.make(StatusTramitacao, _quantity=2)
+
+    t1 = mommy.make(Tramitacao, materia=materia, status=status_a)
+    t2 = mommy.make(Tramitacao, materia=materia, status=status_b)
+
+    materia.refresh_from_db()
+    assert materia.ultima_tramitacao == t2
+    assert list(filtra_tramitacao_status(status_b.pk)) == [materia.pk]
+    assert not filtra_tramitacao_status(status_a.pk).exists()
+
+    t2.delete()
+    materia.refresh_from_db()
+    assert materia.ultima_tramitacao == t1
+    assert list(filtra_tramitacao_status(status_a.pk)) == [materia.pk]
+
+
+@pytest.mark.django_db(transaction=False)
+def test_ultima_tramitacao_pelas_views(admin_client):
+    materia = make_materia_principal()
+    unidade_local = make_unidade_tramitacao('Unidade Local')
+    unidade_destino = make_unidade_tramitacao('Unidade Destino')
+    status = mommy.make(StatusTramitacao, indicador='T')
+    status_fim = mommy.make(StatusTramitacao, indicador='F')
+    primeira = mommy.make(Tramitacao, materia=materia, status=status,
+                          data_tramitacao='2016-03-20',
+                          unidade_tramitacao_local=unidade_local,
+                          unidade_tramitacao_destino=unidade_destino)
+
+    admin_client.post(
+        reverse('sapl.materia:tramitacao_create',
+                kwargs={'pk': materia.pk}),
+        {'unidade_tramitacao_local': unidade_destino.pk,
+         'unidade_tramitacao_destino': unidade_local.pk,
+         'urgente': False,
+         'status': status.pk,
+         'data_tramitacao': '2016-03-21',
+         'texto': 'Texto_Teste',
+         'salvar': 'salvar'},
+        follow=True)
+
+    segunda = Tramitacao.objects.exclude(pk=primeira.pk).get()
+    materia.refresh_from_db()
+    assert materia.ultima_tramitacao == segunda
+    assert materia.em_tramitacao is True
+
+    admin_client.post(
+        reverse('sapl.materia:tramitacao_update',
+                kwargs={'pk': segunda.pk}),
+        {'unidade_tramitacao_local': unidade_destino.pk,
+         'unidade_tramitacao_destino': unidade_local.pk,
+         'urgente': False,
+         'status': status_fim.pk,
+         'data_tramitacao': '2016-03-21',
+         'texto': 'Texto_Teste',
+         'salvar': 'salvar'},
+        follow=True)
+
+    materia.refresh_from_db()
+    assert materia.ultima_tramitacao == segunda
+    assert materia.em_tramitacao is False
+
+
+@pytest.mark.django_db(transaction=False)
+def test_primeira_tramitacao_em_lote(admin_client):
+    materias = mommy.make(MateriaLegislativa, em_tramitacao=False,
+                          _quantity=2)
+    anexada = mommy.make(MateriaLegislativa, em_tramitacao=False)
+    mommy.make(Anexada, materia_principal=materias[0],
+               materia_anexada=anexada)
+    status = mommy.make(StatusTramitacao, indicador='T')
+    unidade_local = make_unidade_tramitacao('Unidade Local')
+    unidade_destino = make_unidade_tramitacao('Unidade Destino')
+
+    response = admin_client.post(
+        reverse('sapl.materia:primeira_tramitacao_em_lote'),
+        {'materia_id': [m.pk for m in materias],
+         'data_tramitacao': '21/03/2016',
+         'data_encaminhamento': '',
+         'data_fim_prazo': '',
+         'unidade_tramitacao_local': unidade_local.pk,
+         'unidade_tramitacao_destino': unidade_destino.pk,
+         'status': status.pk,
+         'urgente': 'False',
+         'turno': '',
+         'texto': 'Texto_Teste'},
+        follow=True)
+
+    assert response.status_code == 200
+    assert Tramitacao.objects.count() == 3
+    for materia in materias + [anexada]:
+        materia.refresh_from_db()
+        assert materia.em_tramitacao
+        assert materia.ultima_tramitacao.status == status
+        assert (materia.ultima_tramitacao.unidade_tramitacao_destino ==
+                unidade_destino)
+
+
 @pytest.mark.django_db(transaction=False)
 def test_form_errors_anexada(admin_client):
     materia_principal = make_materia_principal()
@@ -0,0 +1,23 @@
+from sapl.utils import incrementa_versao, versao_compartilhada
+
+CHAVE_VERSAO_MATERIAS_ANO = 'sapl_materia_ano_versao_{}'
+CHAVE_VERSAO_GLOBAL_MATERIAS = 'sapl_materia_versao'
+
+
+def versao_materias_ano(ano):
+    '''
+    Versão dos dados das matérias do ano, compartilhada entre os workers
+    através do cache. Muda sempre que matérias ou autorias do ano são
+    alteradas ou quando tipos de matéria e autores, comuns a todos os anos,
+    mudam.
+    '''
+    return versao_compartilhada(
+        (CHAVE_VERSAO_GLOBAL_MATERIAS, CHAVE_VERSAO_MATERIAS_ANO.format(ano)))
+
+
+def atualiza_versao_materias_ano(ano):
+    incrementa_versao(CHAVE_VERSAO_MATERIAS_ANO.format(ano))
+
+
+def atualiza_versao_global_materias():
+    incrementa_versao(CHAVE_VERSAO_GLOBAL_MATERIAS)
@@ -3,7 +3,6 @@ import os
 import shutil
 import tempfile
 import weasyprint
-import itertools
 
 from datetime import datetime
 from random import choice
@@ -16,6 +15,7 @@ from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.db.models import Max, Q
 from django.http import HttpResponse, JsonResponse
 from django.http.response import Http404, HttpResponseRedirect
@@ -30,8 +30,10 @@ from django_filters.views import FilterView
 import weasyprint
 
 import sapl
-from sapl.base.email_utils import do_envia_email_confirmacao
-from sapl.base.models import Autor, CasaLegislativa, AppConfig as BaseAppConfig
+from sapl.base.email_utils import (do_envia_email_confirmacao,
+                                   do_envia_email_tramitacao_em_lote)
+from sapl.base.models import Autor, AppConfig as BaseAppConfig
+from sapl.base.models import cache_configuracao
 from sapl.base.signals import tramitacao_signal
 from sapl.comissoes.models import Comissao, Participacao
 from sapl.compilacao.models import (STATUS_TA_IMMUTABLE_RESTRICT,
@@ -54,7 +56,7 @@ from sapl.protocoloadm.models import Protocolo
 from sapl.settings import MEDIA_ROOT
 from sapl.utils import (YES_NO_CHOICES, autor_label, autor_modal, SEPARADOR_HASH_PROPOSICAO,
                         gerar_hash_arquivo, get_base_url,
-                        get_mime_type_from_file_extension, montar_row_autor,
+                        montar_row_autor, resposta_arquivo_protegido,
                         show_results_filter_set, mail_service_configured)
 
 from .forms import (AcessorioEmLoteFilterSet, AcompanhamentoMateriaForm,
@@ -75,7 +77,8 @@ from .models import (AcompanhamentoMateria, Anexada, AssuntoMateria, Autoria,
                      MateriaLegislativa, Numeracao, Orgao, Origem, Proposicao,
                      RegimeTramitacao, Relatoria, StatusTramitacao,
                      TipoDocumento, TipoFimRelatoria, TipoMateriaLegislativa,
-                     TipoProposicao, Tramitacao, UnidadeTramitacao)
+                     TipoProposicao, Tramitacao, UnidadeTramitacao,
+                     atualiza_ultima_tramitacao)
 
 
 AssuntoMateriaCrud = CrudAux.build(AssuntoMateria, 'assunto_materia')
@@ -117,15 +120,7 @@ def proposicao_texto(request, pk):
 
         arquivo = proposicao.texto_original
 
-        mime = get_mime_type_from_file_extension(arquivo.name)
-
-        with open(arquivo.path, 'rb') as f:
-            data = f.read()
-
-        response = HttpResponse(data, content_type='%s' % mime)
-        response['Content-Disposition'] = (
-            'inline; filename="%s"' % arquivo.name.split('/')[-1])
-        return response
+        return resposta_arquivo_protegido(request, arquivo)
     logger.error('user=' + username +
                  '. Objeto Proposicao com pk={} não encontrado.'.format(pk))
     raise Http404
@@ -1205,7 +1200,9 @@ class TramitacaoCrud(MasterDetailCrud):
                 form.instance.materia.em_tramitacao = False
             else:
                 form.instance.materia.em_tramitacao = True
-            form.instance.materia.save()
+            # ultima_tramitacao já foi atualizada pelo sinal da tramitação
+            form.instance.materia.save(
+                update_fields=['em_tramitacao', 'data_ultima_atualizacao'])
 
             try:
                 self.logger.debug("user=" + username + ". Tentando enviar Tramitacao (sender={}, post={}, request={})."
@@ -1239,7 +1236,9 @@ class TramitacaoCrud(MasterDetailCrud):
                 form.instance.materia.em_tramitacao = False
             else:
                 form.instance.materia.em_tramitacao = True
-            form.instance.materia.save()
+            # ultima_tramitacao já foi atualizada pelo sinal da tramitação
+            form.instance.materia.save(
+                update_fields=['em_tramitacao', 'data_ultima_atualizacao'])
 
             try:
                 self.logger.debug("user=" + username + ". Tentando enviar Tramitacao (sender={}, post={}, request={}"
@@ -1851,7 +1850,7 @@ class AcompanhamentoMateriaView(CreateView):
                     materia=materia,
                     email=email,
                     confirmado=False)
-                casa = CasaLegislativa.objects.first()
+                casa = cache_configuracao.casa_legislativa()
 
                 do_envia_email_confirmacao(base_url,
                                            casa,
@@ -1881,7 +1880,7 @@ class AcompanhamentoMateriaView(CreateView):
                     confirmado=False
                 )
 
-                casa = CasaLegislativa.objects.first()
+                casa = cache_configuracao.casa_legislativa()
 
                 do_envia_email_confirmacao(base_url,
                                            casa,
@@ -2167,70 +2166,63 @@ class PrimeiraTramitacaoEmLoteView(PermissionRequiredMixin, FilterView):
                 messages.add_message(request, messages.ERROR, msg)
                 return self.get(request, self.kwargs)
 
+        try:
+            data_tramitacao = tz.localize(datetime.strptime(
+                request.POST['data_tramitacao'], "%d/%m/%Y"))
+        except ValueError:
+            msg = _('Formato da data da tramitação incorreto.')
+            messages.add_message(request, messages.ERROR, msg)
+            return self.get(request, self.kwargs)
+
         # issue https://github.com/interlegis/sapl/issues/1123
         # TODO: usar Form
         urgente = request.POST['urgente'] == 'True'
-        flag_error = False  
-
-        materias_principais = [m for m in MateriaLegislativa.objects.filter(id__in=marcadas)]
-        materias_anexadas = [m.anexadas.all() for m in MateriaLegislativa.objects.filter(id__in=marcadas) if m.anexadas.all()]
-        materias_anexadas = list(itertools.chain.from_iterable(materias_anexadas)) 
         tramitacao_local = int(request.POST['unidade_tramitacao_local'])
-        materias_anexadas = list(filter(lambda ma : not ma.tramitacao_set.all() or \
-                                        ma.tramitacao_set.last().unidade_tramitacao_destino.id == tramitacao_local,
-                                        materias_anexadas))
-        materias = set(materias_principais + materias_anexadas)
-
-        for materia in materias:
-            try:
-                data_tramitacao = tz.localize(datetime.strptime(
-                    request.POST['data_tramitacao'], "%d/%m/%Y"))
-            except ValueError:
-                msg = _('Formato da data da tramitação incorreto.')
-                messages.add_message(request, messages.ERROR, msg)
-                return self.get(request, self.kwargs)
-
-            t = Tramitacao(
-                materia=materia,
-                data_tramitacao=data_tramitacao,
-                data_encaminhamento=data_encaminhamento,
-                data_fim_prazo=data_fim_prazo,
-                unidade_tramitacao_local_id=request.POST[
-                    'unidade_tramitacao_local'],
-                unidade_tramitacao_destino_id=request.POST[
-                    'unidade_tramitacao_destino'],
-                urgente=urgente,
-                status_id=request.POST['status'],
-                turno=request.POST['turno'],
-                texto=request.POST['texto']
-            )
-            t.save()
-            try:
-                self.logger.debug("user=" + username +
-                                  ". Tentando enviar tramitação.")
-                tramitacao_signal.send(sender=Tramitacao,
-                                       post=t,
-                                       request=self.request)
-
-            except Exception as e:
-                self.logger.error('user=' + username + '. Tramitação criada , mas e-mail de acompanhamento '
-                                  'de matéria não enviado. Há problemas na configuração '
-                                  'do e-mail. ' + str(e))
-                flag_error = True
-        if flag_error:
-            msg = _('Tramitação criada, mas e-mail de acompanhamento '
-                    'de matéria não enviado. A não configuração do servidor de e-mail '
-                    'impede o envio de aviso de tramitação')
-            messages.add_message(self.request, messages.WARNING, msg)
-
         status = StatusTramitacao.objects.get(id=request.POST['status'])
+        unidade_destino = UnidadeTramitacao.objects.get(
+            id=request.POST['unidade_tramitacao_destino'])
+
+        # Matérias anexadas às selecionadas que ainda não tramitaram ou cuja
+        # última tramitação tem como destino a unidade local informada
+        materias_anexadas = MateriaLegislativa.objects.filter(
+            materia_anexada_set__materia_principal_id__in=marcadas).filter(
+                Q(ultima_tramitacao__isnull=True) |
+                Q(ultima_tramitacao__unidade_tramitacao_destino_id=tramitacao_local))
+        materias = MateriaLegislativa.objects.filter(
+            Q(id__in=marcadas) | Q(id__in=materias_anexadas)).distinct()
+
+        with transaction.atomic():
+            tramitacoes = Tramitacao.objects.bulk_create([
+                Tramitacao(
+                    materia=materia,
+                    data_tramitacao=data_tramitacao,
+                    data_encaminhamento=data_encaminhamento,
+                    data_fim_prazo=data_fim_prazo,
+                    unidade_tramitacao_local_id=tramitacao_local,
+                    unidade_tramitacao_destino=unidade_destino,
+                    urgente=urgente,
+                    status=status,
+                    turno=request.POST['turno'],
+                    texto=request.POST['texto'])
+                for materia in materias])
+
+            materias_id = [t.materia_id for t in tramitacoes]
+            materias = MateriaLegislativa.objects.filter(id__in=materias_id)
+            atualiza_ultima_tramitacao(materias)
 
-        for materia in materias:
             if status.indicador == 'F':
-                materia.em_tramitacao = False
+                materias.update(em_tramitacao=False,
+                                data_ultima_atualizacao=timezone.now())
             elif self.primeira_tramitacao:
-                materia.em_tramitacao = True
-            materia.save()
+                materias.update(em_tramitacao=True,
+                                data_ultima_atualizacao=timezone.now())
+            else:
+                materias.update(data_ultima_atualizacao=timezone.now())
+
+            # Os e-mails de acompanhamento entram na fila de envio na
+            # mesma transação e são enviados pelo comando envia_emails.
+            do_envia_email_tramitacao_em_lote(
+                get_base_url(request), 'materia', tramitacoes)
 
         msg = _('Tramitação completa.')
         self.logger.info('user=' + username + '. Tramitação completa.')
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('norma', '0023_auto_20190219_1535'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NormaAcessosMes',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.PositiveSmallIntegerField(verbose_name='Ano')),
+                ('mes', models.PositiveSmallIntegerField(verbose_name='Mês')),
+                ('acessos', models.PositiveIntegerField(default=0, verbose_name='Acessos')),
+                ('norma', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='norma.NormaJuridica')),
+            ],
+            options={
+                'verbose_name': 'Acessos da Norma no Mês',
+                'verbose_name_plural': 'Acessos das Normas por Mês',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='normaacessosmes',
+            unique_together=set([('norma', 'ano', 'mes')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='normaacessosmes',
+            index_together=set([('ano', 'mes')]),
+        ),
+        migrations.RunSQL(
+            '''
+            INSERT INTO norma_normaacessosmes (norma_id, ano, mes, acessos)
+            SELECT norma_id, ano, extract(month from horario_acesso), count(*)
+              FROM norma_normaestatisticas
+             WHERE horario_acesso IS NOT NULL
+             GROUP BY norma_id, ano, extract(month from horario_acesso)
+            ''', migrations.RunSQL.noop),
+    ]
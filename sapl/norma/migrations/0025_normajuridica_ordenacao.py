@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('norma', '0024_normaacessosmes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='normajuridica',
+            name='numero_ordenacao',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='normajuridica',
+            name='sufixo_ordenacao',
+            field=models.CharField(blank=True, default='', editable=False, max_length=8),
+        ),
+        migrations.RunSQL(
+            '''
+            UPDATE norma_normajuridica
+               SET numero_ordenacao = COALESCE(NULLIF(
+                       regexp_replace(numero, '[^0-9]', '', 'g'), '')::integer, 0),
+                   sufixo_ordenacao = regexp_replace(numero, '[^a-zA-Z]', '', 'g')
+            ''', migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='normajuridica',
+            index=models.Index(fields=['-data', '-numero_ordenacao', '-sufixo_ordenacao', '-id'], name='norma_norma_data_bc2a81_idx'),
+        ),
+    ]
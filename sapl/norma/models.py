@@ -1,5 +1,12 @@
+from collections import Counter
+import atexit
+import logging
+import re
+import threading
+import time
+
 from django.contrib.contenttypes.fields import GenericRelation
-from django.db import models
+from django.db import connection, models, transaction
 from django.template import defaultfilters
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
@@ -138,10 +145,18 @@ class NormaJuridica(models.Model):
         through_fields=('norma', 'autor'),
         symmetrical=False)
 
+    # Chaves de ordenação do número, mantidas pelo save: a parte numérica
+    # e as letras do número, como em 10A
+    numero_ordenacao = models.PositiveIntegerField(default=0, editable=False)
+    sufixo_ordenacao = models.CharField(
+        max_length=8, blank=True, default='', editable=False)
+
     class Meta:
         verbose_name = _('Norma Jurídica')
         verbose_name_plural = _('Normas Jurídicas')
         ordering = ['-data', '-numero']
+        indexes = [models.Index(fields=['-data', '-numero_ordenacao',
+                                        '-sufixo_ordenacao', '-id'])]
 
     def get_normas_relacionadas(self):
         principais = NormaRelacionada.objects.filter(
@@ -180,6 +195,10 @@ class NormaJuridica(models.Model):
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
 
+        self.numero_ordenacao = int(
+            re.sub('[^0-9]', '', self.numero or '') or 0)
+        self.sufixo_ordenacao = re.sub('[^a-zA-Z]', '', self.numero or '')
+
         if not self.pk and self.texto_integral:
             texto_integral = self.texto_integral
             self.texto_integral = None
@@ -213,6 +232,112 @@ class NormaEstatisticas(models.Model):
             'usuario': self.usuario, 'norma': self.norma}
 
 
+class NormaAcessosMes(models.Model):
+    '''
+    Total de acessos a cada norma por mês, acumulado por
+    ContadorAcessosNormas no lugar de um registro por acesso.
+    '''
+    norma = models.ForeignKey(NormaJuridica,
+                              on_delete=models.CASCADE)
+    ano = models.PositiveSmallIntegerField(verbose_name=_('Ano'))
+    mes = models.PositiveSmallIntegerField(verbose_name=_('Mês'))
+    acessos = models.PositiveIntegerField(verbose_name=_('Acessos'),
+                                          default=0)
+
+    class Meta:
+        verbose_name = _('Acessos da Norma no Mês')
+        verbose_name_plural = _('Acessos das Normas por Mês')
+        unique_together = ('norma', 'ano', 'mes')
+        index_together = ('ano', 'mes')
+
+    def __str__(self):
+        return _('Norma: %(norma)s, %(mes)s/%(ano)s: %(acessos)s') % {
+            'norma': self.norma, 'mes': self.mes, 'ano': self.ano,
+            'acessos': self.acessos}
+
+
+class ContadorAcessosNormas:
+    '''
+    Acumula na memória do processo os acessos às normas e os grava em
+    NormaAcessosMes, somados por (norma, ano, mês), no máximo a cada
+    INTERVALO_DESCARGA segundos, quando MAXIMO_PENDENTES contadores
+    distintos estiverem pendentes e ao término do processo.
+
+    Os acessos só deixam de estar pendentes após a gravação, de modo que
+    uma falha no banco os mantém para a próxima descarga.
+    '''
+    INTERVALO_DESCARGA = 60
+    MAXIMO_PENDENTES = 1000
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self):
+        self.pendentes = Counter()
+        self.lock = threading.Lock()
+        self.lock_descarga = threading.Lock()
+        self.descarregado_em = time.time()
+
+    def registra(self, norma_id):
+        agora = timezone.localtime(timezone.now())
+        with self.lock:
+            self.pendentes[(int(norma_id), agora.year, agora.month)] += 1
+            descarregar = len(self.pendentes) >= self.MAXIMO_PENDENTES or \
+                time.time() - self.descarregado_em >= self.INTERVALO_DESCARGA
+        if descarregar:
+            self.tenta_descarregar()
+
+    def descarrega(self):
+        # Uma descarga por vez, para que os mesmos acessos não sejam gravados
+        # duas vezes; quem encontra uma descarga em andamento segue adiante
+        if not self.lock_descarga.acquire(blocking=False):
+            return
+        try:
+            with self.lock:
+                pendentes = self.pendentes.copy()
+                self.descarregado_em = time.time()
+            self.grava(pendentes)
+            with self.lock:
+                self.pendentes.subtract(pendentes)
+                self.pendentes += Counter()  # descarta os zerados
+        finally:
+            self.lock_descarga.release()
+
+    def grava(self, pendentes):
+        # Normas excluídas desde o acesso são descartadas
+        existentes = set(NormaJuridica.objects.filter(
+            pk__in={norma_id for norma_id, ano, mes in pendentes}
+        ).values_list('pk', flat=True))
+        valores = [(norma_id, ano, mes, acessos)
+                   for (norma_id, ano, mes), acessos in pendentes.items()
+                   if norma_id in existentes]
+        if not valores:
+            return
+
+        tabela = NormaAcessosMes._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {0} (norma_id, ano, mes, acessos) VALUES {1} '
+                'ON CONFLICT (norma_id, ano, mes) DO UPDATE '
+                'SET acessos = {0}.acessos + EXCLUDED.acessos'.format(
+                    tabela, ', '.join(['(%s, %s, %s, %s)'] * len(valores))),
+                [v for valor in valores for v in valor])
+
+    def tenta_descarregar(self):
+        # Uma falha na gravação não deve interromper a requisição nem o
+        # encerramento do processo; os acessos seguem pendentes
+        try:
+            self.descarrega()
+        except Exception as e:
+            self.logger.error('Erro ao gravar os acessos às normas: '
+                              '{}'.format(str(e)))
+
+
+contador_acessos_normas = ContadorAcessosNormas()
+# Os workers do gunicorn, reciclados a cada MAX_REQUESTS requisições ou
+# encerrados pelo arbiter, terminam via sys.exit
+atexit.register(contador_acessos_normas.tenta_descarregar)
+
+
 @reversion.register()
 class AutoriaNorma(models.Model):
     autor = models.ForeignKey(Autor,
@@ -1,4 +1,10 @@
+from datetime import date
+from unittest import mock
+import time
+
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from model_mommy import mommy
 import pytest
@@ -7,7 +13,8 @@ from sapl.base.models import AppConfig
 from sapl.materia.models import MateriaLegislativa, TipoMateriaLegislativa
 from sapl.norma.forms import (NormaJuridicaForm, NormaPesquisaSimplesForm,
                               NormaRelacionadaForm)
-from sapl.norma.models import NormaJuridica, TipoNormaJuridica
+from sapl.norma.models import (NormaAcessosMes, NormaJuridica,
+                               TipoNormaJuridica, contador_acessos_normas)
 
 
 @pytest.mark.django_db(transaction=False)
@@ -156,3 +163,70 @@ def test_norma_pesquisa_form_datas_invalidas():
     assert not form.is_valid()
     assert form.errors['__all__'] == [_('A Data Final não pode ser menor que '
                                         'a Data Inicial')]
+
+
+@pytest.mark.django_db(transaction=False)
+def test_acessos_normas_acumulados(admin_client):
+    mommy.make(AppConfig, estatisticas_acesso_normas='S')
+    norma = mommy.make(NormaJuridica)
+    url = reverse('sapl.norma:normajuridica_detail', kwargs={'pk': norma.pk})
+
+    contador_acessos_normas.pendentes.clear()
+    contador_acessos_normas.descarregado_em = time.time()
+    for i in range(3):
+        assert admin_client.get(url).status_code == 200
+
+    # os acessos ficam em memória até a próxima descarga
+    assert not NormaAcessosMes.objects.exists()
+
+    # uma falha na gravação mantém os acessos pendentes
+    with mock.patch.object(contador_acessos_normas, 'grava',
+                           side_effect=DatabaseError):
+        with pytest.raises(DatabaseError):
+            contador_acessos_normas.descarrega()
+    assert sum(contador_acessos_normas.pendentes.values()) == 3
+
+    contador_acessos_normas.descarrega()
+    assert not contador_acessos_normas.pendentes
+    admin_client.get(url)
+    contador_acessos_normas.descarrega()
+
+    agora = timezone.localtime(timezone.now())
+    acesso = NormaAcessosMes.objects.get()
+    assert (acesso.norma, acesso.ano, acesso.mes, acesso.acessos) == (
+        norma, agora.year, agora.month, 4)
+
+    response = admin_client.get(reverse('sapl.base:estatisticas_acesso'),
+                                {'ano': agora.year})
+    assert list(response.context['normas_mes'].values()) == [[[norma, 4]]]
+
+
+@pytest.mark.django_db(transaction=False)
+def test_norma_pesquisa_paginacao_por_chave(client):
+    tipo = mommy.make(TipoNormaJuridica)
+    numeros = ['2', '10', '10A', '9', '1B', '1A']
+    for i in range(24):
+        mommy.make(NormaJuridica, tipo=tipo, ano=2019,
+                   numero=numeros[i % len(numeros)],
+                   data=date(2019, 1, 1 + i // len(numeros)))
+    mommy.make(NormaJuridica, tipo=tipo, ano=2019, numero='5', data=None)
+
+    norma = NormaJuridica.objects.get(numero='10A', data=date(2019, 1, 1))
+    assert (norma.numero_ordenacao, norma.sufixo_ordenacao) == (10, 'A')
+
+    url = reverse('sapl.norma:norma_pesquisa')
+
+    def pagina(**params):
+        return [n.pk for n in client.get(url, params).context['page_obj']]
+
+    paginas = [pagina(page=p) for p in (1, 2, 3)]
+    normas = NormaJuridica.objects.filter(pk__in=paginas[0])
+    assert normas.get(pk=paginas[0][0]).data is None
+    assert [NormaJuridica.objects.get(pk=pk).numero
+            for pk in paginas[0][1:7]] == ['10A', '10', '9', '2', '1B', '1A']
+
+    # as páginas vizinhas obtidas pela chave são as mesmas do OFFSET
+    assert pagina(page=2, apos=paginas[0][-1]) == paginas[1]
+    assert pagina(page=3, apos=paginas[1][-1]) == paginas[2]
+    assert pagina(page=1, antes=paginas[1][0]) == paginas[0]
+    assert pagina(page=2, antes=paginas[2][0]) == paginas[1]
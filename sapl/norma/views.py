@@ -4,6 +4,7 @@ import re
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
+from django.db.models import Q
 from django.http import HttpResponse, JsonResponse
 from django.template import RequestContext, loader
 from django.utils import timezone
@@ -25,7 +26,8 @@ from sapl.utils import show_results_filter_set
 from .forms import (AnexoNormaJuridicaForm, NormaFilterSet, NormaJuridicaForm,
                     NormaPesquisaSimplesForm, NormaRelacionadaForm, AutoriaNormaForm)
 from .models import (AnexoNormaJuridica, AssuntoNorma, NormaJuridica, NormaRelacionada,
-                     TipoNormaJuridica, TipoVinculoNormaJuridica, AutoriaNorma, NormaEstatisticas)
+                     TipoNormaJuridica, TipoVinculoNormaJuridica, AutoriaNorma,
+                     contador_acessos_normas)
 
 
 # LegislacaoCitadaCrud = Crud.build(LegislacaoCitada, '')
@@ -68,21 +70,76 @@ class NormaRelacionadaCrud(MasterDetailCrud):
         layout_key = 'NormaRelacionadaDetail'
 
 
+def filtro_chave_norma(chave, anteriores=False):
+    '''
+    Filtro das normas que vêm depois (ou antes, se anteriores) da chave
+    (data, numero_ordenacao, sufixo_ordenacao, id) na ordenação padrão da
+    pesquisa, decrescente e com as normas sem data primeiro.
+    '''
+    data, numero, sufixo, pk = chave
+    op = 'gt' if anteriores else 'lt'
+
+    q = Q(**{'numero_ordenacao__' + op: numero}) | \
+        Q(numero_ordenacao=numero, **{'sufixo_ordenacao__' + op: sufixo}) | \
+        Q(numero_ordenacao=numero, sufixo_ordenacao=sufixo,
+          **{'id__' + op: pk})
+
+    if data is None:
+        q = Q(data__isnull=True) & q
+        return q if anteriores else q | Q(data__isnull=False)
+
+    q = Q(**{'data__' + op: data}) | Q(data=data) & q
+    return q | Q(data__isnull=True) if anteriores else q
+
+
 class NormaPesquisaView(FilterView):
     model = NormaJuridica
     filterset_class = NormaFilterSet
     paginate_by = 10
 
+    ordenacao_padrao = ('-data', '-numero_ordenacao', '-sufixo_ordenacao',
+                        '-id')
+
     def get_queryset(self):
         qs = super().get_queryset()
 
-        qs = qs.extra({
-            'nm_i': "CAST(regexp_replace(numero,'[^0-9]','', 'g') AS INTEGER)",
-            'norma_letra': "regexp_replace(numero,'[^a-zA-Z]','', 'g')"
-        }).order_by('-data', '-nm_i', '-norma_letra')
+        qs = qs.order_by(*self.ordenacao_padrao)
 
         return qs
 
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = \
+            super().paginate_queryset(queryset, page_size)
+
+        # Na ordenação padrão, as páginas vizinhas são obtidas a partir da
+        # norma da borda da página atual (paginação por chave), sem OFFSET
+        pagina = self.pagina_por_chave(queryset, page_size)
+        if pagina is not None:
+            page.object_list = object_list = pagina
+
+        return paginator, page, object_list, is_paginated
+
+    def pagina_por_chave(self, queryset, page_size):
+        if self.request.GET.get('o') or \
+                list(queryset.query.order_by) != list(self.ordenacao_padrao):
+            return None
+
+        anteriores = 'antes' in self.request.GET
+        pk = self.request.GET.get('antes' if anteriores else 'apos')
+        if not pk or not pk.isdigit():
+            return None
+
+        chave = NormaJuridica.objects.filter(pk=pk).values_list(
+            'data', 'numero_ordenacao', 'sufixo_ordenacao', 'id').first()
+        if chave is None:
+            return None
+
+        queryset = queryset.filter(filtro_chave_norma(chave, anteriores))
+        if not anteriores:
+            return list(queryset[:page_size])
+
+        return list(reversed(queryset.reverse()[:page_size]))
+
     def get_context_data(self, **kwargs):
         context = super(NormaPesquisaView, self).get_context_data(**kwargs)
 
@@ -96,8 +153,9 @@ class NormaPesquisaView(FilterView):
 
         qr = self.request.GET.copy()
 
-        if 'page' in qr:
-            del qr['page']
+        for param in ('page', 'apos', 'antes'):
+            if param in qr:
+                del qr[param]
 
         paginator = context['paginator']
         page_obj = context['page_obj']
@@ -107,6 +165,10 @@ class NormaPesquisaView(FilterView):
 
         context['filter_url'] = ('&' + qr.urlencode()) if len(qr) > 0 else ''
 
+        if page_obj and not qr.get('o'):
+            context['chave_anterior'] = page_obj[0].pk
+            context['chave_proxima'] = page_obj[len(page_obj) - 1].pk
+
         context['show_results'] = show_results_filter_set(qr)
         context['USE_SOLR'] = settings.USE_SOLR if hasattr(
             settings, 'USE_SOLR') else False
@@ -194,13 +256,12 @@ class NormaCrud(Crud):
 
     class DetailView(Crud.DetailView):
         def get(self, request, *args, **kwargs):
-            estatisticas_acesso_normas = AppConfig.objects.first().estatisticas_acesso_normas
+            response = super().get(request, *args, **kwargs)
+            estatisticas_acesso_normas = AppConfig.attr('estatisticas_acesso_normas')
             if estatisticas_acesso_normas == 'S':
-                NormaEstatisticas.objects.create(usuario=str(self.request.user),
-                                                 norma_id=kwargs['pk'],
-                                                 ano=timezone.now().year,
-                                                 horario_acesso=timezone.now())
-            return super().get(request, *args, **kwargs)
+                # Os acessos são acumulados em memória e gravados em lote
+                contador_acessos_normas.registra(kwargs['pk'])
+            return response
 
     class DeleteView(Crud.DeleteView):
 
@@ -1,3 +1,113 @@
-# from django.test import TestCase
+import pytest
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from model_mommy import mommy
 
-# Create your tests here.
+from sapl.painel.utils import atualiza_versao_painel, versao_painel
+from sapl.painel.views import get_dados_painel, get_presentes, get_votos
+from sapl.parlamentares.models import (Filiacao, Mandato, Parlamentar,
+                                       Partido)
+from sapl.sessao.models import (OrdemDia, PresencaOrdemDia, SessaoPlenaria,
+                                VotoParlamentar)
+
+
+def cria_presentes(sessao, ordem, quantidade):
+    partido = mommy.make(Partido, sigla='PT')
+    for i in range(quantidade):
+        parlamentar = mommy.make(Parlamentar,
+                                 nome_parlamentar='Parlamentar %s' % i,
+                                 ativo=True)
+        mommy.make(Mandato, parlamentar=parlamentar,
+                   legislatura=sessao.legislatura)
+        mommy.make(Filiacao, parlamentar=parlamentar, partido=partido,
+                   data=sessao.data_inicio, data_desfiliacao=None)
+        mommy.make(PresencaOrdemDia, sessao_plenaria=sessao,
+                   parlamentar=parlamentar)
+        mommy.make(VotoParlamentar, ordem=ordem, parlamentar=parlamentar,
+                   voto='Sim')
+
+
+def consultas_painel(quantidade):
+    sessao = mommy.make(SessaoPlenaria)
+    ordem = mommy.make(OrdemDia, sessao_plenaria=sessao, tipo_votacao=2,
+                       votacao_aberta=True)
+    cria_presentes(sessao, ordem, quantidade)
+
+    with CaptureQueriesContext(connection) as consultas:
+        response = get_votos(get_presentes(sessao.pk, {}, ordem), ordem)
+
+    assert response['num_presentes'] == quantidade
+    assert len(response['presentes']) == quantidade
+    for presente in response['presentes']:
+        assert presente['partido'] == 'PT'
+        assert presente['voto'] == 'Voto Informado'
+
+    return len(consultas)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_numero_consultas_painel_independe_dos_presentes():
+    assert consultas_painel(2) == consultas_painel(10)
+
+
+@pytest.mark.django_db(transaction=False)
+def test_stream_painel_desabilitado(admin_client):
+    sessao = mommy.make(SessaoPlenaria)
+    url = reverse('sapl.painel:stream_dados_painel', args=[sessao.pk])
+    assert admin_client.get(url).status_code == 404
+
+
+@pytest.mark.django_db(transaction=False)
+@override_settings(PAINEL_STREAM=True, PAINEL_STREAM_DURACAO=0.01,
+                   PAINEL_STREAM_INTERVALO=0.001)
+def test_stream_painel_publica_versao(admin_client):
+    sessao = mommy.make(SessaoPlenaria)
+    url = reverse('sapl.painel:stream_dados_painel', args=[sessao.pk])
+
+    response = admin_client.get(url)
+    assert response['Content-Type'] == 'text/event-stream'
+    eventos = b''.join(response.streaming_content).decode()
+    assert eventos.startswith('retry: 1\n\n')
+    assert eventos.count('event: painel') == 1
+    assert 'id: {}\n'.format(versao_painel(sessao.pk)) in eventos
+
+    # a versão já recebida pelo navegador não é publicada novamente
+    response = admin_client.get(
+        url, HTTP_LAST_EVENT_ID=versao_painel(sessao.pk))
+    assert 'event: painel' not in b''.join(
+        response.streaming_content).decode()
+
+
+@pytest.mark.django_db(transaction=False)
+def test_dados_painel_nao_modificados_sem_consultas(admin_user):
+    sessao = mommy.make(SessaoPlenaria)
+    url = reverse('sapl.painel:dados_painel', args=[sessao.pk])
+
+    def consulta(**headers):
+        request = RequestFactory().get(url, **headers)
+        request.user = admin_user
+        request.session = {}
+        with CaptureQueriesContext(connection) as consultas:
+            response = get_dados_painel(request, sessao.pk)
+        return response, len(consultas)
+
+    response, _ = consulta()
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    # a mesma versão é respondida da memória, sem acessar o banco
+    response, consultas = consulta(HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert consultas == 0
+
+    response, consultas = consulta()
+    assert response.status_code == 200
+    assert response['ETag'] == etag
+    assert consultas == 0
+
+    atualiza_versao_painel(sessao.pk)
+    response, _ = consulta(HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
@@ -3,7 +3,8 @@ from django.conf.urls import url
 from .apps import AppConfig
 from .views import (cronometro_painel, get_dados_painel, painel_mensagem_view,
                     painel_parlamentar_view, painel_view, painel_votacao_view,
-                    switch_painel, verifica_painel, votante_view)
+                    stream_dados_painel, switch_painel, verifica_painel,
+                    votante_view)
 
 app_name = AppConfig.name
 
@@ -11,6 +12,8 @@ urlpatterns = [
     url(r'^painel-principal/(?P<pk>\d+)$', painel_view,
         name="painel_principal"),
     url(r'^painel/(?P<pk>\d+)/dados$', get_dados_painel, name='dados_painel'),
+    url(r'^painel/(?P<pk>\d+)/stream$', stream_dados_painel,
+        name='stream_dados_painel'),
     url(r'^painel/mensagem$', painel_mensagem_view, name="painel_mensagem"),
     url(r'^painel/parlamentar$', painel_parlamentar_view,
         name='painel_parlamentar'),
@@ -0,0 +1,72 @@
+from django.core.cache import cache
+
+from sapl.utils import incrementa_versao, versao_compartilhada
+
+CRONOMETROS_PAINEL = ('aparte', 'discurso', 'ordem', 'consideracoes')
+
+CHAVE_VERSAO_PAINEL = 'sapl_painel_versao_{}'
+CHAVE_VERSAO_GLOBAL_PAINEL = 'sapl_painel_versao'
+CHAVE_CRONOMETROS_PAINEL = 'sapl_painel_cronometros_{}'
+CHAVE_DADOS_PAINEL = 'sapl_painel_dados_{}'
+
+# Dados do painel já montados neste processo: pk da sessão -> (versão, dados)
+DADOS_PAINEL = {}
+
+
+def versao_painel(pk):
+    '''
+    Versão atual dos dados do painel da sessão plenária pk.
+
+    A versão é compartilhada entre os workers através do cache e é
+    composta por um contador global, incrementado quando dados comuns a
+    todas as sessões mudam (Casa Legislativa, configurações, parlamentares),
+    e um contador da sessão, incrementado sempre que votos, presenças,
+    oradores ou cronômetros da sessão são alterados.
+    '''
+    return versao_compartilhada(
+        (CHAVE_VERSAO_GLOBAL_PAINEL, CHAVE_VERSAO_PAINEL.format(pk)))
+
+
+def atualiza_versao_painel(pk):
+    incrementa_versao(CHAVE_VERSAO_PAINEL.format(pk))
+
+
+def atualiza_versao_global_painel():
+    incrementa_versao(CHAVE_VERSAO_GLOBAL_PAINEL)
+
+
+def dados_painel_versao(pk, versao, montar_dados):
+    '''
+    Retorna os dados do painel da sessão pk na versão informada.
+
+    Os dados são procurados primeiro na memória do processo e depois no
+    cache compartilhado; somente quando nenhum deles possui a versão pedida
+    é que montar_dados é chamada, uma vez por versão.
+    '''
+    pk = int(pk)
+    snapshot = DADOS_PAINEL.get(pk)
+    if not snapshot or snapshot[0] != versao:
+        chave = CHAVE_DADOS_PAINEL.format(pk)
+        snapshot = cache.get(chave)
+        if not snapshot or snapshot[0] != versao:
+            snapshot = (versao, montar_dados(pk))
+            cache.set(chave, snapshot)
+        DADOS_PAINEL[pk] = snapshot
+    return dict(snapshot[1])
+
+
+def cronometros_painel(pk):
+    return cache.get(CHAVE_CRONOMETROS_PAINEL.format(pk), {})
+
+
+def registra_cronometro_painel(pk, tipo, action):
+    cronometros = cronometros_painel(pk)
+    cronometros[tipo] = action
+    cache.set(CHAVE_CRONOMETROS_PAINEL.format(pk), cronometros, None)
+    atualiza_versao_painel(pk)
+
+
+def reinicia_cronometros_painel(pk):
+    cache.set(CHAVE_CRONOMETROS_PAINEL.format(pk),
+              {nome: 'stop' for nome in CRONOMETROS_PAINEL}, None)
+    atualiza_versao_painel(pk)
@@ -1,33 +1,42 @@
 import html
 import json
 import logging
+import time
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
 from django.db.models import Q
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.http.response import Http404, HttpResponseRedirect
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.http import condition
 
-from sapl.base.models import AppConfig as ConfiguracoesAplicacao
-from sapl.base.models import CasaLegislativa
+from sapl.base.models import cache_configuracao
 from sapl.crud.base import Crud
 from sapl.painel.apps import AppConfig
-from sapl.parlamentares.models import Legislatura, Parlamentar, Votante
+from sapl.parlamentares.models import (Legislatura, Mandato, Parlamentar,
+                                       Votante)
 from sapl.sessao.models import (ExpedienteMateria, OradorExpediente, OrdemDia,
                                 PresencaOrdemDia, RegistroVotacao,
                                 SessaoPlenaria, SessaoPlenariaPresenca,
                                 VotoParlamentar)
-from sapl.utils import filiacao_data, get_client_ip, sort_lista_chave
+from sapl.utils import filiacoes_data, get_client_ip, sort_lista_chave
 
 from .models import Cronometro
+from .utils import (CRONOMETROS_PAINEL, cronometros_painel,
+                    dados_painel_versao, registra_cronometro_painel,
+                    versao_painel)
 
 VOTACAO_NOMINAL = 2
 
+PAINEL_STREAM_KEEPALIVE = 15
+
 CronometroPainelCrud = Crud.build(Cronometro, '')
 
 # FIXME mudar lógica
@@ -290,7 +299,8 @@ def votante_view(request):
 
 @user_passes_test(check_permission)
 def painel_view(request, pk):
-    context = {'head_title': str(_('Painel Plenário')), 'sessao_id': pk}
+    context = {'head_title': str(_('Painel Plenário')), 'sessao_id': pk,
+               'painel_stream': settings.PAINEL_STREAM}
     return render(request, 'painel/index.html', context)
 
 
@@ -334,6 +344,10 @@ def painel_votacao_view(request):
 @user_passes_test(check_permission)
 def cronometro_painel(request):
     request.session[request.GET['tipo']] = request.GET['action']
+    if request.GET.get('pk_sessao'):
+        registra_cronometro_painel(request.GET['pk_sessao'],
+                                   request.GET['tipo'],
+                                   request.GET['action'])
     return HttpResponse({})
 
 
@@ -355,18 +369,26 @@ def get_materia_aberta(pk):
 
 
 def get_presentes(pk, response, materia):
+    '''
+    Monta a lista de presentes e de oradores da sessão com um número fixo
+    de consultas, independente do número de parlamentares: mandatos na
+    legislatura e filiações na data da sessão são buscados de uma só vez
+    para todos os presentes e combinados em memória.
+    '''
     if type(materia) == OrdemDia:
         presentes = PresencaOrdemDia.objects.filter(
             sessao_plenaria_id=pk)
     else:
         presentes = SessaoPlenariaPresenca.objects.filter(
             sessao_plenaria_id=pk)
+    presentes = list(presentes.select_related('parlamentar'))
 
     sessao = SessaoPlenaria.objects.get(id=pk)
     num_presentes = len(presentes)
     data_sessao = sessao.data_inicio
     oradores = OradorExpediente.objects.filter(
-        sessao_plenaria_id=pk).order_by('numero_ordem')
+        sessao_plenaria_id=pk).select_related(
+            'parlamentar').order_by('numero_ordem')
 
     oradores_list = []
     for o in oradores:
@@ -377,28 +399,27 @@ def get_presentes(pk, response, materia):
                 'numero': o.numero_ordem
             })
 
+    parlamentares_id = {p.parlamentar_id for p in presentes}
+
+    # Parlamentares com mandato na legislatura da sessão
+    com_mandato = set(Mandato.objects.filter(
+        legislatura_id=sessao.legislatura_id,
+        parlamentar_id__in=parlamentares_id).values_list(
+            'parlamentar_id', flat=True))
+
+    filiacoes = filiacoes_data(com_mandato, data_sessao, data_sessao)
+
     presentes_list = []
     for p in presentes:
-        legislatura = sessao.legislatura
-        # Recupera os mandatos daquele parlamentar
-        mandatos = p.parlamentar.mandato_set.filter(legislatura=legislatura)
-
-        if p.parlamentar.ativo and mandatos:
-            filiacao = filiacao_data(p.parlamentar, data_sessao, data_sessao)
-            if not filiacao:
-                partido = 'Sem Registro'
-            else:
-                partido = filiacao
-
+        if p.parlamentar.ativo and p.parlamentar_id in com_mandato:
             presentes_list.append(
                 {'id': p.id,
-                 'parlamentar_id': p.parlamentar.id,
+                 'parlamentar_id': p.parlamentar_id,
                  'nome': p.parlamentar.nome_parlamentar,
-                 'partido': partido,
+                 'partido': filiacoes.get(p.parlamentar_id) or 'Sem Registro',
                  'voto': ''
                  })
-
-        elif not p.parlamentar.ativo or not mandatos:
+        else:
             num_presentes += -1
 
     if materia:
@@ -436,19 +457,22 @@ def get_materia_expediente_aberta(pk):
 def response_nenhuma_materia(response):
     response.update({
         'msg_painel': str(_('Nenhuma matéria disponivel para votação.'))})
-    return JsonResponse(response)
+    return response
 
 
 def get_votos(response, materia):
-    logger = logging.getLogger(__name__)
     if type(materia) == OrdemDia:
         registro = RegistroVotacao.objects.filter(
-            ordem=materia, materia=materia.materia).last()
-        tipo = 'ordem'
+            ordem=materia, materia=materia.materia).select_related(
+                'tipo_resultado_votacao').last()
+        votos_parlamentares = VotoParlamentar.objects.filter(
+            ordem_id=materia.id)
     elif type(materia) == ExpedienteMateria:
         registro = RegistroVotacao.objects.filter(
-            expediente=materia, materia=materia.materia).last()
-        tipo = 'expediente'
+            expediente=materia, materia=materia.materia).select_related(
+                'tipo_resultado_votacao').last()
+        votos_parlamentares = VotoParlamentar.objects.filter(
+            expediente_id=materia.id)
 
     if not registro:
         response.update({
@@ -461,24 +485,13 @@ def get_votos(response, materia):
         })
 
         if materia.tipo_votacao == 2:
-            if tipo == 'ordem':
-                votos_parlamentares = VotoParlamentar.objects.filter(
-                    ordem_id=materia.id).order_by(
-                        'parlamentar__nome_parlamentar')
-            else:
-                votos_parlamentares = VotoParlamentar.objects.filter(
-                    expediente_id=materia.id).order_by(
-                        'parlamentar__nome_parlamentar')
-
-            for i, p in enumerate(response['presentes']):
-                try:
-                    logger.info("Tentando obter votos do parlamentar (id={}).".format(p['parlamentar_id']))
-                    if votos_parlamentares.get(parlamentar_id=p['parlamentar_id']).voto:
-                        response['presentes'][i]['voto'] = 'Voto Informado'
-                except ObjectDoesNotExist:
-                    logger.error("Votos do parlamentar (id={}) não encontrados. Retornado vazio."
-                                 .format(p['parlamentar_id']))
-                    response['presentes'][i]['voto'] = ''
+            # Todos os votos da matéria em uma única consulta
+            votos = dict(votos_parlamentares.values_list(
+                'parlamentar_id', 'voto'))
+
+            for p in response['presentes']:
+                p['voto'] = 'Voto Informado' \
+                    if votos.get(p['parlamentar_id']) else ''
 
     else:
         total = (registro.numero_votos_sim +
@@ -486,18 +499,12 @@ def get_votos(response, materia):
                  registro.numero_abstencoes)
 
         if materia.tipo_votacao == 2:
-            votos_parlamentares = VotoParlamentar.objects.filter(
-                votacao_id=registro.id).order_by(
-                    'parlamentar__nome_parlamentar')
-
-            for i, p in enumerate(response['presentes']):
-                try:
-                    logger.debug("Tentando obter votos do parlamentar (id={}).".format(p['parlamentar_id']))
-                    response['presentes'][i]['voto'] = votos_parlamentares.get(
-                        parlamentar_id=p['parlamentar_id']).voto
-                except ObjectDoesNotExist:
-                    logger.error("Votos do parlamentar (id={}) não encontrados. Retornado None.".format(p['parlamentar_id']))
-                    response['presentes'][i]['voto'] = None
+            votos = dict(VotoParlamentar.objects.filter(
+                votacao_id=registro.id).values_list(
+                    'parlamentar_id', 'voto'))
+
+            for p in response['presentes']:
+                p['voto'] = votos.get(p['parlamentar_id'])
 
         response.update({
             'numero_votos_sim': registro.numero_votos_sim,
@@ -511,13 +518,16 @@ def get_votos(response, materia):
     return response
 
 
-@user_passes_test(check_permission)
-def get_dados_painel(request, pk):
+def dados_painel(pk):
+    '''
+    Monta os dados exibidos no painel da sessão plenária pk, exceto o
+    estado dos cronômetros, que é acrescentado por get_cronometros.
+    '''
     sessao = SessaoPlenaria.objects.get(id=pk)
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
-    app_config = ConfiguracoesAplicacao.objects.first()
+    app_config = cache_configuracao.app_config()
 
     brasao = None
     if casa and app_config and (bool(casa.logotipo)):
@@ -528,10 +538,6 @@ def get_dados_painel(request, pk):
         'sessao_plenaria': str(sessao),
         'sessao_plenaria_data': sessao.data_inicio.strftime('%d/%m/%Y'),
         'sessao_plenaria_hora_inicio': sessao.hora_inicio,
-        'cronometro_aparte': get_cronometro_status(request, 'aparte'),
-        'cronometro_discurso': get_cronometro_status(request, 'discurso'),
-        'cronometro_ordem': get_cronometro_status(request, 'ordem'),
-        'cronometro_consideracoes': get_cronometro_status(request, 'consideracoes'),
         'status_painel': sessao.painel_aberto,
         'brasao': brasao
     }
@@ -542,13 +548,13 @@ def get_dados_painel(request, pk):
     # Caso tenha alguma matéria com votação aberta, ela é mostrada no painel
     # com prioridade para Ordem do Dia.
     if ordem_dia:
-        return JsonResponse(get_votos(
+        return get_votos(
             get_presentes(pk, response, ordem_dia),
-            ordem_dia))
+            ordem_dia)
     elif expediente:
-        return JsonResponse(get_votos(
+        return get_votos(
             get_presentes(pk, response, expediente),
-            expediente))
+            expediente)
 
     # Caso não tenha nenhuma aberta,
     # a matéria a ser mostrada no Painel deve ser a última votada
@@ -577,9 +583,91 @@ def get_dados_painel(request, pk):
         elif last_expediente_voto:
             materia = ultimo_expediente_votado
 
-        return JsonResponse(get_votos(
-                            get_presentes(pk, response, materia),
-                            materia))
+        return get_votos(get_presentes(pk, response, materia), materia)
 
     # Retorna que não há nenhuma matéria já votada ou aberta
     return response_nenhuma_materia(get_presentes(pk, response, None))
+
+
+def get_cronometros(request, pk):
+    '''
+    Estado dos cronômetros do painel. O estado compartilhado da sessão,
+    registrado por cronometro_painel, tem precedência sobre o estado
+    guardado na sessão do usuário.
+    '''
+    cronometros = cronometros_painel(pk)
+    return {
+        'cronometro_{}'.format(nome): cronometros[nome]
+        if nome in cronometros else get_cronometro_status(request, nome)
+        for nome in CRONOMETROS_PAINEL}
+
+
+def etag_dados_painel(request, pk):
+    cronometros = get_cronometros(request, pk)
+    return '{}-{}'.format(
+        versao_painel(pk),
+        '-'.join(cronometros[c] for c in sorted(cronometros)))
+
+
+@user_passes_test(check_permission)
+@condition(etag_func=etag_dados_painel)
+def get_dados_painel(request, pk):
+    '''
+    Dados do painel servidos a partir do snapshot da versão atual da
+    sessão. Consultas repetidas de uma mesma versão são respondidas com
+    304 (Not Modified) ou a partir da memória, sem acesso ao banco.
+    '''
+    dados = dados_painel_versao(pk, versao_painel(pk), dados_painel)
+    dados.update(get_cronometros(request, pk))
+    response = JsonResponse(dados)
+    # o navegador deve sempre revalidar o ETag a cada consulta
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def evento_painel(versao, dados):
+    return 'id: {}\nevent: painel\ndata: {}\n\n'.format(
+        versao, json.dumps(dados, cls=DjangoJSONEncoder))
+
+
+@user_passes_test(check_permission)
+def stream_dados_painel(request, pk):
+    '''
+    Canal Server-Sent Events do painel. Uma nova versão dos dados, no mesmo
+    formato de get_dados_painel, é publicada somente quando votos,
+    presenças, oradores ou cronômetros da sessão são alterados. A conexão
+    é encerrada após PAINEL_STREAM_DURACAO segundos e o navegador se
+    reconecta informando a última versão recebida (Last-Event-ID).
+
+    Disponível apenas quando PAINEL_STREAM está habilitado.
+    '''
+    if not settings.PAINEL_STREAM:
+        raise Http404()
+    get_object_or_404(SessaoPlenaria, pk=pk)
+
+    def eventos():
+        versao_enviada = request.META.get('HTTP_LAST_EVENT_ID', '')
+        inicio = ultimo_envio = time.time()
+
+        yield 'retry: {}\n\n'.format(
+            int(settings.PAINEL_STREAM_INTERVALO * 1000))
+
+        while time.time() - inicio < settings.PAINEL_STREAM_DURACAO:
+            versao = versao_painel(pk)
+            if versao != versao_enviada:
+                dados = dados_painel_versao(pk, versao, dados_painel)
+                dados.update(get_cronometros(request, pk))
+                yield evento_painel(versao, dados)
+                versao_enviada = versao
+                ultimo_envio = time.time()
+            elif time.time() - ultimo_envio > PAINEL_STREAM_KEEPALIVE:
+                # comentário SSE: mantém a conexão aberta em proxies
+                yield ': keepalive\n\n'
+                ultimo_envio = time.time()
+            time.sleep(settings.PAINEL_STREAM_INTERVALO)
+
+    response = StreamingHttpResponse(
+        eventos(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
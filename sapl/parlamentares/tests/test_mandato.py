@@ -4,6 +4,7 @@ import pytest
 from model_mommy import mommy
 
 from sapl.parlamentares.models import Filiacao, Legislatura, Mandato
+from sapl.utils import filiacao_data, filiacoes_data
 
 pytestmark = pytest.mark.django_db
 
@@ -31,3 +32,30 @@ def test_filiacoes():
     assert mandato.get_partidos() == [f2.partido.sigla,
                                       f3.partido.sigla,
                                       f4.partido.sigla]
+
+
+def test_filiacao_data_indice():
+    mandato = mommy.make(Mandato)
+    parlamentar = mandato.parlamentar
+    f1, f2 = [mommy.make(Filiacao,
+                         parlamentar=parlamentar,
+                         data=ini,
+                         data_desfiliacao=fim)
+              for ini, fim in (
+        (data('2000-01-01'), data('2001-03-01')),
+        (data('2001-03-02'), None),
+    )]
+
+    assert filiacao_data(parlamentar, data('2000-06-01')) == f1.partido.sigla
+    assert filiacao_data(parlamentar, data('2002-01-01')) == f2.partido.sigla
+    assert filiacao_data(parlamentar, data('1999-01-01')) == ''
+    assert filiacao_data(parlamentar,
+                         data('2000-06-01'),
+                         data('2002-01-01')) == ' | '.join(
+        [f2.partido.sigla, f1.partido.sigla])
+    assert filiacoes_data([parlamentar.pk], data('2002-01-01')) == {
+        parlamentar.pk: f2.partido.sigla}
+
+    # o índice é atualizado quando uma filiação muda
+    f2.delete()
+    assert filiacao_data(parlamentar, data('2002-01-01')) == ''
@@ -407,8 +407,7 @@ class ProtocoloDocumentForm(ModelForm):
                             row3,
                             css_id='protocolo_data_hora_manual')
 
-        config = AppConfig.objects.first()
-        if not config.protocolo_manual:
+        if not AppConfig.attr('protocolo_manual'):
             row3 = to_row([(HTML("&nbsp;"), 12)])
             fieldset = row3
 
@@ -431,7 +430,7 @@ class ProtocoloDocumentForm(ModelForm):
         super(ProtocoloDocumentForm, self).__init__(
             *args, **kwargs)
 
-        if not config.protocolo_manual:
+        if not AppConfig.attr('protocolo_manual'):
             self.fields['data_hora_manual'].widget = forms.HiddenInput()
 
 
@@ -597,8 +596,7 @@ class ProtocoloMateriaForm(ModelForm):
                             row3,
                             css_id='protocolo_data_hora_manual')
 
-        config = AppConfig.objects.first()
-        if not config.protocolo_manual:
+        if not AppConfig.attr('protocolo_manual'):
             row3 = to_row([(HTML("&nbsp;"), 12)])
             fieldset = row3
 
@@ -621,7 +619,7 @@ class ProtocoloMateriaForm(ModelForm):
         super(ProtocoloMateriaForm, self).__init__(
             *args, **kwargs)
 
-        if not config.protocolo_manual:
+        if not AppConfig.attr('protocolo_manual'):
             self.fields['data_hora_manual'].widget = forms.HiddenInput()
 
 
@@ -12,7 +12,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.db.models import Max, Q
-from django.http import Http404, HttpResponse, JsonResponse
+from django.http import Http404, JsonResponse
 from django.http.response import HttpResponseRedirect
 from django.shortcuts import redirect
 from django.utils import timezone
@@ -24,7 +24,7 @@ from django_filters.views import FilterView
 
 import sapl
 from sapl.base.email_utils import do_envia_email_confirmacao
-from sapl.base.models import Autor, CasaLegislativa
+from sapl.base.models import Autor, cache_configuracao
 from sapl.base.signals import tramitacao_signal
 from sapl.comissoes.models import Comissao
 from sapl.crud.base import Crud, CrudAux, MasterDetailCrud, make_pagination
@@ -33,7 +33,7 @@ from sapl.materia.views import gerar_pdf_impressos
 from sapl.parlamentares.models import Legislatura, Parlamentar
 from sapl.protocoloadm.models import Protocolo
 from sapl.utils import (create_barcode, get_base_url, get_client_ip,
-                        get_mime_type_from_file_extension,
+                        resposta_arquivo_protegido,
                         show_results_filter_set, mail_service_configured)
 
 from .forms import (AcompanhamentoDocumentoForm, AnularProcoloAdmForm,
@@ -96,15 +96,7 @@ def doc_texto_integral(request, pk):
         if documento.texto_integral:
             arquivo = documento.texto_integral
 
-            mime = get_mime_type_from_file_extension(arquivo.name)
-
-            with open(arquivo.path, 'rb') as f:
-                data = f.read()
-
-            response = HttpResponse(data, content_type='%s' % mime)
-            response['Content-Disposition'] = (
-                'inline; filename="%s"' % arquivo.name.split('/')[-1])
-            return response
+            return resposta_arquivo_protegido(request, arquivo)
     raise Http404
 
 
@@ -236,7 +228,7 @@ class AcompanhamentoDocumentoView(CreateView):
                     documento=documento,
                     email=email,
                     confirmado=False)
-                casa = CasaLegislativa.objects.first()
+                casa = cache_configuracao.casa_legislativa()
 
                 do_envia_email_confirmacao(base_url,
                                            casa,
@@ -266,7 +258,7 @@ class AcompanhamentoDocumentoView(CreateView):
                     confirmado=False
                 )
 
-                casa = CasaLegislativa.objects.first()
+                casa = cache_configuracao.casa_legislativa()
 
                 do_envia_email_confirmacao(base_url,
                                            casa,
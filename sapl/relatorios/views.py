@@ -11,7 +11,7 @@ from django.utils.translation import ugettext_lazy as _
 from django.template.loader import render_to_string
 
 from sapl.settings import MEDIA_URL
-from sapl.base.models import Autor, CasaLegislativa
+from sapl.base.models import Autor, cache_configuracao
 from sapl.comissoes.models import Comissao
 from sapl.materia.models import (Autoria, MateriaLegislativa, Numeracao,
                                  Tramitacao, UnidadeTramitacao)
@@ -174,7 +174,7 @@ def relatorio_materia(request):
     response['Content-Disposition'] = (
         'inline; filename="relatorio_materia.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     cabecalho = get_cabecalho(casa)
     rodape = get_rodape(casa)
@@ -266,7 +266,7 @@ def relatorio_capa_processo(request):
     response[
         'Content-Disposition'] = ('inline; filename="relatorio_processo.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     cabecalho = get_cabecalho(casa)
     rodape = get_rodape(casa)
@@ -307,7 +307,7 @@ def relatorio_ordem_dia(request):
     response['Content-Disposition'] = (
         'inline; filename="relatorio_ordem_dia.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     cabecalho = get_cabecalho(casa)
     rodape = get_rodape(casa)
@@ -339,7 +339,7 @@ def relatorio_documento_administrativo(request):
     response['Content-Disposition'] = (
         'inline; filename="relatorio_documento_administrativo.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     cabecalho = get_cabecalho(casa)
     rodape = get_rodape(casa)
@@ -405,7 +405,7 @@ def relatorio_espelho(request):
     response['Content-Disposition'] = (
         'inline; filename="relatorio_espelho.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     cabecalho = get_cabecalho(casa)
     rodape = get_rodape(casa)
@@ -890,7 +890,7 @@ def relatorio_sessao_plenaria(request, pk):
     response['Content-Disposition'] = (
         'inline; filename="relatorio_protocolo.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     if not casa:
         raise Http404
@@ -1009,7 +1009,7 @@ def relatorio_protocolo(request):
         'Content-Disposition'] = (
             'inline; filename="relatorio_protocolo.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     cabecalho = get_cabecalho(casa)
     rodape = get_rodape(casa)
@@ -1047,7 +1047,7 @@ def relatorio_etiqueta_protocolo(request, nro, ano):
         'Content-Disposition'] = (
             'inline; filename="relatorio_etiqueta_protocolo.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     cabecalho = get_cabecalho(casa)
     rodape = get_rodape(casa)
@@ -1128,7 +1128,7 @@ def relatorio_pauta_sessao(request, pk):
         'Content-Disposition'] = (
             'inline; filename="relatorio_pauta_sessao.pdf"')
 
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
 
     rodape = get_rodape(casa)
     imagem = get_imagem(casa)
@@ -1275,7 +1275,7 @@ def make_pdf(base_url,main_template,header_template,main_css='',header_css=''):
 
 def resumo_ata_pdf(request,pk):
     base_url = request.build_absolute_uri()
-    casa = CasaLegislativa.objects.first()
+    casa = cache_configuracao.casa_legislativa()
     rodape = ' '.join(get_rodape(casa))
    
     sessao_plenaria = SessaoPlenaria.objects.get(pk=pk)
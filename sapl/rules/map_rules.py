@@ -147,6 +147,7 @@ rules_group_norma = {
         (norma.AnexoNormaJuridica, __base__, __perms_publicas__),
         (norma.AutoriaNorma, __base__, __perms_publicas__),
         (norma.NormaEstatisticas, __base__, __perms_publicas__),
+        (norma.NormaAcessosMes, __base__, __perms_publicas__),
 
         # Publicacao está com permissão apenas para norma e não para matéria
         # e proposições apenas por análise do contexto, não é uma limitação
@@ -227,6 +228,9 @@ rules_group_geral = {
          [RP_ADD], __perms_publicas__),
         (base.TipoAutor, __base__, __perms_publicas__),
         (base.Autor, __base__, __perms_publicas__),
+        (base.MensagemEmail, __base__, set()),
+        (base.FilaIndexacao, __base__, set()),
+        (base.TextoExtraido, __base__, set()),
 
         (protocoloadm.StatusTramitacaoAdministrativo, __base__, set()),
         (protocoloadm.TipoDocumentoAdministrativo, __base__, set()),
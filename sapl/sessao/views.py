@@ -31,6 +31,7 @@ from sapl.materia.forms import filtra_tramitacao_status
 from sapl.materia.models import (Autoria, TipoMateriaLegislativa,
                                  Tramitacao)
 from sapl.materia.views import MateriaLegislativaPesquisaView
+from sapl.painel.utils import reinicia_cronometros_painel
 from sapl.parlamentares.models import (Filiacao, Legislatura, Mandato,
                                        Parlamentar, SessaoLegislativa)
 from sapl.sessao.apps import AppConfig
@@ -876,6 +877,7 @@ class PainelView(PermissionRequiredForAppCrudMixin, TemplateView):
         request.session['aparte'] = 'stop'
         request.session['ordem'] = 'stop'
         request.session['consideracoes'] = 'stop'
+        reinicia_cronometros_painel(kwargs['pk'])
 
         return TemplateView.get(self, request, *args, **kwargs)
 
@@ -1513,7 +1515,7 @@ def get_assinaturas(sessao_plenaria):
 
     context = {}
 
-    config_assinatura_ata = AppsAppConfig.objects.first().assinatura_ata
+    config_assinatura_ata = AppsAppConfig.attr('assinatura_ata')
     if config_assinatura_ata == 'T' and parlamentares_ordem:
         context.update(
             {'texto_assinatura': 'Assinatura de Todos os Parlamentares Presentes na Sessão'})
@@ -114,7 +114,9 @@ SOLR_URL = config('SOLR_URL', cast=str, default='http://localhost:8983')
 SOLR_COLLECTION = config('SOLR_COLLECTION', cast=str, default='sapl')
 
 if USE_SOLR:
-    HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'  # enable auto-index
+    # enable auto-index: objetos alterados entram na fila processada pelo
+    # comando atualiza_indice
+    HAYSTACK_SIGNAL_PROCESSOR = 'sapl.base.indexacao.FilaSignalProcessor'
     SEARCH_BACKEND = 'haystack.backends.solr_backend.SolrEngine'
     SEARCH_URL = ('URL', '{}/solr/{}'.format(SOLR_URL, SOLR_COLLECTION))
 
@@ -242,6 +244,16 @@ EMAIL_RUNNING = None
 MAX_DOC_UPLOAD_SIZE = 60 * 1024 * 1024  # 60MB
 MAX_IMAGE_UPLOAD_SIZE = 2 * 1024 * 1024  # 2MB
 
+# Canal de atualização do painel (Server-Sent Events). Cada conexão ocupa
+# um worker durante PAINEL_STREAM_DURACAO segundos, por isso o canal vem
+# desabilitado e os painéis consultam os dados periodicamente. Habilite-o
+# apenas com workers assíncronos do gunicorn (GUNICORN_WORKER_CLASS=gevent
+# ou eventlet); a duração deve ficar abaixo do --timeout do gunicorn.
+PAINEL_STREAM = config('PAINEL_STREAM', cast=bool, default=False)
+PAINEL_STREAM_DURACAO = config('PAINEL_STREAM_DURACAO', cast=int, default=45)
+PAINEL_STREAM_INTERVALO = config(
+    'PAINEL_STREAM_INTERVALO', cast=float, default=0.5)
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 LANGUAGE_CODE = 'pt-br'
@@ -302,6 +314,13 @@ MEDIA_URL = '/media/'
 
 FILE_UPLOAD_PERMISSIONS = 0o644
 
+# Entrega de arquivos protegidos pelo servidor web: 'nginx' usa o cabeçalho
+# X-Accel-Redirect com SENDFILE_URL, uma location internal do nginx com
+# alias para MEDIA_ROOT; 'apache' usa X-Sendfile (mod_xsendfile) com o
+# caminho do arquivo. Vazio: o próprio Django envia o arquivo.
+SENDFILE_BACKEND = config('SENDFILE_BACKEND', default='')
+SENDFILE_URL = config('SENDFILE_URL', default='/protected/')
+
 DAB_FIELD_RENDERER = \
     'django_admin_bootstrapped.renderers.BootstrapFieldRenderer'
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
@@ -1,4 +1,12 @@
-from .utils import listify
+from datetime import date
+from types import SimpleNamespace
+import itertools
+
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from .utils import (intervalos_sobrepostos, intervalos_tem_intersecao,
+                    listify, resposta_arquivo_protegido)
 
 
 def test_listify():
@@ -8,3 +16,58 @@ def test_listify():
         yield 1
         yield 2
     assert [1, 2] == gen()
+
+
+@override_settings(SENDFILE_BACKEND='')
+def test_resposta_arquivo_protegido(tmpdir):
+    caminho = tmpdir.join('documento.pdf')
+    caminho.write_binary(bytes(range(256)) * 4)
+    arquivo = SimpleNamespace(name='sapl/documento.pdf', path=str(caminho))
+
+    def resposta(**headers):
+        return resposta_arquivo_protegido(
+            RequestFactory().get('/', **headers), arquivo)
+
+    response = resposta()
+    assert response.status_code == 200
+    assert response['Accept-Ranges'] == 'bytes'
+    assert b''.join(response.streaming_content) == caminho.read_binary()
+
+    response = resposta(HTTP_RANGE='bytes=10-19')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 10-19/1024'
+    assert b''.join(response.streaming_content) == bytes(range(10, 20))
+
+    response = resposta(HTTP_RANGE='bytes=-4')
+    assert b''.join(response.streaming_content) == bytes(range(252, 256))
+
+    assert resposta(HTTP_RANGE='bytes=2000-').status_code == 416
+
+    last_modified = response['Last-Modified']
+    assert resposta(
+        HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+    with override_settings(SENDFILE_BACKEND='nginx',
+                           SENDFILE_URL='/protected/'):
+        response = resposta()
+    assert response['X-Accel-Redirect'] == '/protected/sapl/documento.pdf'
+    assert not response.content
+
+
+def test_intervalos_sobrepostos():
+    intervalos = [(date(2000, 1, 1), date(2004, 12, 31)),
+                  (date(2004, 12, 31), date(2008, 12, 31)),
+                  (date(2009, 1, 1), None),
+                  (date(2002, 1, 1), date(2003, 1, 1)),
+                  (date(2010, 1, 1), date(2009, 1, 1)),
+                  (date(2015, 1, 1), date(2016, 1, 1))]
+
+    hoje = date.today()
+    esperados = {
+        frozenset((a, b)) for a, b in itertools.combinations(intervalos, 2)
+        if intervalos_tem_intersecao(a[0], a[1] or hoje, b[0], b[1] or hoje)}
+
+    pares = intervalos_sobrepostos(
+        intervalos, lambda i: i[0], lambda i: i[1])
+    assert len(pares) == len(esperados)
+    assert {frozenset(p) for p in pares} == esperados
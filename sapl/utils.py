@@ -1,8 +1,10 @@
+import datetime
 from functools import wraps
 import hashlib
 from operator import itemgetter
 import os
 import re
+import time
 from unicodedata import normalize as unicodedata_normalize
 import unicodedata
 
@@ -13,6 +15,7 @@ from django.conf import settings
 from django.contrib import admin
 from django.contrib.contenttypes.fields import (GenericForeignKey, GenericRel,
                                                 GenericRelation)
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import UploadedFile
 from django.core.mail import get_connection
@@ -20,9 +23,14 @@ from django.db import models
 from django.db.models import Q
 from django.forms import BaseForm
 from django.forms.widgets import SplitDateTimeWidget
+from django.http import (FileResponse, HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
 from django.utils import six, timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
+from django.views.static import was_modified_since
 import django_filters
 from easy_thumbnails import source_generators
 from floppyforms import ClearableFileInput
@@ -547,6 +555,26 @@ def intervalos_tem_intersecao(a_inicio, a_fim, b_inicio, b_fim):
     return maior_inicio <= menor_fim
 
 
+def intervalos_sobrepostos(objetos, inicio, fim):
+    '''
+    Pares de objetos cujos intervalos [inicio(obj), fim(obj)] se sobrepõem,
+    como em intervalos_tem_intersecao; fim None vale a data atual.
+
+    Em vez de comparar todas as combinações, os objetos são percorridos em
+    ordem de início e cada um é comparado apenas com os intervalos ainda
+    abertos.
+    '''
+    hoje = timezone.now().date()
+    abertos = []
+    pares = []
+    for obj in sorted(objetos, key=inicio):
+        abertos = [a for a in abertos if (fim(a) or hoje) >= inicio(obj)]
+        if (fim(obj) or hoje) >= inicio(obj):
+            pares.extend((a, obj) for a in abertos)
+            abertos.append(obj)
+    return pares
+
+
 class MateriaPesquisaOrderingFilter(django_filters.OrderingFilter):
 
     choices = (
@@ -801,24 +829,177 @@ def qs_override_django_filter(self):
     return self._qs
 
 
-def filiacao_data(parlamentar, data_inicio, data_fim=None):
-    from sapl.parlamentares.models import Filiacao
+def como_data(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        return parse_date(valor)
+    return valor
 
-    filiacoes_parlamentar = Filiacao.objects.filter(
-        parlamentar=parlamentar)
 
-    filiacoes = filiacoes_parlamentar.filter(Q(
-        data__lte=data_inicio,
-        data_desfiliacao__isnull=True) | Q(
-        data__lte=data_inicio,
-        data_desfiliacao__gte=data_inicio))
+def nova_versao():
+    return int(time.time() * 1000)
 
-    if data_fim:
-        filiacoes = filiacoes | filiacoes_parlamentar.filter(
-            data__gte=data_inicio,
-            data__lte=data_fim)
 
-    return ' | '.join([f.partido.sigla for f in filiacoes])
+def versao_compartilhada(chaves):
+    '''
+    Versão composta pelos contadores guardados no cache sob as chaves
+    informadas. Contadores ausentes do cache são inicializados com um valor
+    baseado no relógio, evitando que uma versão anterior se repita após a
+    limpeza do cache.
+    '''
+    versoes = cache.get_many(chaves)
+    for chave in chaves:
+        if chave not in versoes:
+            cache.add(chave, nova_versao(), None)
+            versoes[chave] = cache.get(chave)
+    return '.'.join(str(versoes[chave]) for chave in chaves)
+
+
+def incrementa_versao(chave):
+    try:
+        cache.incr(chave)
+    except ValueError:
+        cache.set(chave, nova_versao(), None)
+
+
+class CacheVersionado:
+    '''
+    Base para dados mantidos na memória de cada processo e invalidados
+    entre todos os workers através de uma versão guardada no cache
+    compartilhado.
+
+    Subclasses definem CHAVE_VERSAO e implementam carregar(). invalidar()
+    deve ser chamado por sinais sempre que os dados de origem mudarem; a
+    versão compartilhada é verificada no máximo uma vez a cada
+    INTERVALO_VERIFICACAO segundos.
+    '''
+    CHAVE_VERSAO = None
+    INTERVALO_VERIFICACAO = 1
+
+    def __init__(self):
+        self.versao = None
+        self.verificado_em = 0
+
+    def carregar(self):
+        raise NotImplementedError
+
+    def versao_verificada(self):
+        '''
+        Chamado sempre que a versão compartilhada é consultada.
+        '''
+        pass
+
+    def invalidar(self):
+        self.versao = None
+        incrementa_versao(self.CHAVE_VERSAO)
+
+    def atualizar(self):
+        '''
+        Recarrega os dados caso a versão compartilhada tenha mudado.
+
+        :return: True se os dados foram recarregados
+        '''
+        agora = time.time()
+        if self.versao is not None and \
+                agora - self.verificado_em < self.INTERVALO_VERIFICACAO:
+            return False
+        self.verificado_em = agora
+        self.versao_verificada()
+
+        versao = versao_compartilhada([self.CHAVE_VERSAO])
+        if versao == self.versao:
+            return False
+
+        self.carregar()
+        self.versao = versao
+        return True
+
+
+class IndiceFiliacoes(CacheVersionado):
+    '''
+    Índice em memória das filiações partidárias de todos os parlamentares.
+
+    É montado com uma única consulta e responde, sem acessar o banco, qual
+    o partido de um parlamentar em uma data ou em um intervalo de datas.
+    O índice é mantido atualizado por sinais de Filiacao e Partido.
+    '''
+    CHAVE_VERSAO = 'sapl_indice_filiacoes_versao'
+
+    def __init__(self):
+        super().__init__()
+        self.filiacoes = {}
+
+    def carregar(self):
+        from sapl.parlamentares.models import Filiacao
+
+        filiacoes = {}
+        for parlamentar_id, data, data_desfiliacao, sigla in \
+                Filiacao.objects.order_by().values_list(
+                    'parlamentar_id', 'data', 'data_desfiliacao',
+                    'partido__sigla'):
+            filiacoes.setdefault(parlamentar_id, []).append(
+                (data, data_desfiliacao, sigla))
+
+        # mesma ordenação de Filiacao: data e data de desfiliação
+        # decrescentes, com desfiliação vazia primeiro
+        for lista in filiacoes.values():
+            lista.sort(key=lambda f: (f[0], f[1] or datetime.date.max),
+                       reverse=True)
+
+        self.filiacoes = filiacoes
+
+    def partidos(self, parlamentar_id, data_inicio, data_fim=None):
+        '''
+        Siglas dos partidos do parlamentar em data_inicio ou, se data_fim
+        for informada, também das filiações iniciadas no intervalo.
+        '''
+        siglas = []
+        for data, data_desfiliacao, sigla in self.filiacoes.get(
+                parlamentar_id, ()):
+            if data <= data_inicio and (
+                    data_desfiliacao is None or
+                    data_desfiliacao >= data_inicio):
+                siglas.append(sigla)
+            elif data_fim and data_inicio <= data <= data_fim:
+                siglas.append(sigla)
+        return siglas
+
+    def siglas(self, parlamentares, data_inicio, data_fim=None):
+        '''
+        :param parlamentares: parlamentares ou ids de parlamentares
+        :return: dicionário id do parlamentar -> siglas dos partidos
+        '''
+        self.atualizar()
+        data_inicio = como_data(data_inicio)
+        data_fim = como_data(data_fim)
+
+        resultado = {}
+        for parlamentar in parlamentares:
+            parlamentar_id = getattr(parlamentar, 'pk', parlamentar)
+            siglas = self.partidos(parlamentar_id, data_inicio, data_fim)
+            if siglas:
+                resultado[parlamentar_id] = ' | '.join(siglas)
+        return resultado
+
+
+indice_filiacoes = IndiceFiliacoes()
+
+
+def filiacao_data(parlamentar, data_inicio, data_fim=None):
+    parlamentar_id = getattr(parlamentar, 'pk', parlamentar)
+    return indice_filiacoes.siglas(
+        [parlamentar_id], data_inicio, data_fim).get(parlamentar_id, '')
+
+
+def filiacoes_data(parlamentares, data_inicio, data_fim=None):
+    '''
+    Equivalente a filiacao_data para vários parlamentares de uma só vez.
+
+    :param parlamentares: parlamentares ou ids de parlamentares
+    :return: dicionário id do parlamentar -> siglas dos partidos
+    '''
+    return indice_filiacoes.siglas(parlamentares, data_inicio, data_fim)
 
 
 def parlamentares_ativos(data_inicio, data_fim=None):
@@ -878,6 +1059,100 @@ def get_mime_type_from_file_extension(filename):
     return mime
 
 
+TAMANHO_BLOCO_ARQUIVO = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def intervalo_requisitado(request, tamanho, last_modified):
+    '''
+    Intervalo (inicio, fim) pedido no cabeçalho Range, None quando o
+    arquivo deve ser enviado inteiro e False quando o intervalo não pode
+    ser atendido. Apenas um intervalo por requisição é suportado.
+    '''
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+    if not match or not any(match.groups()):
+        return None
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != last_modified:
+        return None
+
+    inicio, fim = match.groups()
+    if not inicio:
+        inicio, fim = max(tamanho - int(fim), 0), tamanho - 1
+    else:
+        inicio = int(inicio)
+        fim = min(int(fim), tamanho - 1) if fim else tamanho - 1
+
+    if inicio > fim:
+        return False
+    return inicio, fim
+
+
+def le_intervalo(caminho, inicio, tamanho):
+    with open(caminho, 'rb') as f:
+        f.seek(inicio)
+        while tamanho > 0:
+            bloco = f.read(min(TAMANHO_BLOCO_ARQUIVO, tamanho))
+            if not bloco:
+                break
+            tamanho -= len(bloco)
+            yield bloco
+
+
+def resposta_arquivo_protegido(request, arquivo, nome=None):
+    '''
+    Resposta para o download de um arquivo cujo acesso já foi autorizado
+    pela view. O arquivo é enviado em partes, com suporte a
+    If-Modified-Since e a Range, ou, quando SENDFILE_BACKEND está
+    configurado, repassado ao servidor web.
+    '''
+    nome = nome or arquivo.name.split('/')[-1]
+    mime = get_mime_type_from_file_extension(arquivo.name)
+    caminho = arquivo.path
+
+    backend = getattr(settings, 'SENDFILE_BACKEND', '')
+    if backend:
+        response = HttpResponse(content_type=mime)
+        if backend == 'nginx':
+            response['X-Accel-Redirect'] = \
+                settings.SENDFILE_URL.rstrip('/') + '/' + arquivo.name
+        else:
+            response['X-Sendfile'] = caminho
+        response['Content-Disposition'] = 'inline; filename="%s"' % nome
+        return response
+
+    stat = os.stat(caminho)
+    last_modified = http_date(stat.st_mtime)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+
+    intervalo = intervalo_requisitado(request, stat.st_size, last_modified)
+    if intervalo is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%s' % stat.st_size
+        return response
+
+    if intervalo is None:
+        response = FileResponse(open(caminho, 'rb'), content_type=mime)
+        response['Content-Length'] = stat.st_size
+    else:
+        inicio, fim = intervalo
+        response = StreamingHttpResponse(
+            le_intervalo(caminho, inicio, fim - inicio + 1),
+            status=206, content_type=mime)
+        response['Content-Length'] = fim - inicio + 1
+        response['Content-Range'] = 'bytes %s-%s/%s' % (
+            inicio, fim, stat.st_size)
+
+    response['Last-Modified'] = last_modified
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = 'inline; filename="%s"' % nome
+    return response
+
+
 def ExtraiTag(texto, posicao):
     for i in range(posicao, len(texto)):
         if (texto[i] == '>'):
@@ -39,6 +39,7 @@ create_env() {
     echo "USE_SOLR = ""${USE_SOLR-False}" >> $FILENAME
     echo "SOLR_COLLECTION = ""${SOLR_COLLECTION-sapl}" >> $FILENAME
     echo "SOLR_URL = ""${SOLR_URL-http://localhost:8983}" >> $FILENAME
+    echo "PAINEL_STREAM = ""${PAINEL_STREAM-False}" >> $FILENAME
 
     
     echo "[ENV FILE] done."
@@ -109,5 +110,24 @@ echo "| ███████║██║  ██║██║     ████
 echo "| ╚══════╝╚═╝  ╚═╝╚═╝     ╚══════╝  |"
 echo "-------------------------------------"
 
+# Processos em segundo plano, reiniciados caso sejam encerrados
+em_segundo_plano() {
+    while true; do
+        python3 manage.py "$@"
+        sleep 10
+    done >> /var/log/sapl/$1.log 2>&1 &
+}
+
+# Fila de e-mails (acompanhamento de matérias e documentos)
+em_segundo_plano envia_emails --intervalo 60
+
+# Lista de Inconsistências, exibida a partir da última verificação
+em_segundo_plano verifica_inconsistencias --intervalo 3600
+
+# Fila de indexação textual, alimentada pelo FilaSignalProcessor
+if [ "${USE_SOLR-False}" == "True" ] || [ "${USE_SOLR-False}" == "true" ]; then
+    em_segundo_plano atualiza_indice --intervalo 30
+fi
+
 /bin/sh gunicorn_start.sh no-venv &
 /usr/sbin/nginx -g "daemon off;"